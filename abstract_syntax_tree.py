@@ -1,25 +1,30 @@
+from typing import Iterator
+
 from tokens import Token
 
 class Statement:
+	__slots__ = ("token",)
+	# The attributes holding the nodes below this one, in source order
+	children: tuple[str, ...] = ()
 	def __init__(self, token: Token):
 		self.token = token
 
 class Block(Statement):
+	__slots__ = ("statements",)
+	children = ("statements",)
 	def __init__(self, token: Token, statements: list[Statement]):
 		super().__init__(token)
 		self.statements: list[Statement] = statements
 
 	def __str__(self) -> str:
-		block_string = "{\n"
-		for statement in self.statements:
-			block_string += f"\t{statement.__str__()}\n"
-		block_string += "}"
-		return block_string
+		return "{\n" + "".join(f"\t{statement}\n" for statement in self.statements) + "}"
 
 class Expression:
-	pass
+	__slots__ = ()
+	children: tuple[str, ...] = ()
 
 class Integer(Expression):
+	__slots__ = ("token", "value")
 	def __init__(self, token: Token, value: int):
 		self.token = token
 		self.value = value
@@ -27,6 +32,8 @@ class Integer(Expression):
 		return str(self.value)
 
 class Infix(Expression):
+	__slots__ = ("operator", "left", "right")
+	children = ("left", "right")
 	def __init__(self, operator: Token, left: Expression, right: Expression):
 		self.operator = operator
 		self.left = left
@@ -34,24 +41,67 @@ class Infix(Expression):
 	def __str__(self) -> str:
 		return f"({self.left} {self.operator.literal} {self.right})"
 
+class Prefix(Expression):
+	__slots__ = ("operator", "right")
+	children = ("right",)
+	def __init__(self, operator: Token, right: Expression):
+		self.operator = operator
+		self.right = right
+	def __str__(self) -> str:
+		return f"({self.operator.literal}{self.right})"
+
 class Identifier(Expression):
+	__slots__ = ("token", "name")
 	def __init__(self, token: Token, name: str):
 		self.token = token
 		self.name = name
 	def __str__(self) -> str:
 		return self.name
 
+class Index(Expression):
+	__slots__ = ("token", "ident", "index")
+	children = ("ident", "index")
+	def __init__(self, token: Token, ident: Identifier, index: Expression):
+		self.token = token
+		self.ident = ident
+		self.index = index
+	def __str__(self) -> str:
+		return f"{self.ident}[{self.index}]"
+
+def sprite_reference(ident: Identifier, frame: Expression | None) -> str:
+	return f"{ident}[{frame}]" if frame else ident.__str__()
+
 class Draw(Expression):
-	def __init__(self, token: Token, ident: Identifier, x: Expression, y: Expression):
+	__slots__ = ("token", "ident", "x", "y", "frame")
+	children = ("ident", "x", "y", "frame")
+	def __init__(self, token: Token, ident: Identifier, x: Expression, y: Expression, frame: Expression | None = None):
 		self.token = token
 		self.ident = ident
 		self.x = x
 		self.y = y
+		self.frame = frame
+
+	def __str__(self) -> str:
+		return f"draw({sprite_reference(self.ident, self.frame)}, {self.x}, {self.y})"
+
+class Move(Expression):
+	__slots__ = ("token", "ident", "old_x", "old_y", "new_x", "new_y", "frame")
+	children = ("ident", "old_x", "old_y", "new_x", "new_y", "frame")
+	def __init__(self, token: Token, ident: Identifier, old_x: Expression, old_y: Expression, new_x: Expression, new_y: Expression, frame: Expression | None = None):
+		self.token = token
+		self.ident = ident
+		self.old_x = old_x
+		self.old_y = old_y
+		self.new_x = new_x
+		self.new_y = new_y
+		self.frame = frame
 
 	def __str__(self) -> str:
-		return f"draw({self.ident}, {self.x}, {self.y})"
+		return f"move({sprite_reference(self.ident, self.frame)}, {self.old_x}, {self.old_y}, {self.new_x}, {self.new_y})"
 
 class DrawNum(Expression):
+	__slots__ = ("token", "number", "x", "y")
+	children = ("number", "x", "y")
 	def __init__(self, token: Token, number: Expression, x: Expression, y: Expression):
 		self.token = token
 		self.number = number
@@ -62,6 +112,8 @@ class DrawNum(Expression):
 		return f"draw_num({self.number}, {self.x}, {self.y})"
 
 class DrawChar(Expression):
+	__slots__ = ("token", "char", "x", "y")
+	children = ("char", "x", "y")
 	def __init__(self, token: Token, char: Expression, x: Expression, y: Expression):
 		self.token = token
 		self.char = char
@@ -72,6 +124,8 @@ class DrawChar(Expression):
 		return f"draw_char({self.char}, {self.x}, {self.y})"
 
 class Pressed(Expression):
+	__slots__ = ("token", "expression")
+	children = ("expression",)
 	def __init__(self, token: Token, expression: Expression):
 		self.token = token
 		self.expression = expression
@@ -79,6 +133,8 @@ class Pressed(Expression):
 		return f"pressed({self.expression})"
 
 class NotPressed(Expression):
+	__slots__ = ("token", "expression")
+	children = ("expression",)
 	def __init__(self, token: Token, expression: Expression):
 		self.token = token
 		self.expression = expression
@@ -86,12 +142,24 @@ class NotPressed(Expression):
 		return f"not_pressed({self.expression})"
 
 class UntilPressed(Expression):
+	__slots__ = ("token",)
 	def __init__(self, token: Token):
 		self.token = token
 	def __str__(self) -> str:
 		return f"until_pressed({self.expression})"
 
+class Wait(Expression):
+	__slots__ = ("token", "expression")
+	children = ("expression",)
+	def __init__(self, token: Token, expression: Expression):
+		self.token = token
+		self.expression = expression
+	def __str__(self) -> str:
+		return f"wait({self.expression})"
+
 class If(Statement):
+	__slots__ = ("condition", "consequence", "alternative")
+	children = ("condition", "consequence", "alternative")
 	def __init__(self, token: Token, condition: Expression, consequence: Block, alternative: Block | None = None):
 		self.token = token
 		self.condition = condition
@@ -101,6 +169,8 @@ class If(Statement):
 		return f"if ({self.condition}) {self.consequence}{" else " + self.alternative.__str__() if self.alternative else ""}"
 
 class While(Statement):
+	__slots__ = ("condition", "block")
+	children = ("condition", "block")
 	def __init__(self, token: Token, condition: Expression, block: Block):
 		self.token = token
 		self.condition = condition
@@ -108,7 +178,41 @@ class While(Statement):
 	def __str__(self) -> str:
 		return f"while ({self.condition}) {self.block}"
 
+class Case(Statement):
+	__slots__ = ("value", "block")
+	children = ("value", "block")
+	def __init__(self, token: Token, value: Integer, block: Block):
+		self.token = token
+		self.value = value
+		self.block = block
+	def __str__(self) -> str:
+		return f"case {self.value}: {self.block}"
+
+class Switch(Statement):
+	__slots__ = ("value", "cases", "default")
+	children = ("value", "cases", "default")
+	def __init__(self, token: Token, value: Expression, cases: list[Case], default: Block | None = None):
+		self.token = token
+		self.value = value
+		self.cases = cases
+		self.default = default
+	def __str__(self) -> str:
+		cases = " ".join(str(case) for case in self.cases)
+		default = f" default: {self.default}" if self.default else ""
+		return f"switch ({self.value}) {{ {cases}{default} }}"
+
+class Frame(Statement):
+	__slots__ = ("block",)
+	children = ("block",)
+	def __init__(self, token: Token, block: Block):
+		self.token = token
+		self.block = block
+	def __str__(self) -> str:
+		return f"frame {self.block}"
+
 class ExpressionStatement(Statement):
+	__slots__ = ("expression",)
+	children = ("expression",)
 	def __init__(self, token: Token, expression: Expression):
 		super().__init__(token)
 		self.expression = expression
@@ -118,26 +222,42 @@ class ExpressionStatement(Statement):
 
 
 class Clear(Statement):
+	__slots__ = ()
 	def __init__(self, token: Token):
 		super().__init__(token)
 
 	def __str__(self) -> str:
 		return "clear;"
 
+class Scroll(Statement):
+	__slots__ = ("direction", "amount")
+	children = ("amount",)
+	def __init__(self, token: Token, direction: str, amount: Integer | None = None):
+		super().__init__(token)
+		self.direction = direction
+		self.amount = amount
+
+	def __str__(self) -> str:
+		if self.amount:
+			return f"scroll({self.direction}, {self.amount});"
+		return f"scroll({self.direction});"
+
 class SpriteDeclaration(Statement):
-	def __init__(self, token: Token, ident: Identifier, rows: list[Integer]):
+	__slots__ = ("ident", "rows", "frames")
+	children = ("ident", "frames", "rows")
+	def __init__(self, token: Token, ident: Identifier, rows: list[Integer], frames: Integer | None = None):
 		super().__init__(token)
 		self.ident = ident
 		self.rows = rows
+		self.frames = frames
 
 	def __str__(self) -> str:
-		rows = "{ "
-		for row in self.rows:
-			rows += f"{row.__str__()}, "
-		rows = f"{rows[:-2]} }}"
-		return f"{self.token.literal} {self.ident.name} = {rows};"
+		rows = f"{{ {", ".join(str(row) for row in self.rows)} }}"
+		return f"{self.token.literal} {sprite_reference(self.ident, self.frames)} = {rows};"
 
 class IntegerDeclaration(Statement):
+	__slots__ = ("ident", "expression")
+	children = ("ident", "expression")
 	def __init__(self, token: Token, ident: Identifier, expression: Expression):
 		super().__init__(token)
 		self.ident = ident
@@ -145,3 +265,48 @@ class IntegerDeclaration(Statement):
 
 	def __str__(self) -> str:
 		return f"{self.token.literal} {self.ident.name} = {self.expression};"
+
+class ArrayDeclaration(Statement):
+	__slots__ = ("ident", "values")
+	children = ("ident", "values")
+	def __init__(self, token: Token, ident: Identifier, values: list[Integer]):
+		super().__init__(token)
+		self.ident = ident
+		self.values = values
+
+	def __str__(self) -> str:
+		values = ", ".join(value.__str__() for value in self.values)
+		return f"{self.token.literal} {self.ident.name} = {{ {values} }};"
+
+class ArrayAssignment(Statement):
+	__slots__ = ("target", "expression")
+	children = ("target", "expression")
+	def __init__(self, token: Token, target: Index, expression: Expression):
+		super().__init__(token)
+		self.target = target
+		self.expression = expression
+
+	def __str__(self) -> str:
+		return f"{self.token.literal} {self.target} = {self.expression};"
+
+class Import(Statement):
+	__slots__ = ("path",)
+	def __init__(self, token: Token, path: str):
+		super().__init__(token)
+		self.path = path
+
+	def __str__(self) -> str:
+		return f"{self.token.literal} \"{self.path}\";"
+
+def walk(node: Statement | Expression) -> Iterator[Statement | Expression]:
+	# Yields the node and every node below it, parents before their children
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		yield node
+		for name in reversed(node.children):
+			child = getattr(node, name)
+			if isinstance(child, list):
+				stack += reversed(child)
+			elif child is not None:
+				stack.append(child)
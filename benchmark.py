@@ -0,0 +1,188 @@
+import argparse
+import gc
+import math
+import random
+import sys
+import tracemalloc
+
+from pipeline import Pipeline
+
+# Statements in the programs compiled at every size
+SIZES = (250, 500, 1_000, 2_000)
+# The largest exponent of the fitted curve that still counts as linear
+LIMIT = 1.2
+# Each size is timed this many times and the fastest run is kept
+REPEATS = 3
+# Phases shorter than this at the largest size are too noisy to fit
+NOISE = 0.005
+
+# Programs keep reading and writing this many variables, so a statement
+# never needs more registers than the expressions in it
+VARIABLES = 8
+OPERATORS = ("+", "-", "==", "!=")
+
+class Shape:
+	"""
+	What the statements of a synthetic program look like: how deeply they are
+	nested in ifs and whiles, how deep their expressions are and how many
+	statements there are per sprite declared. Sprites are only declared when
+	sprite_every isn't zero, and every sprite is drawn.
+	"""
+	def __init__(self, name: str, nesting: int = 0, expression_depth: int = 1, sprite_every: int = 0):
+		self.name = name
+		self.nesting = nesting
+		self.expression_depth = expression_depth
+		self.sprite_every = sprite_every
+
+SHAPES = {shape.name: shape for shape in (
+	Shape("flat"),
+	Shape("nested", nesting=8),
+	Shape("expressions", expression_depth=5),
+	Shape("sprites", sprite_every=4),
+)}
+
+def letters(number: int) -> str:
+	# Identifiers can't contain digits
+	name = ""
+	while True:
+		number, digit = divmod(number, 26)
+		name = chr(ord("a") + digit) + name
+		if not number:
+			return name
+
+def synthetic(statements: int, shape: Shape, seed: int = 0) -> str:
+	generator = random.Random(seed)
+	variables = [f"v_{letters(number)}" for number in range(VARIABLES)]
+
+	def expression(depth: int) -> str:
+		if not depth:
+			return generator.choice(variables + [str(generator.randrange(256))])
+		return f"({expression(depth - 1)} {generator.choice(OPERATORS)} {expression(depth - 1)})"
+
+	lines = [f"var {name} = {number};" for number, name in enumerate(variables)]
+	sprites = []
+	indent = 0
+	for number in range(statements):
+		# Every group of statements is wrapped in ifs and whiles as deep as the
+		# nesting, and the group closes them again before the next one opens
+		if shape.nesting and number % (shape.nesting + 1) == 0:
+			lines += ["\t" * (indent - depth - 1) + "}" for depth in range(indent)]
+			indent = 0
+			for depth in range(shape.nesting):
+				keyword = "while" if depth % 2 else "if"
+				lines.append("\t" * depth + f"{keyword} ({generator.choice(variables)} != {depth}) {{")
+			indent = shape.nesting
+		prefix = "\t" * indent
+		if shape.sprite_every and number % shape.sprite_every == 0:
+			# Different rows, so no sprite is contained in another one
+			name = f"s_{letters(len(sprites))}"
+			rows = [len(sprites) & 0xFF, len(sprites) >> 8 | 0x80, generator.randrange(256), generator.randrange(256)]
+			lines.append(prefix + f"sprite {name} = {{ {", ".join(map(str, rows))} }};")
+			sprites.append(name)
+			lines.append(prefix + f"draw({name}, {generator.choice(variables)}, {generator.choice(variables)});")
+		else:
+			lines.append(prefix + f"var {generator.choice(variables)} = {expression(shape.expression_depth)};")
+	lines += ["\t" * (indent - depth - 1) + "}" for depth in range(indent)]
+	lines += [f"draw_num({name}, 0, 0);" for name in variables]
+	return "\n".join(lines) + "\n"
+
+def time_phases(code: str) -> dict[str, float]:
+	# Like timeit, collections that happen to start in one phase aren't
+	# counted against it
+	gc.collect()
+	gc.disable()
+	try:
+		pipeline = Pipeline(code)
+		pipeline.run(emit=False)
+	finally:
+		gc.enable()
+	return pipeline.timings
+
+def trace_phases(code: str) -> dict[str, int]:
+	# The peak memory of every phase, from a run of its own as tracing slows
+	# everything down
+	gc.collect()
+	tracemalloc.start()
+	try:
+		pipeline = Pipeline(code)
+		pipeline.run(emit=False)
+	finally:
+		tracemalloc.stop()
+	return pipeline.peaks
+
+def exponent(sizes: list[int], values: list[float]) -> float:
+	# Slope of the least squares line through the points on a log-log scale,
+	# so a value growing like size ** k gives k
+	xs = [math.log(size) for size in sizes]
+	ys = [math.log(max(value, 1e-9)) for value in values]
+	mean_x = sum(xs) / len(xs)
+	mean_y = sum(ys) / len(ys)
+	return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+class Result:
+	"""The timings and peaks of one shape at every size with their fits."""
+	def __init__(self, shape: Shape, sizes: list[int], repeats: int = REPEATS):
+		self.shape = shape
+		self.sizes = sizes
+		programs = [synthetic(size, shape) for size in sizes]
+		# The fastest time of every phase. Every round times each size once,
+		# so a slow spell of the machine doesn't skew the fit towards one size
+		self.timings: list[dict[str, float]] = [{} for _ in sizes]
+		for _ in range(repeats):
+			for timings, code in zip(self.timings, programs):
+				for phase, seconds in time_phases(code).items():
+					timings[phase] = min(seconds, timings.get(phase, seconds))
+		self.peaks = [trace_phases(code) for code in programs]
+		self.phases = list(self.timings[0])
+
+	def time_exponent(self, phase: str) -> float | None:
+		# None when the phase is too short to tell noise from growth
+		if self.timings[-1][phase] < NOISE:
+			return None
+		return exponent(self.sizes, [timings[phase] for timings in self.timings])
+
+	def memory_exponent(self, phase: str) -> float:
+		return exponent(self.sizes, [peaks[phase] for peaks in self.peaks])
+
+	def failures(self, limit: float) -> list[str]:
+		failures = []
+		for phase in self.phases:
+			time = self.time_exponent(phase)
+			if time is not None and time > limit:
+				failures.append(f"{self.shape.name}: {phase} takes time growing like n^{time:.2f}")
+			if self.memory_exponent(phase) > limit:
+				failures.append(f"{self.shape.name}: {phase} takes memory growing like n^{self.memory_exponent(phase):.2f}")
+		return failures
+
+	def report(self) -> list[str]:
+		lines = [f"{self.shape.name}: nesting {self.shape.nesting}, expression depth {self.shape.expression_depth}, a sprite every {self.shape.sprite_every or "-"} statements"]
+		lines.append(f"  {"phase":<10}" + "".join(f"{size:>20}" for size in self.sizes) + f"{"time":>8}{"memory":>8}")
+		for phase in self.phases:
+			cells = "".join(f"{timings[phase] * 1000:>10.1f} ms {peaks[phase] / 1e6:>5.1f} MB" for timings, peaks in zip(self.timings, self.peaks))
+			time = self.time_exponent(phase)
+			lines.append(f"  {phase:<10}{cells}{f"n^{time:.2f}" if time is not None else "-":>8}{f"n^{self.memory_exponent(phase):.2f}":>8}")
+		return lines
+
+def main():
+	arguments = argparse.ArgumentParser(description="Compile synthetic programs of growing size and check that every phase of the compiler scales linearly.")
+	arguments.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="how many statements the programs have")
+	arguments.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES), help="which kinds of programs to compile")
+	arguments.add_argument("--repeats", type=int, default=REPEATS, help="how many times each program is timed")
+	arguments.add_argument("--limit", type=float, default=LIMIT, help="the largest exponent of a fitted curve that passes")
+	options = arguments.parse_args()
+	if len(options.sizes) < 2:
+		arguments.error("at least two sizes are needed to fit a curve")
+
+	failures = []
+	for name in options.shapes:
+		result = Result(SHAPES[name], sorted(options.sizes), options.repeats)
+		for line in result.report():
+			print(line)
+		failures += result.failures(options.limit)
+	for failure in failures:
+		print(f"Not linear: {failure}")
+	if failures:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+import bisect
+import sys
+from array import array
+from typing import Iterator
+
+# A jump to itself, which is how programs halt
+HALT = 0x1000
+
+class CodeBuffer:
+	"""
+	Machine code as one 16-bit word per instruction. Addresses that are only
+	known once the code is placed are left as zero in their word and kept in
+	a separate relocation table of the positions of the words, in order, and
+	what they refer to: ["jump", offset] for jumps and calls to the instruction
+	offset instructions away, ["data", offset] and ["symbol", name, offset]
+	for ANNN loads of the data.
+	"""
+	def __init__(self, words: array | None = None, relocations: list[tuple[int, list]] = []):
+		self.words = words if words is not None else array("H")
+		self.positions = array("I", [position for position, _ in relocations])
+		self.relocations: list[list] = [relocation for _, relocation in relocations]
+
+	def __len__(self) -> int:
+		return len(self.words)
+
+	def emit(self, word: int, relocation: list | None = None):
+		if relocation is not None:
+			self.positions.append(len(self.words))
+			self.relocations.append(relocation)
+		self.words.append(word)
+
+	def relocated(self) -> Iterator[tuple[int, list]]:
+		return zip(self.positions, self.relocations)
+
+	def address(self, op: int, nnn: int, relocation: list | None = None):
+		# 0NNN, 1NNN, 2NNN, ANNN and BNNN
+		self.emit(op << 12 | nnn & 0xFFF, relocation)
+
+	def byte(self, op: int, x: int, kk: int):
+		# 3XKK, 4XKK, 6XKK, 7XKK, CXKK, EXKK and FXKK
+		self.emit(op << 12 | x << 8 | kk & 0xFF)
+
+	def nibbles(self, op: int, x: int, y: int, n: int):
+		# 5XYN, 8XYN, 9XY0 and DXYN
+		self.emit(op << 12 | x << 8 | y << 4 | n)
+
+	def jump(self, op: int, offset: int):
+		self.address(op, 0, ["jump", offset])
+
+	def halt(self):
+		self.jump(0x1, 0)
+
+	def ends_in_halt(self) -> bool:
+		last = len(self.words) - 1
+		return last >= 0 and self.words[last] == HALT and self.positions[-1:] == array("I", [last]) and self.relocations[-1] == ["jump", 0]
+
+	def extend(self, other: "CodeBuffer", end: int | None = None):
+		# Appends the words of other up to end, with their relocations
+		end = len(other) if end is None else end
+		start = len(self.words)
+		count = bisect.bisect_left(other.positions, end)
+		self.words += other.words[:end]
+		self.positions += array("I", [start + position for position in other.positions[:count]])
+		self.relocations += other.relocations[:count]
+
+	def tobytes(self) -> bytes:
+		# CHIP-8 is big-endian, so the words are written all at once in that order
+		if sys.byteorder == "big":
+			return self.words.tobytes()
+		words = array("H", self.words)
+		words.byteswap()
+		return words.tobytes()
+
+	@staticmethod
+	def frombytes(data: bytes, relocations: list[tuple[int, list]] = []) -> "CodeBuffer":
+		words = array("H", data)
+		if sys.byteorder == "little":
+			words.byteswap()
+		return CodeBuffer(words, relocations)
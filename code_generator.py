@@ -1,8 +1,11 @@
-from abstract_syntax_tree import Integer, Identifier, Infix, Expression, If, While, Clear, Draw, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, Block, Statement, DrawNum, DrawChar, Pressed, UntilPressed, NotPressed
-from tokens import TokenType
+from abstract_syntax_tree import Statement
+from ir import Register, Operation, Const, Load, LoadIndexed, Store, StoreIndexed, Binary, KeyTest, WaitKey, DrawSprite, DrawDigits, DrawCharacter, SetTimer, WaitTimer, ClearScreen, ScrollScreen, Label, Jump, BranchIfZero, BranchIfNonZero, BranchIfEqual, BranchIfLess, JumpTable, dump
+from ir_passes import optimize, allocate_registers, ALLOCATABLE, RegisterAllocationException
+from lowering import Lowering
+from execution_profile import Profile
+from targets import Target, CHIP8
 
 from semantic_analyzer import SemanticAnalyzer
-import semantic_analyzer
 
 class CodeGeneratorException(Exception):
 	pass
@@ -13,6 +16,13 @@ INSTRUCTION_LENGTH = 2
 WORD_SIZE = 1
 START = 0x200
 
+# The delay timer counts down at 60 Hz. Running about 600 instructions a
+# second makes it tick once every ten instructions
+CYCLES_PER_TICK = 10
+
+# Low bytes of 00CN, 00DN, 00FC and 00FB
+SCROLLS = {"down": 0xC0, "up": 0xD0, "left": 0xFC, "right": 0xFB}
+
 V0 = 0x0
 V1 = 0x1
 V2 = 0x2
@@ -31,6 +41,7 @@ VE = 0xE
 VF = 0xF
 
 class Instruction:
+	__slots__ = ("op", "x", "y", "n", "kk", "nnn", "target", "table", "line", "call", "node", "repeats")
 	def __init__(self, op: int, x = 0, y = 0, n = 0, kk: int | None = None, nnn: int | None = None):
 		self.op = op
 		self.x = x
@@ -38,320 +49,407 @@ class Instruction:
 		self.n = n
 		self.kk = kk
 		self.nnn = nnn
+		# Set by link_jumps for 1NNN, 2NNN and BNNN
+		self.target: Instruction | None = None
+		# Part of a jump table, which has to stay as it was generated
+		self.table = False
+		# Source line of the statement the instruction was generated for
+		self.line: int | None = None
+		# Builtin call the instruction was generated for
+		self.call: str | None = None
+		# Kind of syntax tree node the instruction was generated for
+		self.node: str | None = None
+		# At most how many times a backward jump is taken, when that is known
+		self.repeats: int | None = None
+
+	def word(self) -> int:
+		# Zero is a valid operand, so the format is told by which fields are set.
+		# Relative jumps may be negative and wrap around in their twelve bits
+		if self.nnn is not None:
+			return self.op << 12 | self.nnn & 0xFFF
+		if self.kk is not None:
+			return self.op << 12 | self.x << 8 | self.kk & 0xFF
+		return self.op << 12 | self.x << 8 | self.y << 4 | self.n
 
 	def as_byte_instruction(self) -> bytes:
-		instruction = self.op<<4
-		if self.nnn:
-			instruction = instruction<<8 | self.nnn
-		else:
-			if self.kk:
-				instruction = (instruction | self.x)<<4
-				instruction = instruction<<4 | self.kk
-			else:
-				instruction = (instruction | self.x)<<4
-				instruction = (instruction | self.y)<<4
-				instruction = (instruction | self.n)
-		return instruction.to_bytes(length=INSTRUCTION_LENGTH)
+		return self.word().to_bytes(length=INSTRUCTION_LENGTH)
 
 	def __str__(self) -> str:
 		return self.as_byte_instruction().hex()
 
-# class LoadInstruction(Instruction):
-# 	def __init__(self, name: str, nnn: int = 0):
-# 		super().__init__(op=0xA, nnn=nnn)
-# 		self.name = name
+# Loads the address of a symbol into I. The address is only known once
+# the data has been laid out, so it is filled in by write_file
+class LoadInstruction(Instruction):
+	__slots__ = ("name", "offset")
+	def __init__(self, name: str, offset: int = 0):
+		super().__init__(op=0xA, nnn=0)
+		self.name = name
+		self.offset = offset
+
+def link_jumps(instructions: list[Instruction]):
+	# Jumps are relative to their own position. Linking them to the instruction
+	# they land on lets passes add and remove instructions freely, after which
+	# relocate_jumps turns the targets back into offsets
+	for position, instruction in enumerate(instructions):
+		if instruction.op in (0x1, 0x2, 0xB):
+			instruction.target = instructions[position + instruction.nnn // INSTRUCTION_LENGTH]
+
+def relocate_jumps(instructions: list[Instruction]):
+	positions = {id(instruction): position for position, instruction in enumerate(instructions)}
+	for position, instruction in enumerate(instructions):
+		if instruction.op in (0x1, 0x2, 0xB):
+			instruction.nnn = INSTRUCTION_LENGTH * (positions[id(instruction.target)] - position)
+
+def pack_sprites(sprites: dict[str, bytes]) -> tuple[bytes, dict[str, int]]:
+	# Greedy shortest common superstring: sprites that are contained in another
+	# sprite are dropped and then sprites are chained by their overlaps, the
+	# largest overlaps first. Every sprite overlaps at most one sprite on either
+	# side and no chain may close a cycle
+	strings: list[bytes] = []
+	contained: set[bytes] = set()
+	for data in sorted(dict.fromkeys(sprites.values()), key=len, reverse=True):
+		if data not in contained:
+			strings.append(data)
+			contained.update(data[start:end] for start in range(len(data)) for end in range(start + 1, len(data) + 1))
+
+	following: dict[int, tuple[int, int]] = {}
+	preceded = set()
+	# The first sprite of the chain ending in a sprite and the last one of the
+	# chain starting in it, kept up to date at the ends only
+	first: dict[int, int] = {}
+	last: dict[int, int] = {}
+	for length in range(max(map(len, strings), default=1) - 1, 0, -1):
+		heads: dict[bytes, list[int]] = {}
+		for index in reversed(range(len(strings))):
+			if len(strings[index]) > length and index not in preceded:
+				heads.setdefault(strings[index][:length], []).append(index)
+		for index, string in enumerate(strings):
+			if len(string) <= length or index in following:
+				continue
+			candidates = heads.get(string[-length:], [])
+			head = first.get(index, index)
+			skipped = []
+			while candidates:
+				candidate = candidates.pop()
+				if candidate in preceded:
+					continue
+				if candidate == head:
+					skipped.append(candidate)
+					continue
+				tail = last.get(candidate, candidate)
+				following[index] = (candidate, length)
+				preceded.add(candidate)
+				first[tail] = head
+				last[head] = tail
+				break
+			candidates += skipped
+
+	chains = []
+	for index in range(len(strings)):
+		if index in preceded:
+			continue
+		chains.append(strings[index])
+		while index in following:
+			index, length = following[index]
+			chains.append(strings[index][length:])
+	packed = b''.join(chains)
+
+	# The first place every sprite is found at
+	offsets: dict[bytes, int] = {}
+	for length in {len(data) for data in sprites.values()}:
+		for position in range(len(packed) - length + 1):
+			offsets.setdefault(packed[position:position + length], position)
+	return packed, {name: offsets[data] for name, data in sprites.items()}
+
+def builtin(operation: Operation) -> str | None:
+	# The name of the builtin an operation was lowered from
+	match operation:
+		case DrawSprite():
+			return "move" if len(operation.positions) == 2 else "draw"
+		case DrawDigits():
+			return "draw_num"
+		case DrawCharacter():
+			return "draw_char"
+		case KeyTest():
+			return "pressed" if operation.pressed else "not_pressed"
+		case WaitKey():
+			return "until_pressed"
+		case SetTimer() | WaitTimer():
+			return "wait"
+		case ScrollScreen():
+			return "scroll"
+	return None
 
 class CodeGenerator:
-
-	def __init__(self, semantic: SemanticAnalyzer):
-		self.registers = [True] * REGISTERS
-
-		# Register V0 is used to load variables from memory and VF is used by certain instructions for various stuff
-		# This is why they are set as reserved here
-		self.registers[V0] = False
-		self.registers[VF] = False
-
+	"""
+	Compiles a program in stages: the syntax tree is lowered to IR, the IR
+	is optimized and given registers and finally each IR operation is turned
+	into CHIP-8 instructions. At level "0" the IR is used as lowered.
+	Instructions the target adds to CHIP-8 are used where they are shorter.
+	"""
+	def __init__(self, semantic: SemanticAnalyzer, profile: Profile | None = None, level: str = "2", target: Target = CHIP8):
 		self.semantic = semantic
-
-		self.sprites: dict[str, bytes] = {}
+		self.level = level
+		self.target = target
+		self.lowering = Lowering(semantic, profile, optimize_size=level == "s")
+		# Variables kept in a register of their own instead of memory
+		self.promoted: dict[str, int] = {}
+		# Variables given back to memory because the registers ran out
+		self.demoted: list[str] = []
+		# The most registers taken at once on every source line
+		self.pressure: dict[int | None, int] = {}
+
+		self.sprites: dict[str, bytes] = self.lowering.sprites
+		self.arrays: dict[str, bytes] = self.lowering.arrays
 		self.main: list[Instruction] = []
 
-		# This op makes sure that a window is spawned when initializing the emulator
-		self.main.append(Instruction(op=0x0, nnn=0x0E0))
-
-
-	def allocate_register(self) -> int:
-		for i in range(REGISTERS):
-			if self.registers[i]:
-				self.registers[i] = False
-				return i
-		raise CodeGeneratorException("No available registers")
+	def generate_program(self, program: list[Statement], dump_ir: bool = False):
+		# With the whole program at hand the IR passes see every statement
+		self.generate_operations(self.lowering.lower_program(program), dump_ir)
+
+	def generate_statement(self, statement: Statement, dump_ir: bool = False):
+		# Single-pass builds compile each top-level statement as soon as it
+		# arrives, so values aren't reused from one statement to the next
+		self.generate_operations(self.lowering.lower_program([statement]), dump_ir)
+
+	def promote(self, names: list[str]):
+		# Registers are taken from the top, hottest variable first. Only
+		# possible before any code has been generated
+		self.promoted = {name: ALLOCATABLE[-1 - position] for position, name in enumerate(names)}
+
+	def generate_operations(self, operations: list[Operation], dump_ir: bool = False):
+		if self.level != "0":
+			operations = optimize(operations)
+		while True:
+			try:
+				pressure = allocate_registers(operations, [register for register in ALLOCATABLE if register not in self.promoted.values()])
+				break
+			except RegisterAllocationException:
+				if not self.promoted or self.main:
+					raise
+				# The least used variable goes back to memory
+				self.demoted.append(self.promoted.popitem()[0])
+		for line, registers in pressure.items():
+			self.pressure[line] = max(self.pressure.get(line, 0), registers)
+		if not self.main:
+			# Promoted variables start at zero like the ones in memory
+			for register in self.promoted.values():
+				self.main.append(Instruction(op=0x6, x=register, kk=0))
+		if dump_ir:
+			print(dump(operations))
+		self.select_instructions(operations, self.main)
+
+	def generate_load(self, register: int, name: str, offset: int, index: int | None, block: list[Instruction]):
+		if name in self.promoted:
+			block.append(Instruction(op=0x8, x=register, y=self.promoted[name], n=0))
+			return
+		block.append(LoadInstruction(name, offset))
+		if index is not None:
+			block.append(Instruction(op=0xF, x=index, kk=0x1E))
+		if self.target.ranged_memory:
+			# 5XY3 loads the register directly instead of going through V0
+			block.append(Instruction(op=0x5, x=register, y=register, n=3))
+			return
+		block.append(Instruction(op=0xF, x=0, kk=0x65))
+		block.append(Instruction(op=0x8, x=register, y=0, n=0))
 
-	def free_register(self, register: int):
-		if register not in (V0, VF):
-			self.registers[register] = True
+	def generate_store(self, register: int, name: str, offset: int, index: int | None, block: list[Instruction]):
+		if name in self.promoted:
+			block.append(Instruction(op=0x8, x=self.promoted[name], y=register, n=0))
+			return
+		block.append(LoadInstruction(name, offset))
+		if index is not None:
+			block.append(Instruction(op=0xF, x=index, kk=0x1E))
+		if self.target.ranged_memory:
+			block.append(Instruction(op=0x5, x=register, y=register, n=2))
+			return
+		block.append(Instruction(op=0x8, x=0, y=register, n=0))
+		block.append(Instruction(op=0xF, x=0, kk=0x55))
 
-	def generate_integer(self, integer: Integer, block: list[Instruction]) -> int:
-		register = self.allocate_register()
-		block.append(Instruction(op=0x6, x=register, kk=integer.value))
-		return register
+	def generate_collision(self, dest: Register | None, block: list[Instruction]):
+		# Drawing reports collisions in VF, which the next addition would overwrite
+		if dest:
+			block.append(Instruction(op=0x8, x=dest.physical, y=VF, n=0))
 
-	def generate_identifier(self, identifier: Identifier, block: list[Instruction]) -> int:
-		register = self.allocate_register()
-		mem_location = self.semantic.get_symbol_location(identifier.name)
-		block.append(Instruction(op=0xA, nnn=mem_location))
-		block.append(Instruction(op=0xF, x=0, kk=0x65))
-		block.append(Instruction(op=0x8, x=register, y=0, n=0))
-		return register
-
-	def generate_draw(self, call: Draw, block: list[Instruction]) -> int:
-		name = call.ident.name
-		x = self.generate_expression(call.x, block)
-		y = self.generate_expression(call.y, block)
-		n = self.semantic.get_symbol_size(name)
-		mem_location = self.semantic.get_symbol_location(name)
-		block.append(Instruction(op=0xA, nnn=mem_location))
-		block.append(Instruction(op=0xD, x=x, y=y, n=n))
-		self.free_register(x)
-		self.free_register(y)
-		return VF
-
-	def generate_draw_num(self, call: DrawNum, block: list[Instruction]) -> int:
+	def generate_sprite_draws(self, draw: DrawSprite, block: list[Instruction]):
+		# I is loaded once and then shared by every draw of the sprite
+		sprite = self.semantic.symbols[draw.name]
+		if isinstance(draw.frame, int):
+			block.append(LoadInstruction(draw.name, draw.frame * sprite.stride))
+		else:
+			# The frames are stored back to back, so the address of the frame is
+			# reached by adding the frame index to I once per byte of a frame
+			block.append(LoadInstruction(draw.name))
+			for _ in range(sprite.stride):
+				block.append(Instruction(op=0xF, x=draw.frame.physical, kk=0x1E))
+		# DXY0 draws the 16 rows of a wide sprite
+		n = 0 if sprite.wide else sprite.height
+		for x, y in draw.positions:
+			block.append(Instruction(op=0xD, x=x.physical, y=y.physical, n=n))
+		self.generate_collision(draw.dest, block)
+
+	def generate_draw_num(self, draw: DrawDigits, block: list[Instruction]):
 		sprite_width = 4
 		sprite_height = 5
-		number = self.generate_expression(call.number, block)
+		x = draw.temps[0].physical
 		block.append(Instruction(op=0xA, nnn=0))
-		block.append(Instruction(op=0xF, x=number, kk=0x33))
-		self.free_register(number)
-		x = self.generate_expression(call.x, block)
-		y = self.generate_expression(call.y, block)
-		block.append(Instruction(op=0xF, x=0, kk=0x65))
-		block.append(Instruction(op=0xF, x=0, kk=0x29))
-		block.append(Instruction(op=0xD, x=x, y=y, n=sprite_height))
-		block.append(Instruction(op=0x7, x=x, kk=sprite_width + 1))
-		block.append(Instruction(op=0xA, nnn=1))
-		block.append(Instruction(op=0xF, x=0, kk=0x65))
-		block.append(Instruction(op=0xF, x=0, kk=0x29))
-		block.append(Instruction(op=0xD, x=x, y=y, n=sprite_height))
-		block.append(Instruction(op=0x7, x=x, kk=sprite_width + 1))
-		block.append(Instruction(op=0xA, nnn=2))
-		block.append(Instruction(op=0xF, x=0, kk=0x65))
-		block.append(Instruction(op=0xF, x=0, kk=0x29))
-		block.append(Instruction(op=0xD, x=x, y=y, n=sprite_height))
-		self.free_register(x)
-		self.free_register(y)
-		return VF
-
-	def generate_draw_char(self, call: DrawChar, block: list[Instruction]) -> int:
-		number = self.generate_expression(call.char, block)
-		block.append(Instruction(op=0xF, x=number, kk=0x29))
-		self.free_register(number)
-		x = self.generate_expression(call.x, block)
-		y = self.generate_expression(call.y, block)
-		block.append(Instruction(op=0xD, x=x, y=y, n=5))
-		self.free_register(x)
-		self.free_register(y)
-		return VF
-
-	def generate_infix(self, infix: Infix, block: list[Instruction]) -> int:
-
-		left_register = self.generate_expression(infix.left, block)
-		right_register = self.generate_expression(infix.right, block)
-
-		match infix.operator.type:
-			case TokenType.PLUS:
-				block.append(Instruction(op=0x8, x=left_register, y=right_register, n=4))
-			case TokenType.MINUS:
-				block.append(Instruction(op=0x8, x=left_register, y=right_register, n=5))
-			case TokenType.ASTERISK:
-				index_register = self.allocate_register()
-				result_register = self.allocate_register()
-
-				block.append(Instruction(op=0x6, x=index_register, kk=0))
-				block.append(Instruction(op=0x6, x=result_register, kk=0))
-
-				block.append(Instruction(op=0x9, x=left_register, y=index_register, n=0))
+		block.append(Instruction(op=0xF, x=draw.number.physical, kk=0x33))
+		if x != draw.x.physical:
+			block.append(Instruction(op=0x8, x=x, y=draw.x.physical, n=0))
+		for digit in range(3):
+			if digit:
+				block.append(Instruction(op=0x7, x=x, kk=sprite_width + 1))
+				block.append(Instruction(op=0xA, nnn=digit))
+			block.append(Instruction(op=0xF, x=0, kk=0x65))
+			block.append(Instruction(op=0xF, x=0, kk=0x29))
+			block.append(Instruction(op=0xD, x=x, y=draw.y.physical, n=sprite_height))
+		self.generate_collision(draw.dest, block)
+
+	def generate_draw_char(self, draw: DrawCharacter, block: list[Instruction]):
+		block.append(Instruction(op=0xF, x=draw.char.physical, kk=0x29))
+		block.append(Instruction(op=0xD, x=draw.x.physical, y=draw.y.physical, n=5))
+		self.generate_collision(draw.dest, block)
+
+	def generate_binary(self, binary: Binary, block: list[Instruction]):
+		dest = binary.dest.physical
+		left = binary.left.physical
+		right = binary.right.physical
+
+		match binary.operator:
+			case "+" | "-":
+				if dest != left:
+					block.append(Instruction(op=0x8, x=dest, y=left, n=0))
+				block.append(Instruction(op=0x8, x=dest, y=right, n=4 if binary.operator == "+" else 5))
+			case "*":
+				index = binary.temps[0].physical
+
+				block.append(Instruction(op=0x6, x=index, kk=0))
+				block.append(Instruction(op=0x6, x=dest, kk=0))
+
+				block.append(Instruction(op=0x9, x=left, y=index, n=0))
 				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 4))
-				block.append(Instruction(op=0x8, x=result_register, y=right_register, n=4))
-				block.append(Instruction(op=0x7, x=index_register, kk=1))
+				block.append(Instruction(op=0x8, x=dest, y=right, n=4))
+				block.append(Instruction(op=0x7, x=index, kk=1))
 				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * -4))
-
-				self.free_register(index_register)
-				self.free_register(left_register)
-				left_register = result_register
-			case TokenType.EQUALS:
-				block.append(Instruction(op=0x5, x=left_register, y=right_register, n=0))
-				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 3))
-				block.append(Instruction(op=0x6, x=left_register, kk=1))
-				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 2))
-				block.append(Instruction(op=0x6, x=left_register, kk=0))
-			case TokenType.NOT_EQUALS:
-				block.append(Instruction(op=0x5, x=left_register, y=right_register, n=0))
+				block[-1].repeats = 255
+			case "==" | "!=":
+				equal, different = (1, 0) if binary.operator == "==" else (0, 1)
+				block.append(Instruction(op=0x5, x=left, y=right, n=0))
 				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 3))
-				block.append(Instruction(op=0x6, x=left_register, kk=0))
+				block.append(Instruction(op=0x6, x=dest, kk=equal))
 				block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 2))
-				block.append(Instruction(op=0x6, x=left_register, kk=1))
+				block.append(Instruction(op=0x6, x=dest, kk=different))
 			case _:
-				raise CodeGeneratorException(f"Invalid operator '{infix.operator}'!")
+				raise CodeGeneratorException(f"Invalid operator '{binary.operator}'!")
 
-		self.free_register(right_register)
-
-		return left_register
-
-	def generate_pressed_call(self, pressed: Pressed, block: list[Instruction]) -> int:
-		register = self.generate_expression(pressed.expression, block)
-		block.append(Instruction(op=0xE, x=register, kk=0x9E))
+	def generate_key_test(self, test: KeyTest, block: list[Instruction]):
+		block.append(Instruction(op=0xE, x=test.code.physical, kk=0x9E if test.pressed else 0xA1))
 		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 3))
-		block.append(Instruction(op=0x6, x=register, kk=1))
+		block.append(Instruction(op=0x6, x=test.dest.physical, kk=1))
 		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 2))
-		block.append(Instruction(op=0x6, x=register, kk=0))
-		return register
-
-	def generate_not_pressed_call(self, not_pressed: NotPressed, block: list[Instruction]) -> int:
-		register = self.generate_expression(not_pressed.expression, block)
-		block.append(Instruction(op=0xE, x=register, kk=0xA1))
-		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 3))
-		block.append(Instruction(op=0x6, x=register, kk=1))
-		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * 2))
-		block.append(Instruction(op=0x6, x=register, kk=0))
-		return register
-
-	def generate_until_pressed_call(self, until_pressed: UntilPressed, block: list[Instruction]) -> int:
-		register = self.allocate_register()
-		block.append(Instruction(op=0xF, x=register, kk=0x0A))
-		return register
-
-	def generate_expression(self, expression: Expression, block: list[Instruction]) -> int:
-		match expression:
-			case Integer():
-				register = self.generate_integer(expression, block)
-			case Identifier():
-				register = self.generate_identifier(expression, block)
-			case Infix():
-				register = self.generate_infix(expression, block)
-			case Draw():
-				register = self.generate_draw(expression, block)
-			case DrawNum():
-				register = self.generate_draw_num(expression, block)
-			case DrawChar():
-				register = self.generate_draw_char(expression, block)
-			case Pressed():
-				register = self.generate_pressed_call(expression, block)
-			case NotPressed():
-				register = self.generate_not_pressed_call(expression, block)
-			case UntilPressed():
-				register = self.generate_until_pressed_call(expression, block)
-			case _:
-				raise CodeGeneratorException("Invalid expression type")
-		return register
-
-	def generate_integer_declaration(self, statement: IntegerDeclaration, block: list[Instruction]):
-		register_value = self.generate_expression(statement.expression, block)
-		mem_location = self.semantic.get_symbol_location(statement.ident.name)
-		block.append(Instruction(op=0xA, nnn=mem_location))
-		if register_value != 0:
-			block.append(Instruction(op=0x8, x=0, y=register_value, n=0))
-		block.append(Instruction(op=0xF, x=0, kk=0x55))
-		#self.sprites.append(b'\0')
-		self.free_register(register_value)
-
-	def generate_sprite_declaration(self, declaration: SpriteDeclaration):
-		self.sprites[declaration.ident.name] = b''
-		for row in declaration.rows:
-			self.sprites[declaration.ident.name] += row.value.to_bytes(WORD_SIZE)
-
-	def generate_draw_statement(self, statement: Draw, block: list[Instruction]):
-		name = statement.ident.name
-		x = self.generate_expression(statement.x, block)
-		y = self.generate_expression(statement.y, block)
-		n = self.semantic.get_symbol_size(name)
-		mem_location = self.semantic.get_symbol_location(name)
-		block.append(Instruction(op=0xA, nnn=mem_location))
-		block.append(Instruction(op=0xD, x=x, y=y, n=n))
-		self.free_register(x)
-		self.free_register(y)
-
-	def generate_clear_statement(self, statement: Clear, block: list[Instruction]):
-		block.append(Instruction(op=0x0, kk=0xE0))
-
-	def generate_if_statement(self, if_statement: If, block: list[Instruction]):
-		condition = self.generate_expression(if_statement.condition, block)
-		block.append(Instruction(op=4, x=condition, kk=0))
-		consequence = []
-		for statement in if_statement.consequence.statements:
-			self.generate_statement(statement, consequence)
-		alternative = []
-		if if_statement.alternative:
-			for statement in if_statement.alternative.statements:
-				self.generate_statement(statement, alternative)
-			consequence.append(Instruction(op=1, nnn=INSTRUCTION_LENGTH * (len(alternative) + 1)))
-		block.append(Instruction(op=1, nnn=INSTRUCTION_LENGTH * (len(consequence) + 1)))
-		block += consequence
-		block += alternative
-		self.free_register(condition)
-
-	def generate_while_statement(self, while_statement: While, block: list[Instruction]):
-		condition = []
-		register = self.generate_expression(while_statement.condition, condition)
-		block += condition
-		block.append(Instruction(op=4, x=register, kk=0))
-		consequence = []
-		for statement in while_statement.block.statements:
-			self.generate_statement(statement, consequence)
-		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * (len(consequence) + 2)))
-		block += consequence
-		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * -(len(consequence) + 2 + len(condition))))
-		
-	def generate_statement(self, statement: Statement, block: list[Instruction]):
-		match statement:
-			case ExpressionStatement():
-				register = self.generate_expression(statement.expression, block)
-				self.free_register(register)
-			case Clear():
-				self.generate_clear_statement(statement, block)
-			case If():
-				self.generate_if_statement(statement, block)
-			case While():
-				self.generate_while_statement(statement, block)
-			case IntegerDeclaration():
-				self.generate_integer_declaration(statement, block)
-			case SpriteDeclaration():
-				self.generate_sprite_declaration(statement)
+		block.append(Instruction(op=0x6, x=test.dest.physical, kk=0))
+
+	def generate_timer_wait(self, register: int, block: list[Instruction]):
+		# Spin on FX07 until the delay timer has run out
+		block.append(Instruction(op=0xF, x=register, kk=0x07))
+		block.append(Instruction(op=0x3, x=register, kk=0))
+		block.append(Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * -2))
+		# The timer starts at 255 at most and each round takes three instructions
+		block[-1].repeats = 255 * CYCLES_PER_TICK // 3
+
+	def generate_jump_table(self, table: JumpTable, block: list[Instruction], jumps: list[tuple[int, str]]):
+		# Indices past the end go to the default. Otherwise BNNN adds twice the
+		# index to the address of the first of the jumps that follow it
+		index = table.index.physical
+		block.append(Instruction(op=0x6, x=0x0, kk=len(table.labels)))
+		block.append(Instruction(op=0x8, x=0x0, y=index, n=0x7))
+		block.append(Instruction(op=0x3, x=0xF, kk=0))
+		jumps.append((len(block), table.default))
+		block.append(Instruction(op=0x1, nnn=0))
+		block.append(Instruction(op=0x8, x=0x0, y=index, n=0x0))
+		block.append(Instruction(op=0x8, x=0x0, y=0x0, n=0x4))
+		block.append(Instruction(op=0xB, nnn=INSTRUCTION_LENGTH))
+		block[-1].table = True
+		for label in table.labels:
+			jumps.append((len(block), label))
+			block.append(Instruction(op=0x1, nnn=0))
+			block[-1].table = True
+
+	def generate_operation(self, operation: Operation, block: list[Instruction], labels: dict[str, int], jumps: list[tuple[int, str]]):
+		match operation:
+			case Const():
+				block.append(Instruction(op=0x6, x=operation.dest.physical, kk=operation.value))
+			case Load():
+				self.generate_load(operation.dest.physical, operation.name, operation.offset, None, block)
+			case LoadIndexed():
+				self.generate_load(operation.dest.physical, operation.name, 0, operation.index.physical, block)
+			case Store():
+				self.generate_store(operation.source.physical, operation.name, operation.offset, None, block)
+			case StoreIndexed():
+				self.generate_store(operation.source.physical, operation.name, 0, operation.index.physical, block)
+			case Binary():
+				self.generate_binary(operation, block)
+			case KeyTest():
+				self.generate_key_test(operation, block)
+			case WaitKey():
+				block.append(Instruction(op=0xF, x=operation.dest.physical, kk=0x0A))
+			case DrawSprite():
+				self.generate_sprite_draws(operation, block)
+			case DrawDigits():
+				self.generate_draw_num(operation, block)
+			case DrawCharacter():
+				self.generate_draw_char(operation, block)
+			case SetTimer():
+				block.append(Instruction(op=0xF, x=operation.source.physical, kk=0x15))
+			case WaitTimer():
+				self.generate_timer_wait(operation.dest.physical, block)
+			case ClearScreen():
+				block.append(Instruction(op=0x0, kk=0xE0))
+			case ScrollScreen():
+				block.append(Instruction(op=0x0, kk=SCROLLS[operation.direction] | (operation.amount or 0)))
+			case Label():
+				labels[operation.name] = len(block)
+			case Jump():
+				jumps.append((len(block), operation.label))
+				block.append(Instruction(op=0x1, nnn=0))
+			case BranchIfZero() | BranchIfNonZero():
+				# The jump is skipped when the branch isn't taken
+				block.append(Instruction(op=0x4 if isinstance(operation, BranchIfZero) else 0x3, x=operation.condition.physical, kk=0))
+				jumps.append((len(block), operation.label))
+				block.append(Instruction(op=0x1, nnn=0))
+			case BranchIfEqual():
+				block.append(Instruction(op=0x4, x=operation.condition.physical, kk=operation.value))
+				jumps.append((len(block), operation.label))
+				block.append(Instruction(op=0x1, nnn=0))
+			case BranchIfLess():
+				# VF is cleared when subtracting the value borrows
+				block.append(Instruction(op=0x6, x=0x0, kk=operation.value))
+				block.append(Instruction(op=0x8, x=0x0, y=operation.condition.physical, n=0x7))
+				block.append(Instruction(op=0x4, x=0xF, kk=0))
+				jumps.append((len(block), operation.label))
+				block.append(Instruction(op=0x1, nnn=0))
+			case JumpTable():
+				self.generate_jump_table(operation, block, jumps)
 			case _:
-				raise CodeGeneratorException(f"Unrecognized statement {statement}!")
-
-	def write_file(self, filename: str):
-		with open(filename, "wb") as output:
-			pc = 0
-			size = 0
-			# This instruction here makes it so that the emulator doesn't
-			# spill over the main block and start interpreting the stack
-			# as instructions
-			self.main.append(Instruction(op=0x1, nnn=0))
-			main_length = len(self.main) * INSTRUCTION_LENGTH
-			for instruction in self.main:
-				match instruction.op:
-					case 0xA:
-						instruction.nnn = START + main_length + instruction.nnn
-					case 0x1:
-						instruction.nnn = START + pc + instruction.nnn
-				output.write(instruction.as_byte_instruction())
-				#print(f"{pc}: op={instruction.op} nnn={instruction.nnn - START if instruction.nnn else None}")
-				pc += INSTRUCTION_LENGTH
-				size += INSTRUCTION_LENGTH
-
-			# These are needed for draw_num
-			output.write(b'\0\0\0')
-
-			for name, type in self.semantic.symbols.items():
-				#print(name)
-				match type:
-					case semantic_analyzer.Integer():
-						output.write(b'\0')
-						#print("0")
-					case semantic_analyzer.Sprite():
-						output.write(self.sprites[name])
-						#print(self.sprites[name].hex())
-			
-
-			print(f"The program is {size} bytes large!")
+				raise CodeGeneratorException(f"Unrecognized operation {operation}!")
+
+	def select_instructions(self, operations: list[Operation], block: list[Instruction]):
+		labels: dict[str, int] = {}
+		jumps: list[tuple[int, str]] = []
+		for operation in operations:
+			start = len(block)
+			self.generate_operation(operation, block, labels, jumps)
+			call = builtin(operation)
+			for instruction in block[start:]:
+				instruction.line = operation.line
+				instruction.call = call
+				instruction.node = operation.node
+		# Jumps are relative to their own position
+		for position, label in jumps:
+			block[position].nnn = INSTRUCTION_LENGTH * (labels[label] - position)
+
+	def finish(self):
+		# This instruction here makes it so that the emulator doesn't
+		# spill over the main block and start interpreting the stack
+		# as instructions
+		self.main.append(Instruction(op=0x1, nnn=0))
@@ -0,0 +1,201 @@
+import bisect
+import itertools
+
+from code_generator import Instruction, link_jumps, relocate_jumps
+from peephole import skips
+from execution_profile import Profile
+
+# Static estimate of how many times more often the body of a loop runs
+LOOP_WEIGHT = 10
+
+class BasicBlock:
+	def __init__(self, start: int, instructions: list[Instruction]):
+		self.start = start
+		self.instructions = instructions
+		# How often the block runs, see ControlFlowGraph.estimate_weights
+		self.weight = 1
+		# The block that has to be placed right after this one, either because
+		# this block falls through to it, because one of its skips lands there
+		# or because both are part of the same jump table
+		self.fixed_next: BasicBlock | None = None
+
+	def jump(self) -> Instruction | None:
+		last = self.instructions[-1]
+		return last if last.op == 0x1 else None
+
+class ControlFlowGraph:
+	"""
+	Splits the instruction stream into basic blocks, threads jumps that land
+	on other jumps and lays the blocks out so that as many jumps as possible
+	become fall-throughs, preferring the hottest ones. How hot a block is
+	comes from the profile when there is one and from loop nesting otherwise.
+	"""
+	def __init__(self, instructions: list[Instruction], profile: Profile | None = None):
+		link_jumps(instructions)
+		self.threaded = 0
+		self.removed = 0
+		self.unreachable = 0
+		self.thread_jumps(instructions)
+		self.blocks = self.remove_unreachable(self.split(instructions))
+		if profile:
+			for block in self.blocks:
+				block.weight = max(profile.count(instruction.line) for instruction in block.instructions)
+		else:
+			self.estimate_weights()
+
+	def thread_jumps(self, instructions: list[Instruction]):
+		for instruction in instructions:
+			if instruction.op != 0x1:
+				continue
+			seen = {id(instruction)}
+			while instruction.target.op == 0x1 and id(instruction.target) not in seen and instruction.target.target is not instruction.target:
+				seen.add(id(instruction.target))
+				instruction.target = instruction.target.target
+				self.threaded += 1
+
+	def split(self, instructions: list[Instruction]) -> list[BasicBlock]:
+		targets = {id(instruction.target) for instruction in instructions if instruction.target}
+		leaders = {0}
+		for position, instruction in enumerate(instructions):
+			if id(instruction) in targets:
+				leaders.add(position)
+			if instruction.op == 0x1:
+				leaders.add(position + 1)
+			elif skips(instruction):
+				leaders.add(position + 2)
+		starts = sorted(leader for leader in leaders if leader < len(instructions))
+		ends = starts[1:] + [len(instructions)]
+		blocks = [BasicBlock(start, instructions[start:end]) for start, end in zip(starts, ends)]
+
+		def skipped(position: int) -> bool:
+			return position > 0 and skips(instructions[position - 1])
+
+		for block, following in zip(blocks, blocks[1:]):
+			last = block.start + len(block.instructions) - 1
+			if not block.jump() or skipped(last) or skipped(block.start) or block.instructions[-1].table and following.instructions[0].table:
+				block.fixed_next = following
+		return blocks
+
+	def remove_unreachable(self, blocks: list[BasicBlock]) -> list[BasicBlock]:
+		# Statements that can't run are already removed from the syntax tree, so
+		# this only drops jumps left behind by threading and the final halt
+		# after an infinite loop
+		block_at = {id(block.instructions[0]): block for block in blocks}
+		reachable = set()
+		pending = [blocks[0]]
+		while pending:
+			block = pending.pop()
+			if id(block) in reachable:
+				continue
+			reachable.add(id(block))
+			if block.fixed_next:
+				pending.append(block.fixed_next)
+			if block.jump():
+				pending.append(block_at[id(block.jump().target)])
+		for block in blocks:
+			if id(block) not in reachable:
+				self.unreachable += len(block.instructions)
+		return [block for block in blocks if id(block) in reachable]
+
+	def estimate_weights(self):
+		# Every backward jump closes a loop around the blocks between its
+		# target and itself
+		positions = {}
+		for block in self.blocks:
+			for offset, instruction in enumerate(block.instructions):
+				positions[id(instruction)] = block.start + offset
+		# Each loop adds one to the depth where its first block starts and
+		# takes it away again after its last one
+		starts = sorted(block.start for block in self.blocks)
+		changes = [0] * (len(starts) + 1)
+		for block in self.blocks:
+			for offset, instruction in enumerate(block.instructions):
+				target = positions[id(instruction.target)] if instruction.target else None
+				if target is not None and target <= block.start + offset:
+					changes[bisect.bisect_left(starts, target)] += 1
+					changes[bisect.bisect_right(starts, block.start + offset)] -= 1
+		depth = dict(zip(starts, itertools.accumulate(changes)))
+		for block in self.blocks:
+			block.weight = LOOP_WEIGHT ** depth[block.start]
+
+	def layout(self) -> list[BasicBlock]:
+		# Blocks tied together with fixed_next form chains that are never split
+		chains: dict[int, list[BasicBlock]] = {}
+		chain_of: dict[int, int] = {}
+		tied = {id(block.fixed_next) for block in self.blocks if block.fixed_next}
+		for block in self.blocks:
+			if id(block) in tied:
+				continue
+			chain = [block]
+			while chain[-1].fixed_next:
+				chain.append(chain[-1].fixed_next)
+			chains[block.start] = chain
+			for member in chain:
+				chain_of[id(member)] = block.start
+
+		heads = {id(chain[0].instructions[0]): start for start, chain in chains.items()}
+		entry = self.blocks[0].start
+
+		# Chains end in an unconditional jump, so the chain it lands on can be
+		# placed right after it. The hottest jumps get to pick first
+		edges = []
+		for start, chain in chains.items():
+			jump = chain[-1].jump()
+			if jump and id(jump.target) in heads and heads[id(jump.target)] not in (start, entry):
+				edges.append((chain[-1].weight, start, heads[id(jump.target)]))
+		edges.sort(key=lambda edge: -edge[0])
+
+		following: dict[int, int] = {}
+		preceded = set()
+		# The first chain of the run of linked chains ending in a chain and the
+		# last one of the run starting in it, kept up to date at the ends only
+		first: dict[int, int] = {}
+		last: dict[int, int] = {}
+		for _, source, target in edges:
+			if source in following or target in preceded:
+				continue
+			# Linking must not close a cycle of chains
+			head = first.get(source, source)
+			if head == target:
+				continue
+			tail = last.get(target, target)
+			following[source] = target
+			preceded.add(target)
+			first[tail] = head
+			last[head] = tail
+
+		order = []
+		for start in [entry] + sorted(start for start in chains if start != entry):
+			if start in preceded and start != entry:
+				continue
+			while True:
+				order += chains[start]
+				if start not in following:
+					break
+				start = following[start]
+		return order
+
+	def instructions(self) -> list[Instruction]:
+		instructions = [instruction for block in self.layout() for instruction in block.instructions]
+
+		# Jumps to the very next instruction are dropped and whatever jumped
+		# to them continues to the instruction after them instead
+		forward: dict[int, Instruction] = {}
+		optimized = []
+		for position, instruction in enumerate(instructions):
+			skipped = position > 0 and skips(instructions[position - 1])
+			following = instructions[position + 1] if position + 1 < len(instructions) else None
+			if instruction.op == 0x1 and instruction.target is following and not skipped and not instruction.table:
+				forward[id(instruction)] = following
+				self.removed += 1
+			else:
+				optimized.append(instruction)
+		for instruction in optimized:
+			if instruction.target:
+				while id(instruction.target) in forward:
+					instruction.target = forward[id(instruction.target)]
+		relocate_jumps(optimized)
+		return optimized
+
+	def report(self) -> str:
+		return f"Threaded {self.threaded} jumps, removed {self.removed} jumps with block layout and {self.unreachable} unreachable instructions"
@@ -0,0 +1,140 @@
+from abstract_syntax_tree import Statement, Expression, Block, Integer, Identifier, Draw, Move, DrawNum, DrawChar, UntilPressed, Wait, If, While, Switch, Frame, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, ArrayDeclaration, ArrayAssignment, walk
+from semantic_analyzer import SemanticAnalyzer
+
+# Expressions that do more than compute a value and must be kept even if
+# the value itself is never used
+SIDE_EFFECTS = (Draw, Move, DrawNum, DrawChar, UntilPressed, Wait)
+
+def has_side_effects(expression: Expression) -> bool:
+	return any(isinstance(node, SIDE_EFFECTS) for node in walk(expression))
+
+def read_names(expression: Expression) -> set[str]:
+	return {node.name for node in walk(expression) if isinstance(node, Identifier)}
+
+def inner_blocks(statement: Statement) -> list[Block]:
+	match statement:
+		case If():
+			return [block for block in (statement.consequence, statement.alternative) if block]
+		case While():
+			return [statement.block]
+		case Switch():
+			return [case.block for case in statement.cases] + ([statement.default] if statement.default else [])
+		case Frame():
+			return [statement.block]
+	return []
+
+def terminates(statement: Statement) -> bool:
+	match statement:
+		case While() if isinstance(statement.condition, Integer) and statement.condition.value:
+			return False
+		case If() if statement.alternative:
+			return all(map(terminates, statement.consequence.statements)) or all(map(terminates, statement.alternative.statements))
+		case Switch() if statement.default:
+			return any(all(map(terminates, block.statements)) for block in inner_blocks(statement))
+		case Frame():
+			return all(map(terminates, statement.block.statements))
+	return True
+
+class DeadCodeEliminator:
+	"""
+	Removes statements that can never run, branches on constant conditions and
+	stores to variables and arrays that are never read, together with their
+	storage. A warning is recorded for every removal.
+	"""
+	def __init__(self, semantic: SemanticAnalyzer, keep: set[str] = set()):
+		self.semantic = semantic
+		# Symbols that other modules may read
+		self.keep = keep
+		self.warnings: list[str] = []
+
+	def warn(self, message: str, statement: Statement):
+		self.warnings.append(f"Warning: {message} at {statement.token.line}:{statement.token.column}")
+
+	def run(self, program: list[Statement]) -> list[Statement]:
+		program = self.remove_unreachable(program)
+		while True:
+			reads = self.collect_reads(program)
+			dead = {name for name in self.semantic.symbols if name not in reads and name not in self.keep}
+			if not dead:
+				return program
+			program = self.remove_dead_stores(program, dead)
+			for name in dead:
+				self.semantic.remove_symbol(name)
+
+	def remove_unreachable(self, statements: list[Statement]) -> list[Statement]:
+		result = []
+		reachable = True
+		for statement in statements:
+			if not reachable:
+				self.warn("Unreachable statement removed", statement)
+				continue
+			match statement:
+				case If() if isinstance(statement.condition, Integer):
+					self.warn(f"Condition is always {"true" if statement.condition.value else "false"}", statement)
+					taken = statement.consequence if statement.condition.value else statement.alternative
+					if taken:
+						result += self.remove_unreachable(taken.statements)
+					reachable = all(map(terminates, result))
+					continue
+				case While() if isinstance(statement.condition, Integer) and not statement.condition.value:
+					self.warn("Loop never runs and was removed", statement)
+					continue
+				case Switch() if isinstance(statement.value, Integer):
+					self.warn(f"Switch value is always {statement.value.value}", statement)
+					taken = next((case.block for case in statement.cases if case.value.value == statement.value.value), statement.default)
+					if taken:
+						result += self.remove_unreachable(taken.statements)
+					reachable = all(map(terminates, result))
+					continue
+			for block in inner_blocks(statement):
+				block.statements = self.remove_unreachable(block.statements)
+			result.append(statement)
+			reachable = terminates(statement)
+		return result
+
+	def collect_reads(self, statements: list[Statement]) -> set[str]:
+		# A variable that is only read to compute a new value for itself is
+		# still dead, so reads inside a store to the same name don't count
+		reads = set()
+		for statement in statements:
+			match statement:
+				case IntegerDeclaration():
+					reads |= read_names(statement.expression) - {statement.ident.name}
+				case ArrayAssignment():
+					name = statement.target.ident.name
+					reads |= (read_names(statement.target.index) | read_names(statement.expression)) - {name}
+				case ExpressionStatement():
+					reads |= read_names(statement.expression)
+				case If() | While():
+					reads |= read_names(statement.condition)
+				case Switch():
+					reads |= read_names(statement.value)
+			for block in inner_blocks(statement):
+				reads |= self.collect_reads(block.statements)
+		return reads
+
+	def remove_dead_stores(self, statements: list[Statement], dead: set[str]) -> list[Statement]:
+		result = []
+		for statement in statements:
+			match statement:
+				case IntegerDeclaration() if statement.ident.name in dead:
+					self.warn(f"Value assigned to '{statement.ident.name}' is never read", statement)
+					if has_side_effects(statement.expression):
+						result.append(ExpressionStatement(statement.token, statement.expression))
+					continue
+				case ArrayAssignment() if statement.target.ident.name in dead:
+					self.warn(f"Value assigned to '{statement.target.ident.name}' is never read", statement)
+					for expression in (statement.target.index, statement.expression):
+						if has_side_effects(expression):
+							result.append(ExpressionStatement(statement.token, expression))
+					continue
+				case ArrayDeclaration() if statement.ident.name in dead:
+					self.warn(f"Array '{statement.ident.name}' is never read", statement)
+					continue
+				case SpriteDeclaration() if statement.ident.name in dead:
+					self.warn(f"Sprite '{statement.ident.name}' is never drawn", statement)
+					continue
+			for block in inner_blocks(statement):
+				block.statements = self.remove_dead_stores(block.statements, dead)
+			result.append(statement)
+		return result
@@ -0,0 +1,360 @@
+import argparse
+import random
+import re
+import sys
+from typing import Callable, Iterator
+
+from pipeline import Pipeline, OPTIMIZATION_LEVELS
+from emulator import Emulator, KeyTrace
+
+# Runs that haven't halted after this many instructions can't be compared
+CYCLES = 200_000
+# How many different sets of held keys every program is run with
+TRACES = 3
+# Top-level statements of a generated program, not counting declarations
+STATEMENTS = 12
+# How deeply statements and expressions are nested
+DEPTH = 2
+# Most cases of a generated switch
+SWITCH_CASES = 6
+
+OPERATORS = ("+", "-", "*", "==", "!=")
+
+class Compound:
+	"""
+	An if, while, frame or switch statement of a generated program. The body
+	is kept as statements of its own so the shrinker can take it apart. The
+	body of a switch is its cases, which are compounds too.
+	"""
+	def __init__(self, header: str, body: list, alternative: list | None = None):
+		self.header = header
+		self.body = body
+		self.alternative = alternative
+
+def render(statements: list, indent: int = 0) -> str:
+	lines = []
+	for statement in statements:
+		if isinstance(statement, Compound):
+			lines.append("\t" * indent + statement.header + " {")
+			lines.append(render(statement.body, indent + 1))
+			if statement.alternative is not None:
+				lines.append("\t" * indent + "} else {")
+				lines.append(render(statement.alternative, indent + 1))
+			lines.append("\t" * indent + "}")
+		else:
+			lines.append("\t" * indent + statement)
+	return "\n".join(line for line in lines if line)
+
+def source(statements: list) -> str:
+	# Every variable and array is drawn at the end, so stores to them are
+	# never dead and the same values have to be in memory at every level
+	code = render(statements)
+	variables = dict.fromkeys(name for name in re.findall(r"var (\w+) =", code))
+	arrays = {name: values.count(",") + 1 for name, values in re.findall(r"array (\w+) = \{([^}]*)\}", code)}
+	reads = list(variables) + [f"{name}[{index}]" for name, size in arrays.items() for index in range(size)]
+	epilogue = [f"draw_num({read}, {position % 5 * 12}, {position // 5 % 5 * 6});" for position, read in enumerate(reads)]
+	return "\n".join([code] + epilogue) + "\n"
+
+class ProgramGenerator:
+	"""
+	Writes random programs that the compiler accepts and that always halt:
+	loops count up to a small constant, arrays and sprite frames are only
+	indexed with constants and nothing reads memory it didn't declare.
+	"""
+	def __init__(self, generator: random.Random, statements: int = STATEMENTS, depth: int = DEPTH):
+		self.random = generator
+		self.statements = statements
+		self.depth = depth
+		self.variables: list[str] = []
+		# Loop counters may be read but only their loop changes them
+		self.counters: list[str] = []
+		self.arrays: dict[str, int] = {}
+		self.sprites: dict[str, int] = {}
+		self.names = 0
+
+	def new_name(self, prefix: str) -> str:
+		# Identifiers can't contain digits, so the names are counted in letters
+		self.names += 1
+		number = self.names
+		letters = ""
+		while number:
+			number, digit = divmod(number - 1, 26)
+			letters = chr(ord("a") + digit) + letters
+		return f"{prefix}_{letters}"
+
+	def integer(self) -> int:
+		return self.random.choice([0, 1, 2, 3, self.random.randrange(256)])
+
+	def expression(self, depth: int) -> str:
+		choices = ["integer"]
+		if self.variables or self.counters:
+			choices += ["variable"] * 3
+		if self.arrays:
+			choices.append("index")
+		if depth:
+			choices += ["infix"] * 3 + ["key"]
+		match self.random.choice(choices):
+			case "variable":
+				return self.random.choice(self.variables + self.counters)
+			case "index":
+				name = self.random.choice(list(self.arrays))
+				return f"{name}[{self.random.randrange(self.arrays[name])}]"
+			case "infix":
+				return f"({self.expression(depth - 1)} {self.random.choice(OPERATORS)} {self.expression(depth - 1)})"
+			case "key":
+				return f"{self.random.choice(["pressed", "not_pressed"])}({self.expression(depth - 1)})"
+		return str(self.integer())
+
+	def condition(self, depth: int) -> str:
+		match self.random.randrange(6) if depth else 0:
+			case 1:
+				return f"!{self.condition(depth - 1)}"
+			case 2 | 3:
+				return f"({self.condition(depth - 1)} {self.random.choice(["&&", "||"])} {self.condition(depth - 1)})"
+		return self.expression(depth)
+
+	def sprite(self) -> str:
+		name = self.random.choice(list(self.sprites))
+		frames = self.sprites[name]
+		return f"{name}[{self.random.randrange(frames)}]" if frames > 1 else name
+
+	def value(self) -> str:
+		# What a variable can be set to, including the results of calls
+		match self.random.randrange(8):
+			case 0:
+				return f"draw({self.sprite()}, {self.expression(1)}, {self.expression(1)})"
+			case 1:
+				return "until_pressed()"
+		return self.expression(self.depth)
+
+	def assignment(self) -> str:
+		if not self.variables or len(self.variables) < 6 and self.random.randrange(3) == 0:
+			name = self.new_name("v")
+			statement = f"var {name} = {self.value()};"
+			self.variables.append(name)
+			return statement
+		return f"var {self.random.choice(self.variables)} = {self.value()};"
+
+	def statement(self, depth: int) -> list:
+		kinds = ["assign"] * 4 + ["draw", "draw_num", "draw_char", "move", "clear", "wait"]
+		if self.arrays:
+			kinds += ["store"] * 2
+		if depth:
+			kinds += ["if"] * 2 + ["while"] * 2 + ["frame", "switch"]
+		match self.random.choice(kinds):
+			case "assign":
+				return [self.assignment()]
+			case "store":
+				name = self.random.choice(list(self.arrays))
+				return [f"var {name}[{self.random.randrange(self.arrays[name])}] = {self.expression(self.depth)};"]
+			case "draw":
+				return [f"draw({self.sprite()}, {self.expression(1)}, {self.expression(1)});"]
+			case "draw_num":
+				return [f"draw_num({self.expression(self.depth)}, {self.expression(1)}, {self.expression(1)});"]
+			case "draw_char":
+				return [f"draw_char({self.expression(1)}, {self.expression(1)}, {self.expression(1)});"]
+			case "move":
+				coordinates = ", ".join(self.expression(1) for _ in range(4))
+				return [f"move({self.sprite()}, {coordinates});"]
+			case "clear":
+				return ["clear;"]
+			case "wait":
+				return [f"wait({self.random.randrange(4)});"]
+			case "if":
+				condition = self.condition(self.depth)
+				consequence = self.block(depth - 1)
+				alternative = self.block(depth - 1) if self.random.randrange(2) else None
+				return [Compound(f"if ({condition})", consequence, alternative)]
+			case "while":
+				counter = self.new_name("c")
+				count = self.random.randrange(1, 5)
+				# The counter still bounds a loop with more to its condition
+				condition = f"{counter} != {count}"
+				if self.random.randrange(2):
+					condition = f"{condition} && {self.condition(self.depth - 1)}"
+				self.counters.append(counter)
+				body = self.block(depth - 1)
+				self.counters.remove(counter)
+				return [f"var {counter} = 0;", Compound(f"while ({condition})", body + [f"var {counter} = {counter} + 1;"])]
+			case "frame":
+				return [Compound("frame", self.block(depth - 1))]
+			case "switch":
+				return [self.switch()]
+		return []
+
+	def switch(self) -> Compound:
+		# Close values become a jump table and spread out ones a decision tree.
+		# Every case holds one simple statement, which keeps the programs
+		# small enough for memory at every level
+		value = self.expression(self.depth)
+		count = self.random.randrange(1, SWITCH_CASES + 1)
+		if self.random.randrange(2):
+			low = self.random.choice([0, 1, self.random.randrange(256 - 2 * count)])
+			values = self.random.sample(range(low, low + 2 * count), count)
+		else:
+			values = self.random.sample(range(256), count)
+		cases = [Compound(f"case {value}:", self.statement(0)) for value in sorted(values)]
+		if self.random.randrange(2):
+			cases.append(Compound("default:", self.statement(0)))
+		return Compound(f"switch ({value})", cases)
+
+	def block(self, depth: int) -> list:
+		statements = []
+		for _ in range(self.random.randrange(1, 4)):
+			statements += self.statement(depth)
+		return statements
+
+	def program(self) -> list:
+		statements = []
+		for _ in range(self.random.randrange(3)):
+			name = self.new_name("a")
+			self.arrays[name] = self.random.randrange(1, 5)
+			statements.append(f"array {name} = {{{", ".join(str(self.integer()) for _ in range(self.arrays[name]))}}};")
+		for _ in range(self.random.randrange(1, 3)):
+			name = self.new_name("s")
+			frames = self.random.randrange(1, 3)
+			self.sprites[name] = frames
+			rows = ", ".join(str(self.random.randrange(256)) for _ in range(frames * self.random.randrange(1, 4)))
+			statements.append(f"sprite {name}{f"[{frames}]" if frames > 1 else ""} = {{{rows}}};")
+		for _ in range(self.statements):
+			statements += self.statement(self.depth)
+		return statements
+
+def random_keys(generator: random.Random) -> KeyTrace:
+	# A level reaches a key test at a different cycle than the others, so the
+	# keys are held for the whole run instead of changing over time
+	return KeyTrace([(0, {key for key in range(16) if generator.randrange(4) == 0})])
+
+class Run:
+	"""One build of a program run with one set of held keys."""
+	def __init__(self, level: str, pipeline: Pipeline, keys: KeyTrace, cycles: int):
+		linker = pipeline.link()
+		image = linker.link()
+		emulator = Emulator(image, keys).run(cycles)
+		self.level = level
+		self.size = linker.code_size
+		self.cycles = emulator.cycles
+		self.halted = emulator.halted
+		self.display = emulator.display()
+		self.memory = {}
+		for name, symbol in pipeline.object.symbols.items():
+			if symbol["type"] in ("integer", "array"):
+				address = linker.addresses[name]
+				self.memory[name] = bytes(emulator.memory[address:address + symbol["size"]])
+
+def build(code: str, level: str) -> Pipeline:
+	pipeline = Pipeline(code, level=level)
+	pipeline.run()
+	return pipeline
+
+def compare(code: str, traces: list[KeyTrace], cycles: int = CYCLES) -> tuple[str | None, list[list[Run]] | None]:
+	# Returns the first difference between the levels, if there is one, and
+	# the runs of every trace that halted at every level. A program that no
+	# level compiles has no runs at all and the error instead
+	pipelines = {}
+	errors = {}
+	for level in OPTIMIZATION_LEVELS:
+		try:
+			pipelines[level] = build(code, level)
+		except Exception as exception:
+			errors[level] = str(exception)
+	if len(errors) == len(OPTIMIZATION_LEVELS):
+		return f"No level compiles the program: {errors[OPTIMIZATION_LEVELS[0]]}", None
+	if errors:
+		level, error = next(iter(errors.items()))
+		return f"-O{level} fails to compile the program that -O{next(iter(pipelines))} compiles: {error}", []
+
+	compared = []
+	for keys in traces:
+		runs = [Run(level, pipeline, keys, cycles) for level, pipeline in pipelines.items()]
+		if not all(run.halted for run in runs):
+			continue
+		reference = runs[0]
+		held = " ".join(f"{key:X}" for key in sorted(keys.pressed(0))) or "none"
+		for run in runs[1:]:
+			if run.display != reference.display:
+				return f"-O{run.level} draws a different screen than -O{reference.level} with keys {held}", compared
+			for name, value in reference.memory.items():
+				if name in run.memory and run.memory[name] != value:
+					return f"-O{run.level} leaves {list(run.memory[name])} in '{name}' where -O{reference.level} leaves {list(value)} with keys {held}", compared
+		compared.append(runs)
+	return None, compared
+
+def simplifications(statements: list) -> Iterator[list]:
+	# Smaller versions of the program: one statement left out, a compound
+	# statement replaced by its body or a compound statement simplified
+	for position, statement in enumerate(statements):
+		before, after = statements[:position], statements[position + 1:]
+		yield before + after
+		if not isinstance(statement, Compound):
+			continue
+		yield before + statement.body + after
+		if statement.alternative is not None:
+			yield before + statement.alternative + after
+			yield before + [Compound(statement.header, statement.body)] + after
+			for alternative in simplifications(statement.alternative):
+				yield before + [Compound(statement.header, statement.body, alternative)] + after
+		for body in simplifications(statement.body):
+			yield before + [Compound(statement.header, body, statement.alternative)] + after
+
+def shrink(statements: list, fails: Callable[[list], bool]) -> list:
+	# Greedily takes the first simplification that still fails until none does
+	while True:
+		for candidate in simplifications(statements):
+			if fails(candidate):
+				statements = candidate
+				break
+		else:
+			return statements
+
+def report(runs: list[list[Run]]) -> list[str]:
+	# Sizes and cycles of every level next to the unoptimized build
+	lines = []
+	for position, level in enumerate(OPTIMIZATION_LEVELS):
+		size = sum(trace[position].size for trace in runs)
+		cycles = sum(trace[position].cycles for trace in runs)
+		base_size = sum(trace[0].size for trace in runs) or 1
+		base_cycles = sum(trace[0].cycles for trace in runs) or 1
+		lines.append(f"-O{level}: {size} bytes ({(size - base_size) / base_size:+.1%}), {cycles} cycles ({(cycles - base_cycles) / base_cycles:+.1%})")
+	return lines
+
+def main():
+	arguments = argparse.ArgumentParser(description="Compile random programs at every optimization level and check that they all behave the same.")
+	arguments.add_argument("--programs", type=int, default=100, help="how many programs to generate")
+	arguments.add_argument("--seed", type=int, default=0, help="seed of the random programs and key traces")
+	arguments.add_argument("--statements", type=int, default=STATEMENTS, help="top-level statements per program")
+	arguments.add_argument("--traces", type=int, default=TRACES, help="sets of held keys to run each program with")
+	arguments.add_argument("--cycles", type=int, default=CYCLES, help="how many instructions a run may take")
+	options = arguments.parse_args()
+
+	generator = random.Random(options.seed)
+	runs: list[list[Run]] = []
+	mismatches = 0
+	# Generated programs are meant to compile, so these point at the generator
+	uncompilable = 0
+	for number in range(options.programs):
+		statements = ProgramGenerator(generator, options.statements).program()
+		traces = [random_keys(generator) for _ in range(options.traces)]
+		difference, compared = compare(source(statements), traces, options.cycles)
+		if compared is None:
+			uncompilable += 1
+			print(f"Program {number}: {difference}")
+			print(source(statements))
+			continue
+		runs += compared
+		if difference is None:
+			continue
+		mismatches += 1
+		# Simplifications that no level compiles anymore are not kept
+		smallest = shrink(statements, lambda candidate: None not in compare(source(candidate), traces, options.cycles))
+		print(f"Program {number}: {compare(source(smallest), traces, options.cycles)[0]}")
+		print(source(smallest))
+
+	print(f"{options.programs} programs, {uncompilable} uncompilable, {len(runs)} runs compared, {mismatches} mismatches")
+	for line in report(runs):
+		print(line)
+	if mismatches or uncompilable:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,293 @@
+import random
+
+from code_generator import Instruction, START, REGISTERS, INSTRUCTION_LENGTH, CYCLES_PER_TICK
+from targets import Target, CHIP8
+
+class EmulatorException(Exception):
+	pass
+
+WIDTH = 64
+HEIGHT = 32
+
+FONT_START = 0x50
+FONT = bytes([
+	0xF0, 0x90, 0x90, 0x90, 0xF0, 0x20, 0x60, 0x20, 0x20, 0x70,
+	0xF0, 0x10, 0xF0, 0x80, 0xF0, 0xF0, 0x10, 0xF0, 0x10, 0xF0,
+	0x90, 0x90, 0xF0, 0x10, 0x10, 0xF0, 0x80, 0xF0, 0x10, 0xF0,
+	0xF0, 0x80, 0xF0, 0x90, 0xF0, 0xF0, 0x10, 0x20, 0x40, 0x40,
+	0xF0, 0x90, 0xF0, 0x90, 0xF0, 0xF0, 0x90, 0xF0, 0x10, 0xF0,
+	0xF0, 0x90, 0xF0, 0x90, 0x90, 0xE0, 0x90, 0xE0, 0x90, 0xE0,
+	0xF0, 0x80, 0x80, 0x80, 0xF0, 0xE0, 0x90, 0x90, 0x90, 0xE0,
+	0xF0, 0x80, 0xF0, 0x80, 0xF0, 0xF0, 0x80, 0xF0, 0x80, 0x80,
+])
+
+class KeyTrace:
+	"""
+	Which keys are held down at each point of a run. Every line of a trace
+	file gives the instruction count from which on the hexadecimal keys after
+	it are held, until the next line:
+
+		0
+		500 7
+		900 7 9
+	"""
+	def __init__(self, changes: list[tuple[int, set[int]]] = []):
+		self.changes = sorted(changes, key=lambda change: change[0])
+
+	@staticmethod
+	def parse(text: str) -> "KeyTrace":
+		changes = []
+		for number, line in enumerate(text.splitlines(), 1):
+			fields = line.split("#")[0].split()
+			if not fields:
+				continue
+			try:
+				changes.append((int(fields[0]), {int(key, 16) for key in fields[1:]}))
+			except ValueError:
+				raise EmulatorException(f"Invalid key trace line '{line}' at {number}:1")
+		return KeyTrace(changes)
+
+	def pressed(self, cycle: int) -> set[int]:
+		keys = set()
+		for start, held in self.changes:
+			if start > cycle:
+				break
+			keys = held
+		return keys
+
+class Emulator:
+	"""
+	A headless CHIP-8 interpreter for running compiled programs without a
+	window. A jump to itself halts the program. The instructions a target adds
+	are understood when running for that target, always on the 64x32 screen.
+	"""
+	def __init__(self, image: bytes, keys: KeyTrace = KeyTrace(), seed: int = 0, target: Target = CHIP8):
+		if START + len(image) > target.memory:
+			raise EmulatorException(f"The program is {len(image)} bytes large and doesn't fit in memory!")
+		self.target = target
+		self.memory = bytearray(target.memory)
+		self.memory[FONT_START:FONT_START + len(FONT)] = FONT
+		self.memory[START:START + len(image)] = image
+		self.v = [0] * REGISTERS
+		self.i = 0
+		self.pc = START
+		self.stack: list[int] = []
+		self.delay = 0
+		self.screen = [[0] * WIDTH for _ in range(HEIGHT)]
+		self.keys = keys
+		self.random = random.Random(seed)
+		self.cycles = 0
+		self.halted = False
+
+	def step(self):
+		memory = self.memory
+		v = self.v
+		word = memory[self.pc] << 8 | memory[self.pc + 1]
+		op = word >> 12
+		x = word >> 8 & 0xF
+		y = word >> 4 & 0xF
+		n = word & 0xF
+		kk = word & 0xFF
+		nnn = word & 0xFFF
+		self.pc += INSTRUCTION_LENGTH
+		self.cycles += 1
+		if self.cycles % CYCLES_PER_TICK == 0 and self.delay:
+			self.delay -= 1
+
+		match op:
+			case 0x0 if word == 0x00E0:
+				self.screen = [[0] * WIDTH for _ in range(HEIGHT)]
+			case 0x0 if word == 0x00EE:
+				self.pc = self.stack.pop()
+			case 0x0 if self.scrolls(word):
+				self.scroll(word)
+			case 0x1:
+				if nnn == self.pc - INSTRUCTION_LENGTH:
+					self.halted = True
+				self.pc = nnn
+			case 0x2:
+				self.stack.append(self.pc)
+				self.pc = nnn
+			case 0x3:
+				if v[x] == kk:
+					self.skip()
+			case 0x4:
+				if v[x] != kk:
+					self.skip()
+			case 0x5 if n in (2, 3) and self.target.ranged_memory:
+				registers = range(x, y + 1) if x <= y else range(x, y - 1, -1)
+				for offset, register in enumerate(registers):
+					if n == 2:
+						memory[self.i + offset] = v[register]
+					else:
+						v[register] = memory[self.i + offset]
+			case 0x5:
+				if v[x] == v[y]:
+					self.skip()
+			case 0x6:
+				v[x] = kk
+			case 0x7:
+				v[x] = v[x] + kk & 0xFF
+			case 0x8:
+				self.arithmetic(x, y, n)
+			case 0x9:
+				if v[x] != v[y]:
+					self.skip()
+			case 0xA:
+				self.i = nnn
+			case 0xB:
+				self.pc = nnn + v[x if self.target.jump_quirk else 0]
+			case 0xC:
+				v[x] = self.random.randrange(256) & kk
+			case 0xD:
+				self.draw(v[x], v[y], n)
+			case 0xE if kk == 0x9E:
+				if v[x] in self.keys.pressed(self.cycles):
+					self.skip()
+			case 0xE if kk == 0xA1:
+				if v[x] not in self.keys.pressed(self.cycles):
+					self.skip()
+			case 0xF if word == 0xF000 and self.target.long_index:
+				self.i = memory[self.pc] << 8 | memory[self.pc + 1]
+				self.pc += INSTRUCTION_LENGTH
+			case 0xF:
+				self.misc(x, kk)
+			case _:
+				raise EmulatorException(f"Invalid instruction {word:04x} at {self.pc - INSTRUCTION_LENGTH:03x}")
+
+	def skip(self):
+		# F000 NNNN is skipped as a whole
+		long = self.target.long_index and self.memory[self.pc] == 0xF0 and self.memory[self.pc + 1] == 0x00
+		self.pc += INSTRUCTION_LENGTH * (2 if long else 1)
+
+	def scrolls(self, word: int) -> bool:
+		match word & 0xFFF0, word & 0xF:
+			case (0x00C0, _):
+				return "down" in self.target.scrolls
+			case (0x00D0, _):
+				return "up" in self.target.scrolls
+			case (0x00F0, 0xB):
+				return "right" in self.target.scrolls
+			case (0x00F0, 0xC):
+				return "left" in self.target.scrolls
+		return False
+
+	def scroll(self, word: int):
+		n = word & 0xF
+		blank = [[0] * WIDTH for _ in range(n)]
+		match word & 0xFFF0, n:
+			case (0x00C0, _):
+				self.screen = blank + self.screen[:HEIGHT - n]
+			case (0x00D0, _):
+				self.screen = self.screen[n:] + blank
+			case (0x00F0, 0xB):
+				self.screen = [[0] * 4 + row[:-4] for row in self.screen]
+			case (0x00F0, 0xC):
+				self.screen = [row[4:] + [0] * 4 for row in self.screen]
+
+	def arithmetic(self, x: int, y: int, n: int):
+		v = self.v
+		match n:
+			case 0x0:
+				v[x] = v[y]
+			case 0x1:
+				v[x] |= v[y]
+			case 0x2:
+				v[x] &= v[y]
+			case 0x3:
+				v[x] ^= v[y]
+			case 0x4:
+				total = v[x] + v[y]
+				v[x] = total & 0xFF
+				v[0xF] = int(total > 0xFF)
+			case 0x5:
+				flag = int(v[x] >= v[y])
+				v[x] = v[x] - v[y] & 0xFF
+				v[0xF] = flag
+			case 0x6:
+				flag = v[x] & 1
+				v[x] >>= 1
+				v[0xF] = flag
+			case 0x7:
+				flag = int(v[y] >= v[x])
+				v[x] = v[y] - v[x] & 0xFF
+				v[0xF] = flag
+			case 0xE:
+				flag = v[x] >> 7
+				v[x] = v[x] << 1 & 0xFF
+				v[0xF] = flag
+			case _:
+				raise EmulatorException(f"Invalid instruction 8{x:x}{y:x}{n:x}")
+
+	def misc(self, x: int, kk: int):
+		v = self.v
+		memory = self.memory
+		match kk:
+			case 0x07:
+				v[x] = self.delay
+			case 0x0A:
+				pressed = self.keys.pressed(self.cycles)
+				if pressed:
+					v[x] = min(pressed)
+				else:
+					self.pc -= INSTRUCTION_LENGTH
+			case 0x15:
+				self.delay = v[x]
+			case 0x18:
+				pass
+			case 0x1E:
+				self.i = self.i + v[x] & 0xFFFF
+			case 0x29:
+				self.i = FONT_START + (v[x] & 0xF) * 5
+			case 0x33:
+				memory[self.i:self.i + 3] = bytes((v[x] // 100, v[x] // 10 % 10, v[x] % 10))
+			case 0x55:
+				memory[self.i:self.i + x + 1] = bytes(v[:x + 1])
+			case 0x65:
+				v[:x + 1] = memory[self.i:self.i + x + 1]
+			case _:
+				raise EmulatorException(f"Invalid instruction f{x:x}{kk:02x}")
+
+	def draw(self, x: int, y: int, height: int):
+		self.v[0xF] = 0
+		# DXY0 draws 16 rows of two bytes each
+		wide = height == 0 and self.target.wide_sprites
+		size = len(self.memory)
+		for row in range(16 if wide else height):
+			if wide:
+				bits = self.memory[(self.i + 2 * row) % size] << 8 | self.memory[(self.i + 2 * row + 1) % size]
+			else:
+				bits = self.memory[(self.i + row) % size] << 8
+			for column in range(16 if wide else 8):
+				if bits & 0x8000 >> column:
+					pixel_x = (x + column) % WIDTH
+					pixel_y = (y + row) % HEIGHT
+					if self.screen[pixel_y][pixel_x]:
+						self.v[0xF] = 1
+					self.screen[pixel_y][pixel_x] ^= 1
+
+	def run(self, cycles: int) -> "Emulator":
+		while not self.halted and self.cycles < cycles:
+			self.step()
+		return self
+
+	def display(self) -> str:
+		return "\n".join("".join("#" if pixel else "." for pixel in row) for row in self.screen)
+
+def record_profile(image: bytes, addresses: list[int], instructions: list[Instruction], keys: KeyTrace, cycles: int, target: Target = CHIP8) -> tuple[dict[int, int], dict[int, int]]:
+	# Runs the image and counts the executions of every address and the
+	# entries into every source line of the instructions placed at addresses
+	line_at = {address: instruction.line for address, instruction in zip(addresses, instructions)}
+	emulator = Emulator(image, keys, target=target)
+	addresses: dict[int, int] = {}
+	lines: dict[int, int] = {}
+	previous = None
+	while not emulator.halted and emulator.cycles < cycles:
+		address = emulator.pc
+		addresses[address] = addresses.get(address, 0) + 1
+		line = line_at.get(address)
+		if line is not None and line != previous:
+			lines[line] = lines.get(line, 0) + 1
+		previous = line
+		emulator.step()
+	return lines, addresses
@@ -0,0 +1,76 @@
+import json
+
+from abstract_syntax_tree import Statement, Identifier, If, While, Switch, walk
+from dead_code import inner_blocks
+from semantic_analyzer import SemanticAnalyzer
+import semantic_analyzer
+
+class ProfileException(Exception):
+	pass
+
+# A line is hot when it runs at least this share as often as the hottest line
+HOT_FRACTION = 0.1
+
+class Profile:
+	"""
+	How many times each source line of a program was entered while its ROM
+	ran, and how many times each instruction address was executed. Only the
+	line counts are used for compiling, because addresses move as soon as the
+	code changes.
+	"""
+	def __init__(self, lines: dict[int, int], addresses: dict[int, int] = {}, source: str = ""):
+		self.lines = lines
+		self.addresses = addresses
+		# Hash of the source the profile was recorded for
+		self.source = source
+		self.hottest = max(lines.values(), default=0)
+
+	def count(self, line: int | None) -> int:
+		return self.lines.get(line, 0) if line is not None else 0
+
+	def hot(self, line: int | None) -> bool:
+		count = self.count(line)
+		return count > 0 and count >= self.hottest * HOT_FRACTION
+
+	def save(self, path: str):
+		with open(path, "w") as file:
+			json.dump({
+				"source": self.source,
+				"lines": {str(line): count for line, count in sorted(self.lines.items())},
+				"addresses": {f"{address:03x}": count for address, count in sorted(self.addresses.items())},
+			}, file, indent="\t")
+
+	@staticmethod
+	def load(path: str) -> "Profile":
+		try:
+			with open(path, "r") as file:
+				data = json.load(file)
+			lines = {int(line): int(count) for line, count in data["lines"].items()}
+			addresses = {int(address, 16): int(count) for address, count in data.get("addresses", {}).items()}
+		except OSError:
+			raise ProfileException(f"Cannot read profile '{path}'")
+		except (ValueError, KeyError, AttributeError):
+			raise ProfileException(f"Profile '{path}' is not a valid profile")
+		return Profile(lines, addresses, data.get("source", ""))
+
+def variable_weights(program: list[Statement], profile: Profile) -> dict[str, int]:
+	# How often each variable is touched, weighted by how often the statements
+	# touching it ran. Statements with blocks only touch their condition
+	weights: dict[str, int] = {}
+	for statement in program:
+		blocks = inner_blocks(statement)
+		roots = [statement.condition] if isinstance(statement, (If, While)) else [statement.value] if isinstance(statement, Switch) else [] if blocks else [statement]
+		for root in roots:
+			for node in walk(root):
+				if isinstance(node, Identifier):
+					weights[node.name] = weights.get(node.name, 0) + profile.count(statement.token.line)
+		for block in blocks:
+			for name, weight in variable_weights(block.statements, profile).items():
+				weights[name] = weights.get(name, 0) + weight
+	return weights
+
+def promotable(program: list[Statement], semantic: SemanticAnalyzer, profile: Profile, count: int, keep: set[str] = set()) -> list[str]:
+	# The hottest integer variables that only this module can see
+	weights = variable_weights(program, profile)
+	candidates = [name for name, weight in weights.items() if weight and name not in keep and name not in semantic.imported and isinstance(semantic.symbols.get(name), semantic_analyzer.Integer)]
+	return sorted(candidates, key=lambda name: -weights[name])[:count]
@@ -0,0 +1,270 @@
+from typing import Callable
+
+class Register:
+	"""
+	A virtual register. Every register is written by exactly one operation,
+	so a register can be replaced by another one holding the same value.
+	"""
+	def __init__(self, number: int):
+		self.number = number
+		# The CHIP-8 register chosen by the register allocator
+		self.physical: int | None = None
+	def __str__(self) -> str:
+		if self.physical is None:
+			return f"v{self.number}"
+		return f"v{self.number}:V{self.physical:X}"
+
+def map_registers(value, function: Callable[[Register], Register]):
+	match value:
+		case Register():
+			return function(value)
+		case list():
+			return [map_registers(item, function) for item in value]
+		case tuple():
+			return tuple(map_registers(item, function) for item in value)
+	return value
+
+def registers_in(value) -> list[Register]:
+	registers = []
+	map_registers(value, registers.append)
+	return registers
+
+class Operation:
+	# Names of the attributes holding the registers the operation reads
+	operand_fields: tuple[str, ...] = ()
+	# Pure operations only compute their destination, so they can be removed
+	# when it isn't used and merged with an identical earlier operation
+	pure = False
+
+	def __init__(self, dest: Register | None = None):
+		self.dest = dest
+		# Scratch registers the operation needs while it runs
+		self.temps: list[Register] = []
+		self.line: int | None = None
+		# Kind of syntax tree node the operation was lowered from
+		self.node: str | None = None
+
+	def operands(self) -> list[Register]:
+		return [register for field in self.operand_fields for register in registers_in(getattr(self, field))]
+
+	def replace_operands(self, function: Callable[[Register], Register]):
+		for field in self.operand_fields:
+			setattr(self, field, map_registers(getattr(self, field), function))
+
+	def key(self) -> tuple:
+		# Operations with equal keys compute the same value
+		return (type(self).__name__,) + tuple(map_registers(getattr(self, field), id) for field in self.operand_fields)
+
+	def assign(self) -> str:
+		return f"{self.dest} = " if self.dest else ""
+
+class Const(Operation):
+	pure = True
+	def __init__(self, dest: Register, value: int):
+		super().__init__(dest)
+		self.value = value
+	def key(self) -> tuple:
+		return ("Const", self.value)
+	def __str__(self) -> str:
+		return f"{self.assign()}{self.value}"
+
+class Load(Operation):
+	pure = True
+	def __init__(self, dest: Register, name: str, offset: int = 0):
+		super().__init__(dest)
+		self.name = name
+		self.offset = offset
+	def key(self) -> tuple:
+		return ("Load", self.name, self.offset)
+	def __str__(self) -> str:
+		return f"{self.assign()}load {self.name}{f"+{self.offset}" if self.offset else ""}"
+
+class LoadIndexed(Operation):
+	operand_fields = ("index",)
+	pure = True
+	def __init__(self, dest: Register, name: str, index: Register):
+		super().__init__(dest)
+		self.name = name
+		self.index = index
+	def key(self) -> tuple:
+		return ("LoadIndexed", self.name, id(self.index))
+	def __str__(self) -> str:
+		return f"{self.assign()}load {self.name}[{self.index}]"
+
+class Store(Operation):
+	operand_fields = ("source",)
+	def __init__(self, name: str, source: Register, offset: int = 0):
+		super().__init__()
+		self.name = name
+		self.source = source
+		self.offset = offset
+	def __str__(self) -> str:
+		return f"store {self.name}{f"+{self.offset}" if self.offset else ""}, {self.source}"
+
+class StoreIndexed(Operation):
+	operand_fields = ("index", "source")
+	def __init__(self, name: str, index: Register, source: Register):
+		super().__init__()
+		self.name = name
+		self.index = index
+		self.source = source
+	def __str__(self) -> str:
+		return f"store {self.name}[{self.index}], {self.source}"
+
+class Binary(Operation):
+	operand_fields = ("left", "right")
+	pure = True
+	COMMUTATIVE = ("+", "*", "==", "!=")
+	def __init__(self, dest: Register, operator: str, left: Register, right: Register):
+		super().__init__(dest)
+		self.operator = operator
+		self.left = left
+		self.right = right
+	def key(self) -> tuple:
+		operands = (id(self.left), id(self.right))
+		if self.operator in self.COMMUTATIVE:
+			operands = tuple(sorted(operands))
+		return ("Binary", self.operator) + operands
+	def __str__(self) -> str:
+		return f"{self.assign()}{self.left} {self.operator} {self.right}"
+
+class KeyTest(Operation):
+	operand_fields = ("code",)
+	def __init__(self, dest: Register, code: Register, pressed: bool):
+		super().__init__(dest)
+		self.code = code
+		self.pressed = pressed
+	def __str__(self) -> str:
+		return f"{self.assign()}{"pressed" if self.pressed else "not_pressed"} {self.code}"
+
+class WaitKey(Operation):
+	def __str__(self) -> str:
+		return f"{self.assign()}wait_key"
+
+class DrawSprite(Operation):
+	operand_fields = ("frame", "positions")
+	def __init__(self, dest: Register | None, name: str, frame: Register | int, positions: list[tuple[Register, Register]]):
+		super().__init__(dest)
+		self.name = name
+		# Either a register holding the frame or a constant frame
+		self.frame = frame
+		self.positions = positions
+	def __str__(self) -> str:
+		positions = ", ".join(f"({x}, {y})" for x, y in self.positions)
+		return f"{self.assign()}draw {self.name}[{self.frame}] at {positions}"
+
+class DrawDigits(Operation):
+	operand_fields = ("number", "x", "y")
+	def __init__(self, dest: Register | None, number: Register, x: Register, y: Register):
+		super().__init__(dest)
+		self.number = number
+		self.x = x
+		self.y = y
+	def __str__(self) -> str:
+		return f"{self.assign()}draw_num {self.number} at ({self.x}, {self.y})"
+
+class DrawCharacter(Operation):
+	operand_fields = ("char", "x", "y")
+	def __init__(self, dest: Register | None, char: Register, x: Register, y: Register):
+		super().__init__(dest)
+		self.char = char
+		self.x = x
+		self.y = y
+	def __str__(self) -> str:
+		return f"{self.assign()}draw_char {self.char} at ({self.x}, {self.y})"
+
+class SetTimer(Operation):
+	operand_fields = ("source",)
+	def __init__(self, source: Register):
+		super().__init__()
+		self.source = source
+	def __str__(self) -> str:
+		return f"set_timer {self.source}"
+
+class WaitTimer(Operation):
+	def __str__(self) -> str:
+		return f"{self.assign()}wait_timer"
+
+class ClearScreen(Operation):
+	def __str__(self) -> str:
+		return "clear"
+
+class ScrollScreen(Operation):
+	def __init__(self, direction: str, amount: int | None = None):
+		super().__init__()
+		self.direction = direction
+		self.amount = amount
+	def __str__(self) -> str:
+		return f"scroll {self.direction}" + (f" {self.amount}" if self.amount else "")
+
+class Label(Operation):
+	def __init__(self, name: str):
+		super().__init__()
+		self.name = name
+	def __str__(self) -> str:
+		return f"{self.name}:"
+
+class Jump(Operation):
+	def __init__(self, label: str):
+		super().__init__()
+		self.label = label
+	def __str__(self) -> str:
+		return f"jump {self.label}"
+
+class BranchIfZero(Operation):
+	operand_fields = ("condition",)
+	def __init__(self, condition: Register, label: str):
+		super().__init__()
+		self.condition = condition
+		self.label = label
+	def __str__(self) -> str:
+		return f"branch_if_zero {self.condition}, {self.label}"
+
+class BranchIfNonZero(Operation):
+	operand_fields = ("condition",)
+	def __init__(self, condition: Register, label: str):
+		super().__init__()
+		self.condition = condition
+		self.label = label
+	def __str__(self) -> str:
+		return f"branch_if_nonzero {self.condition}, {self.label}"
+
+class BranchIfEqual(Operation):
+	operand_fields = ("condition",)
+	def __init__(self, condition: Register, value: int, label: str):
+		super().__init__()
+		self.condition = condition
+		self.value = value
+		self.label = label
+	def __str__(self) -> str:
+		return f"branch_if_equal {self.condition}, {self.value}, {self.label}"
+
+class BranchIfLess(Operation):
+	operand_fields = ("condition",)
+	def __init__(self, condition: Register, value: int, label: str):
+		super().__init__()
+		self.condition = condition
+		self.value = value
+		self.label = label
+	def __str__(self) -> str:
+		return f"branch_if_less {self.condition}, {self.value}, {self.label}"
+
+class JumpTable(Operation):
+	# Jumps to labels[index], or to default when the index is out of range
+	operand_fields = ("index",)
+	def __init__(self, index: Register, labels: list[str], default: str):
+		super().__init__()
+		self.index = index
+		self.labels = labels
+		self.default = default
+	def __str__(self) -> str:
+		return f"jump_table {self.index}, [{", ".join(self.labels)}], {self.default}"
+
+# Operations that end a basic block
+CONTROL_FLOW = (Label, Jump, BranchIfZero, BranchIfNonZero, BranchIfEqual, BranchIfLess, JumpTable)
+
+def defined_registers(operation: Operation) -> list[Register]:
+	return ([operation.dest] if operation.dest else []) + operation.temps
+
+def dump(operations: list[Operation]) -> str:
+	return "\n".join(f"{operation}" if isinstance(operation, Label) else f"\t{operation}" for operation in operations)
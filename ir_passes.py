@@ -0,0 +1,178 @@
+from ir import Register, Operation, Const, Load, LoadIndexed, Store, StoreIndexed, Binary, DrawSprite, DrawDigits, DrawCharacter, Jump, BranchIfZero, BranchIfNonZero, BranchIfEqual, BranchIfLess, JumpTable, CONTROL_FLOW, defined_registers
+
+class RegisterAllocationException(Exception):
+	pass
+
+# V0 is used to move values to and from memory and VF is written by
+# arithmetic and drawing, so neither is handed out
+ALLOCATABLE = list(range(0x1, 0xF))
+
+# Reusing a value keeps its register taken until the reuse, so common
+# subexpression elimination only remembers this many of the most recently
+# used values and leaves the other registers to the statements themselves
+AVAILABLE_VALUES = 6
+
+def evaluate(operator: str, left: int, right: int) -> int:
+	match operator:
+		case "+":
+			return (left + right) & 0xFF
+		case "-":
+			return (left - right) & 0xFF
+		case "*":
+			return (left * right) & 0xFF
+		case "==":
+			return int(left == right)
+		case "!=":
+			return int(left != right)
+	raise ValueError(operator)
+
+def replace(operation: Operation, new: Operation) -> Operation:
+	new.line = operation.line
+	new.node = operation.node
+	return new
+
+def fold_constants(operations: list[Operation]) -> list[Operation]:
+	constants: dict[int, int] = {}
+	aliases: dict[int, Register] = {}
+	result = []
+	for operation in operations:
+		operation.replace_operands(lambda register: aliases.get(id(register), register))
+		match operation:
+			case Binary() if id(operation.left) in constants and id(operation.right) in constants:
+				operation = replace(operation, Const(operation.dest, evaluate(operation.operator, constants[id(operation.left)], constants[id(operation.right)])))
+			case Binary() if operation.operator in ("+", "-") and constants.get(id(operation.right)) == 0 or operation.operator == "*" and constants.get(id(operation.right)) == 1:
+				aliases[id(operation.dest)] = operation.left
+				continue
+			case Binary() if operation.operator == "+" and constants.get(id(operation.left)) == 0 or operation.operator == "*" and constants.get(id(operation.left)) == 1:
+				aliases[id(operation.dest)] = operation.right
+				continue
+			case Binary() if operation.operator == "*" and 0 in (constants.get(id(operation.left)), constants.get(id(operation.right))):
+				operation = replace(operation, Const(operation.dest, 0))
+			case LoadIndexed() if id(operation.index) in constants:
+				operation = replace(operation, Load(operation.dest, operation.name, constants[id(operation.index)]))
+			case StoreIndexed() if id(operation.index) in constants:
+				operation = replace(operation, Store(operation.name, operation.source, constants[id(operation.index)]))
+			case DrawSprite() if isinstance(operation.frame, Register) and id(operation.frame) in constants:
+				operation.frame = constants[id(operation.frame)]
+			case BranchIfZero() if id(operation.condition) in constants:
+				if constants[id(operation.condition)]:
+					continue
+				operation = replace(operation, Jump(operation.label))
+			case BranchIfNonZero() if id(operation.condition) in constants:
+				if not constants[id(operation.condition)]:
+					continue
+				operation = replace(operation, Jump(operation.label))
+			case BranchIfEqual() if id(operation.condition) in constants:
+				if constants[id(operation.condition)] != operation.value:
+					continue
+				operation = replace(operation, Jump(operation.label))
+			case BranchIfLess() if id(operation.condition) in constants:
+				if constants[id(operation.condition)] >= operation.value:
+					continue
+				operation = replace(operation, Jump(operation.label))
+			case JumpTable() if id(operation.index) in constants:
+				index = constants[id(operation.index)]
+				operation = replace(operation, Jump(operation.labels[index] if index < len(operation.labels) else operation.default))
+		if isinstance(operation, Const):
+			constants[id(operation.dest)] = operation.value
+		result.append(operation)
+	return result
+
+def remember(available: dict[tuple, Register], key: tuple, register: Register):
+	# The dictionary is kept in the order the values were last used in
+	available.pop(key, None)
+	available[key] = register
+	if len(available) > AVAILABLE_VALUES:
+		del available[next(iter(available))]
+
+def eliminate_common_subexpressions(operations: list[Operation]) -> list[Operation]:
+	# Works one basic block at a time. A store makes the stored register the
+	# value of later loads from the same place until the next store to it
+	available: dict[tuple, Register] = {}
+	replaced: dict[int, Register] = {}
+	result = []
+	for operation in operations:
+		operation.replace_operands(lambda register: replaced.get(id(register), register))
+		if isinstance(operation, CONTROL_FLOW):
+			available.clear()
+		match operation:
+			case Store():
+				available = {key: value for key, value in available.items() if key[:2] != ("LoadIndexed", operation.name) and key != ("Load", operation.name, operation.offset)}
+				remember(available, ("Load", operation.name, operation.offset), operation.source)
+			case StoreIndexed():
+				available = {key: value for key, value in available.items() if key[0] not in ("Load", "LoadIndexed") or key[1] != operation.name}
+		if operation.pure:
+			key = operation.key()
+			if key in available:
+				replaced[id(operation.dest)] = available[key]
+				remember(available, key, available[key])
+				continue
+			remember(available, key, operation.dest)
+		result.append(operation)
+	return result
+
+def eliminate_dead_code(operations: list[Operation]) -> list[Operation]:
+	used = set()
+	result = []
+	for operation in reversed(operations):
+		if operation.dest and id(operation.dest) not in used:
+			if operation.pure:
+				continue
+			if isinstance(operation, (DrawSprite, DrawDigits, DrawCharacter)):
+				operation.dest = None
+		used |= {id(register) for register in operation.operands()}
+		result.append(operation)
+	result.reverse()
+	return result
+
+def reusable(operation: Operation, register: Register) -> list[Register]:
+	# Operands whose register the destination or a temporary may take over
+	# when their value isn't needed after the operation
+	match operation:
+		case Binary():
+			return [operation.left] if register is operation.dest and operation.operator != "*" else []
+		case DrawDigits():
+			if register in operation.temps:
+				# The temporary is moved between digits, so y can't share it
+				return [operation.x] if operation.x is not operation.y else []
+			return [operand for operand in operation.operands() if operand is not operation.x]
+	return operation.operands()
+
+def allocate_registers(operations: list[Operation], registers: list[int] = ALLOCATABLE) -> dict[int | None, int]:
+	# Linear scan. Values never live across a label, so the live range of a
+	# register runs from its definition to its last use. Returns the most
+	# registers taken at once on every source line
+	pressure: dict[int | None, int] = {}
+	end: dict[int, int] = {}
+	for position, operation in enumerate(operations):
+		for register in operation.operands() + defined_registers(operation):
+			end[id(register)] = position
+
+	free = list(registers)
+	active: list[Register] = []
+	for position, operation in enumerate(operations):
+		for register in [register for register in active if end[id(register)] < position]:
+			active.remove(register)
+			free.append(register.physical)
+
+		if isinstance(operation, Binary) and operation.operator in Binary.COMMUTATIVE and end[id(operation.left)] > position == end[id(operation.right)]:
+			operation.left, operation.right = operation.right, operation.left
+
+		for register in operation.temps + ([operation.dest] if operation.dest else []):
+			candidates = [operand for operand in reusable(operation, register) if operand in active and end[id(operand)] == position]
+			if candidates:
+				active.remove(candidates[0])
+				register.physical = candidates[0].physical
+			elif free:
+				register.physical = min(free)
+				free.remove(register.physical)
+			else:
+				raise RegisterAllocationException(f"No available registers on line {operation.line}")
+			active.append(register)
+		pressure[operation.line] = max(pressure.get(operation.line, 0), len(active))
+	return pressure
+
+def optimize(operations: list[Operation]) -> list[Operation]:
+	operations = fold_constants(operations)
+	operations = eliminate_common_subexpressions(operations)
+	return eliminate_dead_code(operations)
@@ -30,28 +30,23 @@ class Lexer:
 
 	letters = "abcdefghijklmnopqrstuvwxyzåäöABCDEFGHIJKLMNOPQRSTUVWXYZÅÄÖ_"
 
-	def read_word(self):
-		word = ""
-		while self.ch in self.letters and self.ch:
-			word += self.ch
+	def read_while(self, condition):
+		# Slices the characters out of the code instead of adding them up one by one
+		# At the end of the code the position stays on the last character
+		start = self.position if self.ch else len(self.code)
+		while self.ch and condition(self.ch):
 			self.read_char()
-		return word
+		return self.code[start:self.position if self.ch else len(self.code)]
+
+	def read_word(self):
+		return self.read_while(lambda ch: ch in self.letters)
 
 	def read_binary(self):
-		number = ""
 		self.read_char()
-		while self.ch in ("1", "0"):
-			number += self.ch
-			self.read_char()
-		return number
-			
+		return self.read_while(lambda ch: ch in ("1", "0"))
 
 	def read_decimal(self):
-		number = ""
-		while self.ch.isnumeric():
-			number += self.ch
-			self.read_char()
-		return number
+		return self.read_while(str.isnumeric)
 
 	def read_number(self):
 		number = self.ch
@@ -92,6 +87,14 @@ class Lexer:
 				else:
 					token = Token(TokenType.NOT, "!", line, column)
 					return token
+			case "&" | "|":
+				line = self.line
+				column = self.column
+				first = self.ch
+				self.read_char()
+				if self.ch != first:
+					return Token(TokenType.ILLEGAL, first, line, column)
+				token = Token(TokenType.AND if first == "&" else TokenType.OR, first * 2, line, column)
 			case "+":
 				token = Token(TokenType.PLUS, self.ch, self.line, self.column)
 			case "-":
@@ -114,8 +117,18 @@ class Lexer:
 				token = Token(TokenType.RBRACKET, self.ch, self.line, self.column)
 			case ";":
 				token = Token(TokenType.SEMICOLON, self.ch, self.line, self.column)
+			case ":":
+				token = Token(TokenType.COLON, self.ch, self.line, self.column)
 			case ",":
 				token = Token(TokenType.COMMA, self.ch, self.line, self.column)
+			case '"':
+				line = self.line
+				column = self.column
+				self.read_char()
+				string = self.read_while(lambda ch: ch != '"')
+				if self.ch == "":
+					raise LexerException(f"Unterminated string at {line}:{column}")
+				token = Token(TokenType.STRING, string, line, column)
 			case "":
 				token = Token(TokenType.EOF, self.ch, self.line, self.column)
 			case _:
@@ -137,6 +150,14 @@ class Lexer:
 		self.read_char()
 		return token
 
+	def tokens(self):
+		# Yields tokens lazily up to and including EOF
+		while True:
+			token = self.next_token()
+			yield token
+			if token.type is TokenType.EOF:
+				return
+
 def main():
 	code = "var result = !number - (5 + 505) * 4 / 8;"
 	lexer = Lexer(code)
@@ -0,0 +1,267 @@
+import hashlib
+import json
+
+from array import array
+
+from code_buffer import CodeBuffer
+from code_generator import Instruction, LoadInstruction, pack_sprites, START, INSTRUCTION_LENGTH
+from semantic_analyzer import SemanticAnalyzer, Type
+import semantic_analyzer
+from targets import Target, CHIP8
+
+class LinkerException(Exception):
+	pass
+
+# Stored in every object file and hashed with the source, so objects made by
+# an older compiler are never reused
+OBJECT_VERSION = 2
+
+# The three bytes at the start of the data are used for instruction fx33's output
+SCRATCH_SIZE = 3
+
+# The highest address ANNN and 1NNN can hold
+SHORT_ADDRESS_MAX = 0xFFF
+
+def assemble(instructions: list[Instruction]) -> CodeBuffer:
+	# Addresses are left to the relocation table. Jumps and calls keep their
+	# offset in instructions
+	code = CodeBuffer()
+	for instruction in instructions:
+		match instruction.op:
+			case 0xA if isinstance(instruction, LoadInstruction):
+				code.address(0xA, 0, ["symbol", instruction.name, instruction.offset])
+			case 0xA:
+				code.address(0xA, 0, ["data", instruction.nnn])
+			case 0x1 | 0x2 | 0xB:
+				code.jump(instruction.op, instruction.nnn // INSTRUCTION_LENGTH)
+			case _ if instruction.nnn is not None:
+				code.address(instruction.op, instruction.nnn)
+			case _ if instruction.kk is not None:
+				code.byte(instruction.op, instruction.x, instruction.kk)
+			case _:
+				code.nibbles(instruction.op, instruction.x, instruction.y, instruction.n)
+	return code
+
+def describe(type: Type, data: bytes | None) -> dict:
+	match type:
+		case semantic_analyzer.Integer():
+			return {"type": "integer", "size": 1}
+		case semantic_analyzer.Array():
+			return {"type": "array", "size": type.size, "data": data.hex()}
+		case semantic_analyzer.Sprite() if type.wide:
+			return {"type": "sprite", "size": type.size, "frames": type.frames, "wide": True, "data": data.hex()}
+		case semantic_analyzer.Sprite():
+			return {"type": "sprite", "size": type.size, "frames": type.frames, "data": data.hex()}
+	raise LinkerException(f"Cannot describe symbol of type {type}")
+
+def interface(symbols: dict[str, dict]) -> dict[str, dict]:
+	# What an importing module may depend on. Data can change freely
+	return {name: {key: value for key, value in symbol.items() if key != "data"} for name, symbol in symbols.items()}
+
+def symbol_hash(symbols: dict[str, dict]) -> str:
+	return hashlib.sha256(json.dumps(interface(symbols), sort_keys=True).encode()).hexdigest()
+
+def source_hash(code: str) -> str:
+	return hashlib.sha256(f"{OBJECT_VERSION}\n{code}".encode()).hexdigest()
+
+class ObjectFile:
+	"""
+	A compiled module: relocatable code, the symbols it declares with their
+	data and the interface hashes of the modules it imported.
+	"""
+	def __init__(self, name: str, code: CodeBuffer, symbols: dict[str, dict], source: str = "", dependencies: dict[str, str] = {}):
+		self.name = name
+		self.code = code
+		self.symbols = symbols
+		self.source = source
+		self.dependencies = dependencies
+
+	@staticmethod
+	def build(name: str, instructions: list[Instruction], semantic: SemanticAnalyzer, sprites: dict[str, bytes], arrays: dict[str, bytes]) -> "ObjectFile":
+		symbols = {symbol: describe(type, sprites.get(symbol) or arrays.get(symbol)) for symbol, type in semantic.symbols.items() if symbol not in semantic.imported}
+		return ObjectFile(name, assemble(instructions), symbols)
+
+	def types(self) -> dict[str, Type]:
+		types = {}
+		for name, symbol in self.symbols.items():
+			match symbol["type"]:
+				case "integer":
+					types[name] = semantic_analyzer.Integer(0)
+				case "array":
+					types[name] = semantic_analyzer.Array(0, symbol["size"])
+				case "sprite":
+					types[name] = semantic_analyzer.Sprite(0, symbol["size"], symbol["frames"], symbol.get("wide", False))
+		return types
+
+	def interface_hash(self) -> str:
+		return symbol_hash(self.symbols)
+
+	def save(self, path: str):
+		with open(path, "w") as file:
+			json.dump({
+				"version": OBJECT_VERSION,
+				"name": self.name,
+				"source": self.source,
+				"dependencies": self.dependencies,
+				"symbols": self.symbols,
+				"code": self.code.tobytes().hex(),
+				"relocations": list(self.code.relocated()),
+			}, file)
+
+	@staticmethod
+	def load(path: str) -> "ObjectFile | None":
+		# Missing, unreadable and outdated objects are simply rebuilt
+		try:
+			with open(path, "r") as file:
+				data = json.load(file)
+		except (OSError, ValueError):
+			return None
+		if data.get("version") != OBJECT_VERSION:
+			return None
+		code = CodeBuffer.frombytes(bytes.fromhex(data["code"]), [(position, relocation) for position, relocation in data["relocations"]])
+		return ObjectFile(data["name"], code, data["symbols"], data["source"], data["dependencies"])
+
+class Linker:
+	"""
+	Places the code of the modules one after another in the order given, with
+	the data of every module after all of the code, and fills in the addresses.
+	A module ends in a halt that only the last module keeps, so the others fall
+	through to the module after them.
+
+	On targets with F000 NNNN, loads of addresses that don't fit in the twelve
+	bits of ANNN take four bytes instead of two. Jumps keep twelve bits, so the
+	code itself has to end below 0x1000 while the data may go on past it.
+	"""
+	def __init__(self, objects: list[ObjectFile], target: Target = CHIP8):
+		self.objects = objects
+		self.target = target
+		self.code_size = 0
+		# Address of the first instruction of each module
+		self.starts: dict[str, int] = {}
+		# Address of every instruction of each module
+		self.instruction_addresses: dict[str, list[int]] = {}
+		# Address of every symbol in the data
+		self.addresses: dict[str, int] = {}
+		self.sprites_size = 0
+		self.packed_size = 0
+		self.variables_size = 0
+		self.arrays_size = 0
+
+	def layout(self) -> tuple[dict[str, int], bytes]:
+		locations: dict[str, int] = {}
+		owners: dict[str, str] = {}
+		data = bytearray(SCRATCH_SIZE)
+		sprites: dict[str, bytes] = {}
+		self.variables_size = 0
+		self.arrays_size = 0
+		for module in self.objects:
+			for name, symbol in module.symbols.items():
+				if name in owners:
+					raise LinkerException(f"Symbol '{name}' is declared in both {owners[name]} and {module.name}!")
+				owners[name] = module.name
+				match symbol["type"]:
+					case "integer":
+						locations[name] = len(data)
+						data += b'\0'
+						self.variables_size += 1
+					case "array":
+						locations[name] = len(data)
+						data += bytes.fromhex(symbol["data"])
+						self.arrays_size += symbol["size"]
+					case "sprite":
+						sprites[name] = bytes.fromhex(symbol["data"])
+		packed, offsets = pack_sprites(sprites)
+		for name, offset in offsets.items():
+			locations[name] = len(data) + offset
+		data += packed
+		self.sprites_size = sum(len(sprite) for sprite in sprites.values())
+		self.packed_size = len(packed)
+		return locations, bytes(data)
+
+	def sections(self) -> dict[str, int]:
+		# Bytes of every part of the linked image, which add up to its size
+		return {
+			"code": self.code_size,
+			"scratch": SCRATCH_SIZE,
+			"variables": self.variables_size,
+			"arrays": self.arrays_size,
+			"sprites": self.packed_size,
+		}
+
+	def place(self, code: CodeBuffer, long: set[int]) -> list[int]:
+		# Address of every instruction followed by the address after the code
+		addresses = [START]
+		for position in range(len(code)):
+			addresses.append(addresses[-1] + INSTRUCTION_LENGTH * (2 if position in long else 1))
+		return addresses
+
+	def resolve(self, relocation: list, locations: dict[str, int], data_start: int) -> int | None:
+		# The data address a load refers to
+		match relocation:
+			case ["symbol", name, offset]:
+				if name not in locations:
+					raise LinkerException(f"Undefined symbol '{name}'!")
+				return data_start + locations[name] + offset
+			case ["data", offset]:
+				return data_start + offset
+		return None
+
+	def link(self) -> bytes:
+		locations, data = self.layout()
+
+		# This op makes sure that a window is spawned when initializing the emulator
+		code = CodeBuffer()
+		code.address(0x0, 0x0E0)
+		firsts = {}
+		for position, module in enumerate(self.objects):
+			last = position == len(self.objects) - 1
+			firsts[module.name] = len(code)
+			code.extend(module.code, None if last or not module.code.ends_in_halt() else len(module.code) - 1)
+
+		# Growing a load moves everything after it, which may push more data
+		# past the limit, so loads are grown until none is left
+		long: set[int] = set()
+		while True:
+			addresses = self.place(code, long)
+			grown = {position for position, relocation in code.relocated() if (self.resolve(relocation, locations, addresses[-1]) or 0) > SHORT_ADDRESS_MAX} - long
+			if not grown or not self.target.long_index:
+				break
+			long |= grown
+
+		data_start = addresses[-1]
+		self.code_size = data_start - START
+		for position, module in enumerate(self.objects):
+			end = firsts[self.objects[position + 1].name] if position + 1 < len(self.objects) else len(code)
+			self.instruction_addresses[module.name] = addresses[firsts[module.name]:end]
+			self.starts[module.name] = addresses[firsts[module.name]]
+		self.addresses = {name: data_start + location for name, location in locations.items()}
+
+		# Images that don't fit are never encoded
+		size = self.code_size + len(data)
+		if START + size > self.target.memory:
+			raise LinkerException(f"The program is {size} bytes large and doesn't fit in the {self.target.memory - START} bytes of {self.target}!")
+		if data_start > SHORT_ADDRESS_MAX + 1:
+			raise LinkerException(f"The code is {self.code_size} bytes large and jumps can't reach past {SHORT_ADDRESS_MAX:#x}!")
+
+		# Only the relocated words are touched one by one, the rest of the code
+		# is copied and written in bulk
+		words = array("H", code.words)
+		long_addresses: dict[int, int] = {}
+		for position, relocation in code.relocated():
+			match relocation:
+				case ["jump", offset]:
+					words[position] |= addresses[position + offset]
+				case _ if position in long:
+					long_addresses[position] = self.resolve(relocation, locations, data_start)
+				case _:
+					words[position] |= self.resolve(relocation, locations, data_start)
+		if long:
+			# Long loads become F000 followed by the address
+			spliced = array("H")
+			previous = 0
+			for position in sorted(long):
+				spliced += words[previous:position]
+				spliced += array("H", [0xF000, long_addresses[position]])
+				previous = position + 1
+			words = spliced + words[previous:]
+		return CodeBuffer(words).tobytes() + data
@@ -0,0 +1,341 @@
+import heapq
+
+from abstract_syntax_tree import Statement, Block, Case, While, walk
+from code_generator import Instruction, START, INSTRUCTION_LENGTH
+from peephole import skips
+from pipeline import Pipeline
+
+# How many loops the ranking at the end of a listing shows
+RANKED_LOOPS = 5
+
+ARITHMETIC = {0x0: "LD", 0x1: "OR", 0x2: "AND", 0x3: "XOR", 0x4: "ADD", 0x5: "SUB", 0x6: "SHR", 0x7: "SUBN", 0xE: "SHL"}
+MISC = {0x07: "LD V{x:X}, DT", 0x0A: "LD V{x:X}, K", 0x15: "LD DT, V{x:X}", 0x18: "LD ST, V{x:X}", 0x1E: "ADD I, V{x:X}", 0x29: "LD F, V{x:X}", 0x33: "LD B, V{x:X}", 0x55: "LD [I], V{x:X}", 0x65: "LD V{x:X}, [I]"}
+
+def disassemble(word: int) -> str:
+	op = word >> 12
+	x = word >> 8 & 0xF
+	y = word >> 4 & 0xF
+	n = word & 0xF
+	kk = word & 0xFF
+	nnn = word & 0xFFF
+	match op:
+		case 0x0 if word == 0x00E0:
+			return "CLS"
+		case 0x0 if word == 0x00EE:
+			return "RET"
+		case 0x0 if word & 0xFFF0 == 0x00C0:
+			return f"SCD {n:X}"
+		case 0x0 if word & 0xFFF0 == 0x00D0:
+			return f"SCU {n:X}"
+		case 0x0 if word == 0x00FB:
+			return "SCR"
+		case 0x0 if word == 0x00FC:
+			return "SCL"
+		case 0x0:
+			return f"SYS {nnn:03X}"
+		case 0x1:
+			return f"JP {nnn:03X}"
+		case 0x2:
+			return f"CALL {nnn:03X}"
+		case 0x3:
+			return f"SE V{x:X}, {kk:02X}"
+		case 0x4:
+			return f"SNE V{x:X}, {kk:02X}"
+		case 0x5 if n == 0:
+			return f"SE V{x:X}, V{y:X}"
+		case 0x5 if n == 2:
+			return f"LD [I], V{x:X}-V{y:X}"
+		case 0x5 if n == 3:
+			return f"LD V{x:X}-V{y:X}, [I]"
+		case 0x6:
+			return f"LD V{x:X}, {kk:02X}"
+		case 0x7:
+			return f"ADD V{x:X}, {kk:02X}"
+		case 0x8 if n in (0x6, 0xE):
+			return f"{ARITHMETIC[n]} V{x:X}"
+		case 0x8 if n in ARITHMETIC:
+			return f"{ARITHMETIC[n]} V{x:X}, V{y:X}"
+		case 0x9 if n == 0:
+			return f"SNE V{x:X}, V{y:X}"
+		case 0xA:
+			return f"LD I, {nnn:03X}"
+		case 0xB:
+			return f"JP V0, {nnn:03X}"
+		case 0xC:
+			return f"RND V{x:X}, {kk:02X}"
+		case 0xD:
+			return f"DRW V{x:X}, V{y:X}, {n:X}"
+		case 0xE if kk == 0x9E:
+			return f"SKP V{x:X}"
+		case 0xE if kk == 0xA1:
+			return f"SKNP V{x:X}"
+		case 0xF if kk in MISC:
+			return MISC[kk].format(x=x)
+	return f"DW {word:04X}"
+
+class Cost:
+	"""
+	Best and worst case cycles of a piece of code. None means that it may
+	never end, like a loop without a known bound or a wait for a key.
+	"""
+	def __init__(self, best: int | None, worst: int | None):
+		self.best = best
+		self.worst = worst
+
+	def __str__(self) -> str:
+		if self.best is None:
+			return "never ends"
+		return f"{self.best}-{self.worst if self.worst is not None else "unbounded"}"
+
+class CostModel:
+	"""
+	Static cost estimates in the cycles of emulator.py, where every
+	instruction takes one cycle. A region of instructions is entered at the
+	first instruction reached from outside of it and left by any edge out of
+	it, by halting or by returning. A call costs its own cycle and those of
+	the subroutine it calls. Backward jumps the code generator knows a bound
+	for are counted as taken that many times, any other loop makes the worst
+	case unbounded.
+	"""
+	def __init__(self, instructions: list[Instruction]):
+		self.instructions = instructions
+		self.predecessors: list[list[int]] = [[] for _ in instructions]
+		for position in range(len(instructions)):
+			for target in self.successors(position):
+				if target < len(instructions):
+					self.predecessors[target].append(position)
+		# Cycles of every instruction, where a call also takes the cycles of
+		# the subroutine it calls
+		self.weights = [Cost(1, 1)] * len(instructions)
+		# Outlined subroutines, from the target of a call up to its return
+		self.subroutines: set[int] = set()
+		costs: dict[int, Cost] = {}
+		for position, instruction in enumerate(instructions):
+			if instruction.op != 0x2:
+				continue
+			start = position + instruction.nnn // INSTRUCTION_LENGTH
+			if start not in costs:
+				end = start
+				while end < len(instructions) - 1 and not self.returns(end):
+					end += 1
+				self.subroutines.update(range(start, end + 1))
+				costs[start] = self.estimate(set(range(start, end + 1)))
+			cost = costs[start]
+			self.weights[position] = Cost(1 + cost.best, None if cost.worst is None else 1 + cost.worst)
+
+	def returns(self, position: int) -> bool:
+		instruction = self.instructions[position]
+		return instruction.op == 0x0 and instruction.kk == 0xEE
+
+	def successors(self, position: int) -> list[int]:
+		instruction = self.instructions[position]
+		if instruction.op == 0x1:
+			target = position + instruction.nnn // INSTRUCTION_LENGTH
+			# A jump to itself halts
+			return [] if target == position else [target]
+		if self.returns(position):
+			return []
+		if instruction.op == 0xB:
+			# Any of the jumps of the table that follows
+			end = position + 1
+			while end < len(self.instructions) and self.instructions[end].table:
+				end += 1
+			return list(range(position + 1, end))
+		if skips(instruction):
+			return [position + 1, position + 2]
+		# Calls go on after the call, their subroutine is in its weight
+		return [position + 1]
+
+	def entry(self, region: set[int]) -> int:
+		for position in sorted(region):
+			if position == 0 or any(source not in region for source in self.predecessors[position]):
+				return position
+		return min(region)
+
+	def estimate(self, region: set[int], per_iteration: bool = False) -> Cost:
+		# With per_iteration only jumping back to the entry ends the region,
+		# which gives the cost of one round of a loop
+		entry = self.entry(region)
+
+		def inner(position: int) -> list[int]:
+			return [target for target in self.successors(position) if target in region and not (per_iteration and target == entry)]
+
+		def leaves(position: int) -> bool:
+			if per_iteration:
+				return entry in self.successors(position)
+			return len(inner(position)) < len(self.successors(position)) or not self.successors(position)
+
+		best = None
+		distance = {entry: self.weights[entry].best}
+		pending = [(distance[entry], entry)]
+		while pending:
+			length, position = heapq.heappop(pending)
+			if length > distance[position]:
+				continue
+			if leaves(position):
+				best = length
+				break
+			for target in inner(position):
+				through = length + self.weights[target].best
+				if target not in distance or through < distance[target]:
+					distance[target] = through
+					heapq.heappush(pending, (through, target))
+		if best is None:
+			return Cost(None, None)
+
+		# Depth first search for the backward jumps that close loops
+		order: list[int] = []
+		loops: list[tuple[int, int]] = []
+		state = {entry: "open"}
+		stack = [(entry, iter(inner(entry)))]
+		while stack:
+			position, targets = stack[-1]
+			target = next(targets, None)
+			if target is None:
+				stack.pop()
+				state[position] = "done"
+				order.append(position)
+			elif target not in state:
+				state[target] = "open"
+				stack.append((target, iter(inner(target))))
+			elif state[target] == "open":
+				loops.append((position, target))
+		order.reverse()
+
+		if any(self.instructions[source].repeats is None for source, _ in loops):
+			return Cost(best, None)
+		if any(self.instructions[position].op == 0xF and self.instructions[position].kk == 0x0A or self.weights[position].worst is None for position in order):
+			return Cost(best, None)
+
+		def longest(start: int) -> dict[int, int]:
+			# Longest paths without taking a backward jump
+			lengths = {start: self.weights[start].worst}
+			for position in order[order.index(start):]:
+				if position not in lengths:
+					continue
+				for target in inner(position):
+					if (position, target) not in loops:
+						lengths[target] = max(lengths.get(target, 0), lengths[position] + self.weights[target].worst)
+			return lengths
+
+		lengths = longest(entry)
+		worst = max(length for position, length in lengths.items() if leaves(position))
+		for source, target in loops:
+			worst += self.instructions[source].repeats * longest(target).get(source, 0)
+		return Cost(best, worst)
+
+class Listing:
+	"""
+	The linked ROM as annotated assembly: the address, word and mnemonic of
+	every instruction with the source line it was generated for, followed by
+	static cycle estimates for every statement, the body of every loop and
+	every builtin call.
+	"""
+	def __init__(self, pipeline: Pipeline, program: list[Statement]):
+		self.pipeline = pipeline
+		self.program = program
+		self.linker = pipeline.link()
+		self.image = self.linker.link()
+		self.instructions = pipeline.generator.main
+		self.model = CostModel(self.instructions)
+		self.source = pipeline.code.splitlines()
+
+	def source_line(self, line: int) -> str:
+		return self.source[line - 1].strip() if 0 < line <= len(self.source) else ""
+
+	def word(self, address: int) -> int:
+		return self.image[address - START] << 8 | self.image[address - START + 1]
+
+	def code(self) -> list[str]:
+		lines = []
+		previous = None
+		placed = {address: position for position, address in enumerate(self.linker.instruction_addresses[self.pipeline.object.name])}
+		# Room for the eight digits of F000 NNNN on targets that have it
+		width = INSTRUCTION_LENGTH * (2 if self.pipeline.target.long_index else 1)
+		address = START
+		while address < START + self.linker.code_size:
+			word = self.word(address)
+			position = placed.get(address)
+			instruction = self.instructions[position] if position is not None else None
+			if instruction and instruction.line is not None and instruction.line != previous:
+				lines.append(f"      ; {instruction.line}: {self.source_line(instruction.line)}")
+			previous = instruction.line if instruction else None
+			length = INSTRUCTION_LENGTH
+			mnemonic = disassemble(word)
+			if word & 0xF000 == 0x1000 and word & 0xFFF == address:
+				mnemonic += " ; halt"
+			if word == 0xF000 and self.pipeline.target.long_index:
+				# F000 NNNN takes the address from the next two bytes
+				length *= 2
+				mnemonic = f"LD I, {self.word(address + INSTRUCTION_LENGTH):04X}"
+				word = word << 16 | self.word(address + INSTRUCTION_LENGTH)
+			cost = "1"
+			if instruction and instruction.repeats:
+				cost = f"1, taken up to {instruction.repeats} times"
+			elif word & 0xF0FF == 0xF00A:
+				cost = "1, waits for a key"
+			lines.append(f"{address:03X}  {word:0{2 * length}X}{"" if length == width else "    "}  {mnemonic:<18} {cost}")
+			address += length
+		return lines
+
+	def data(self) -> list[str]:
+		lines = []
+		symbols = {name: symbol for module in self.linker.objects for name, symbol in module.symbols.items()}
+		for name, address in sorted(self.linker.addresses.items(), key=lambda item: item[1]):
+			data = self.image[address - START:address - START + symbols[name]["size"]]
+			lines.append(f"{address:03X}  {name}: DB {" ".join(f"{byte:02X}" for byte in data)}")
+		return lines
+
+	def region(self, statement: Statement) -> set[int]:
+		# Outlined subroutines are counted in the calls to them
+		lines = {node.token.line for node in walk(statement) if isinstance(node, Statement)}
+		return {position for position, instruction in enumerate(self.instructions) if instruction.line in lines and position not in self.model.subroutines}
+
+	def statements(self) -> tuple[list[str], list[tuple[Statement, Cost]]]:
+		lines = []
+		loops = []
+		for top in self.program:
+			for statement in walk(top):
+				if not isinstance(statement, Statement) or isinstance(statement, (Block, Case)):
+					continue
+				region = self.region(statement)
+				if not region:
+					continue
+				text = f"line {statement.token.line:<4} {self.source_line(statement.token.line):<40}"
+				if isinstance(statement, While):
+					cost = self.model.estimate(region, per_iteration=True)
+					loops.append((statement, cost))
+					lines.append(f"; {text} {cost} per iteration")
+				else:
+					lines.append(f"; {text} {self.model.estimate(region)}")
+		return lines, loops
+
+	def calls(self) -> list[str]:
+		# Every run of instructions generated for the same call
+		lines = []
+		position = 0
+		while position < len(self.instructions):
+			instruction = self.instructions[position]
+			end = position + 1
+			while end < len(self.instructions) and (self.instructions[end].call, self.instructions[end].line) == (instruction.call, instruction.line):
+				end += 1
+			if instruction.call and position not in self.model.subroutines:
+				cost = self.model.estimate(set(range(position, end)))
+				lines.append(f"; line {instruction.line:<4} {instruction.call:<40} {cost}")
+			position = end
+		return lines
+
+	def text(self) -> str:
+		statements, loops = self.statements()
+		# Loops that may never end come first
+		loops.sort(key=lambda loop: (loop[1].worst is not None, -(loop[1].worst or 0), -(loop[1].best or 0)))
+		ranked = [f"; {rank}. line {statement.token.line}: {cost} cycles per iteration" for rank, (statement, cost) in enumerate(loops[:RANKED_LOOPS], 1)]
+		sections = [
+			[f"; {self.pipeline.path or "<main>"} at -O{self.pipeline.level}: {self.linker.code_size} bytes of code and {len(self.image) - self.linker.code_size} of data, one cycle per instruction"],
+			self.code(),
+			["; Data"] + self.data(),
+			["; Cycles of every statement, best-worst"] + statements,
+			["; Cycles of every builtin call"] + self.calls(),
+			["; Most expensive loops"] + (ranked or ["; none"]),
+		]
+		return "\n\n".join("\n".join(section) for section in sections)
@@ -0,0 +1,422 @@
+from abstract_syntax_tree import Integer, Identifier, Infix, Prefix, Expression, If, While, Switch, Clear, Scroll, Draw, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, Statement, DrawNum, DrawChar, Pressed, UntilPressed, NotPressed, Wait, Frame, Move, Index, ArrayDeclaration, ArrayAssignment, walk
+from tokens import TokenType
+from semantic_analyzer import SemanticAnalyzer
+from ir import Register, Operation, Const, Load, LoadIndexed, Store, StoreIndexed, Binary, KeyTest, WaitKey, DrawSprite, DrawDigits, DrawCharacter, SetTimer, WaitTimer, ClearScreen, ScrollScreen, Label, Jump, BranchIfZero, BranchIfNonZero, BranchIfEqual, BranchIfLess, JumpTable
+from execution_profile import Profile
+
+class LoweringException(Exception):
+	pass
+
+OPERATORS = {
+	TokenType.PLUS: "+",
+	TokenType.MINUS: "-",
+	TokenType.ASTERISK: "*",
+	TokenType.EQUALS: "==",
+	TokenType.NOT_EQUALS: "!=",
+}
+
+# Hot loops with bodies of at most this many syntax tree nodes are unrolled
+UNROLL_NODES = 40
+# Hot multiplications by at most this constant become a chain of additions
+EXPAND_LIMIT = 16
+# Switches with at least this many cases, whose values are spread over at
+# most JUMP_TABLE_SPREAD times as many numbers, jump through a table
+JUMP_TABLE_CASES = 4
+JUMP_TABLE_SPREAD = 2
+# The index is doubled in V0 to address the table, so it can't be longer
+JUMP_TABLE_ENTRIES = 128
+# Decision trees compare the value with this many cases one by one
+DECISION_TREE_LEAF = 3
+
+class Lowering:
+	"""
+	Turns the syntax tree into three-address IR. Every value gets a new
+	virtual register and variables are only touched through explicit loads
+	and stores, so no value is kept in a register across a label.
+
+	With a profile, branches are laid out for the path that ran more often,
+	hot loops are unrolled once and hot multiplications by small constants
+	are turned into additions, unless the program is optimized for size.
+	"""
+	def __init__(self, semantic: SemanticAnalyzer, profile: Profile | None = None, optimize_size: bool = False):
+		self.semantic = semantic
+		self.profile = profile
+		self.optimize_size = optimize_size
+		self.inverted = 0
+		self.unrolled = 0
+		self.expanded = 0
+		# What was done with every loop and why, by the line of the loop
+		self.loops: dict[int, str] = {}
+		# How every switch was compiled, by its line
+		self.switches: dict[int, str] = {}
+		self.sprites: dict[str, bytes] = {}
+		self.arrays: dict[str, bytes] = {}
+		self.operations: list[Operation] = []
+		self.registers = 0
+		self.labels = 0
+		self.line: int | None = None
+		# Kind of the innermost syntax tree node being lowered
+		self.node: str | None = None
+
+	def new_register(self) -> Register:
+		self.registers += 1
+		return Register(self.registers)
+
+	def new_label(self) -> str:
+		self.labels += 1
+		return f"L{self.labels}"
+
+	def emit(self, operation: Operation) -> Operation:
+		operation.line = self.line
+		operation.node = self.node
+		self.operations.append(operation)
+		return operation
+
+	def lower_integer(self, integer: Integer) -> Register:
+		register = self.new_register()
+		self.emit(Const(register, integer.value))
+		return register
+
+	def lower_identifier(self, identifier: Identifier) -> Register:
+		register = self.new_register()
+		self.emit(Load(register, identifier.name))
+		return register
+
+	def lower_index(self, index: Index) -> Register:
+		register = self.new_register()
+		if isinstance(index.index, Integer):
+			self.emit(Load(register, index.ident.name, index.index.value))
+		else:
+			self.emit(LoadIndexed(register, index.ident.name, self.lower_expression(index.index)))
+		return register
+
+	def lower_frame(self, frame: Expression | None) -> Register | int:
+		if frame is None:
+			return 0
+		if isinstance(frame, Integer):
+			return frame.value
+		return self.lower_expression(frame)
+
+	def lower_draw(self, call: Draw) -> Register:
+		x = self.lower_expression(call.x)
+		y = self.lower_expression(call.y)
+		frame = self.lower_frame(call.frame)
+		register = self.new_register()
+		self.emit(DrawSprite(register, call.ident.name, frame, [(x, y)]))
+		return register
+
+	def lower_move(self, call: Move) -> Register:
+		# The sprite is erased by drawing it again at its old position, so the
+		# result only reports collisions from the draw at the new position
+		positions = [(self.lower_expression(x), self.lower_expression(y)) for x, y in ((call.old_x, call.old_y), (call.new_x, call.new_y))]
+		frame = self.lower_frame(call.frame)
+		register = self.new_register()
+		self.emit(DrawSprite(register, call.ident.name, frame, positions))
+		return register
+
+	def lower_draw_num(self, call: DrawNum) -> Register:
+		number = self.lower_expression(call.number)
+		x = self.lower_expression(call.x)
+		y = self.lower_expression(call.y)
+		register = self.new_register()
+		draw = self.emit(DrawDigits(register, number, x, y))
+		# The x coordinate is moved right after every digit
+		draw.temps.append(self.new_register())
+		return register
+
+	def lower_draw_char(self, call: DrawChar) -> Register:
+		char = self.lower_expression(call.char)
+		x = self.lower_expression(call.x)
+		y = self.lower_expression(call.y)
+		register = self.new_register()
+		self.emit(DrawCharacter(register, char, x, y))
+		return register
+
+	def lower_multiplication(self, factor: Expression, times: int) -> Register:
+		# Adding the factor to itself is faster than the multiplication loop
+		factor_register = self.lower_expression(factor)
+		register = factor_register
+		for _ in range(times - 1):
+			total = self.new_register()
+			self.emit(Binary(total, "+", register, factor_register))
+			register = total
+		self.expanded += 1
+		return register
+
+	def lower_infix(self, infix: Infix) -> Register:
+		if infix.operator.type not in OPERATORS:
+			raise LoweringException(f"Invalid operator '{infix.operator}'!")
+		if infix.operator.type is TokenType.ASTERISK and self.profile and self.profile.hot(self.line) and not self.optimize_size:
+			for factor, constant in ((infix.left, infix.right), (infix.right, infix.left)):
+				if isinstance(constant, Integer) and 2 <= constant.value <= EXPAND_LIMIT:
+					return self.lower_multiplication(factor, constant.value)
+		left = self.lower_expression(infix.left)
+		right = self.lower_expression(infix.right)
+		register = self.new_register()
+		binary = self.emit(Binary(register, OPERATORS[infix.operator.type], left, right))
+		if binary.operator == "*":
+			# Counter of the repeated addition
+			binary.temps.append(self.new_register())
+		return register
+
+	def lower_not(self, prefix: Prefix) -> Register:
+		register = self.new_register()
+		self.emit(Binary(register, "==", self.lower_expression(prefix.right), self.lower_integer(Integer(prefix.operator, 0))))
+		return register
+
+	def lower_key_test(self, expression: Pressed | NotPressed) -> Register:
+		code = self.lower_expression(expression.expression)
+		register = self.new_register()
+		self.emit(KeyTest(register, code, isinstance(expression, Pressed)))
+		return register
+
+	def lower_until_pressed_call(self, until_pressed: UntilPressed) -> Register:
+		register = self.new_register()
+		self.emit(WaitKey(register))
+		return register
+
+	def lower_wait_call(self, wait: Wait) -> Register:
+		self.emit(SetTimer(self.lower_expression(wait.expression)))
+		register = self.new_register()
+		self.emit(WaitTimer(register))
+		return register
+
+	def lower_expression(self, expression: Expression) -> Register:
+		outer = self.node
+		self.node = type(expression).__name__
+		register = self.lower_expression_node(expression)
+		self.node = outer
+		return register
+
+	def lower_expression_node(self, expression: Expression) -> Register:
+		match expression:
+			case Integer():
+				return self.lower_integer(expression)
+			case Identifier():
+				return self.lower_identifier(expression)
+			case Index():
+				return self.lower_index(expression)
+			case Infix():
+				return self.lower_infix(expression)
+			case Prefix():
+				return self.lower_not(expression)
+			case Draw():
+				return self.lower_draw(expression)
+			case Move():
+				return self.lower_move(expression)
+			case DrawNum():
+				return self.lower_draw_num(expression)
+			case DrawChar():
+				return self.lower_draw_char(expression)
+			case Pressed() | NotPressed():
+				return self.lower_key_test(expression)
+			case UntilPressed():
+				return self.lower_until_pressed_call(expression)
+			case Wait():
+				return self.lower_wait_call(expression)
+		raise LoweringException("Invalid expression type")
+
+	def lower_condition(self, condition: Expression, label: str, jump_if: bool):
+		# Jumps to the label when the condition is jump_if and falls through
+		# otherwise. Logical operators become chains of branches that skip the
+		# right operand when the left one already decides the result
+		match condition:
+			case Prefix():
+				self.lower_condition(condition.right, label, not jump_if)
+			case Infix() if condition.operator.type in (TokenType.AND, TokenType.OR):
+				# The left operand decides on its own when it is false for && and
+				# true for ||
+				decides = condition.operator.type is TokenType.OR
+				if jump_if == decides:
+					self.lower_condition(condition.left, label, jump_if)
+					self.lower_condition(condition.right, label, jump_if)
+				else:
+					decided = self.new_label()
+					self.lower_condition(condition.left, decided, decides)
+					self.lower_condition(condition.right, label, jump_if)
+					self.emit(Label(decided))
+			case _:
+				value = self.lower_expression(condition)
+				self.emit(BranchIfNonZero(value, label) if jump_if else BranchIfZero(value, label))
+
+	def lower_block(self, statements: list[Statement]):
+		for statement in statements:
+			self.lower_statement(statement)
+
+	def consequence_is_cold(self, if_statement: If) -> bool:
+		# Compares how often the consequence ran with how often it was skipped.
+		# Statements sharing a line can't be told apart
+		if not self.profile or not if_statement.consequence.statements:
+			return False
+		consequence = if_statement.consequence.statements
+		alternative = if_statement.alternative.statements if if_statement.alternative else []
+		lines = [statement.token.line for statement in consequence + alternative]
+		if if_statement.token.line in lines or alternative and alternative[0].token.line in lines[:len(consequence)]:
+			return False
+		taken = self.profile.count(consequence[0].token.line)
+		if alternative:
+			skipped = self.profile.count(alternative[0].token.line)
+		else:
+			skipped = self.profile.count(if_statement.token.line) - taken
+		return skipped > taken
+
+	def lower_cold_if_statement(self, if_statement: If):
+		# The hot path only skips the branch and the consequence ends in a jump
+		# of its own, which lets block layout move it out of the way
+		consequence = self.new_label()
+		end = self.new_label()
+		self.lower_condition(if_statement.condition, consequence, True)
+		if if_statement.alternative:
+			self.lower_block(if_statement.alternative.statements)
+		self.emit(Jump(end))
+		self.emit(Label(consequence))
+		self.lower_block(if_statement.consequence.statements)
+		self.emit(Jump(end))
+		self.emit(Label(end))
+		self.inverted += 1
+
+	def lower_if_statement(self, if_statement: If):
+		if self.consequence_is_cold(if_statement):
+			self.lower_cold_if_statement(if_statement)
+			return
+		alternative = self.new_label()
+		self.lower_condition(if_statement.condition, alternative, False)
+		self.lower_block(if_statement.consequence.statements)
+		if if_statement.alternative:
+			end = self.new_label()
+			self.emit(Jump(end))
+			self.emit(Label(alternative))
+			self.lower_block(if_statement.alternative.statements)
+			self.emit(Label(end))
+		else:
+			self.emit(Label(alternative))
+
+	def unroll_count(self, while_statement: While) -> int:
+		line = while_statement.token.line
+		if not self.profile:
+			self.loops[line] = "left alone, there is no profile"
+		elif self.optimize_size:
+			self.loops[line] = "left alone, the program is optimized for size"
+		elif not self.profile.hot(line):
+			self.loops[line] = "left alone, the loop isn't hot in the profile"
+		elif sum(1 for _ in walk(while_statement.block)) > UNROLL_NODES:
+			self.loops[line] = f"left alone, the body has more than {UNROLL_NODES} nodes"
+		else:
+			self.loops[line] = "unrolled once"
+			self.unrolled += 1
+			return 2
+		return 1
+
+	def lower_while_statement(self, while_statement: While):
+		start = self.new_label()
+		self.emit(Label(start))
+		# A loop that can never end doesn't need to test its condition
+		infinite = isinstance(while_statement.condition, Integer) and while_statement.condition.value
+		end = None if infinite else self.new_label()
+		# Unrolled copies of the body each test the condition, but only the
+		# last one jumps back to the start
+		for _ in range(self.unroll_count(while_statement)):
+			if end:
+				self.lower_condition(while_statement.condition, end, False)
+			self.lower_block(while_statement.block.statements)
+		self.emit(Jump(start))
+		if end:
+			self.emit(Label(end))
+
+	def lower_decision_tree(self, value: Register, cases: list[tuple[int, str]], default: str):
+		# Halves the sorted cases with every comparison. The value stays in its
+		# register across the labels of the tree, which are only jumped to from
+		# further up in it
+		if len(cases) <= DECISION_TREE_LEAF:
+			for case, label in cases:
+				self.emit(BranchIfEqual(value, case, label))
+			self.emit(Jump(default))
+			return
+		middle = len(cases) // 2
+		lower = self.new_label()
+		self.emit(BranchIfLess(value, cases[middle][0], lower))
+		self.lower_decision_tree(value, cases[middle:], default)
+		self.emit(Label(lower))
+		self.lower_decision_tree(value, cases[:middle], default)
+
+	def lower_switch_statement(self, switch: Switch):
+		value = self.lower_expression(switch.value)
+		end = self.new_label()
+		default = self.new_label() if switch.default else end
+		labels = {case.value.value: self.new_label() for case in switch.cases}
+		cases = sorted(labels.items())
+		spread = cases[-1][0] - cases[0][0] + 1 if cases else 0
+		# Targets reading BNNN as BXNN jump through a register that depends on
+		# where the table ends up, so they always use a decision tree
+		if not self.semantic.target.jump_quirk and len(cases) >= JUMP_TABLE_CASES and spread <= min(JUMP_TABLE_SPREAD * len(cases), JUMP_TABLE_ENTRIES):
+			# Values below the lowest case wrap around to indices past the end
+			low = cases[0][0]
+			index = value
+			if low:
+				index = self.new_register()
+				self.emit(Binary(index, "-", value, self.lower_integer(Integer(switch.token, low))))
+			self.emit(JumpTable(index, [labels.get(low + offset, default) for offset in range(spread)], default))
+			self.switches[switch.token.line] = f"jump table with {spread} entries"
+		else:
+			self.lower_decision_tree(value, cases, default)
+			self.switches[switch.token.line] = f"decision tree over {len(cases)} cases"
+		for case in switch.cases:
+			self.emit(Label(labels[case.value.value]))
+			self.lower_block(case.block.statements)
+			self.emit(Jump(end))
+		if switch.default:
+			self.emit(Label(default))
+			self.lower_block(switch.default.statements)
+		self.emit(Label(end))
+
+	def lower_frame_statement(self, frame: Frame):
+		# The delay timer is started at the beginning of the frame and waited on
+		# at the end, which locks every frame to the 60 Hz timer ticks
+		self.emit(SetTimer(self.lower_integer(Integer(frame.token, 1))))
+		self.lower_block(frame.block.statements)
+		self.emit(WaitTimer(self.new_register()))
+
+	def lower_statement(self, statement: Statement):
+		outer = self.line, self.node
+		self.line = statement.token.line
+		self.node = type(statement).__name__
+		match statement:
+			case ExpressionStatement():
+				self.lower_expression(statement.expression)
+			case Clear():
+				self.emit(ClearScreen())
+			case Scroll():
+				self.emit(ScrollScreen(statement.direction, statement.amount.value if statement.amount else None))
+			case If():
+				self.lower_if_statement(statement)
+			case While():
+				self.lower_while_statement(statement)
+			case Switch():
+				self.lower_switch_statement(statement)
+			case Frame():
+				self.lower_frame_statement(statement)
+			case IntegerDeclaration():
+				self.emit(Store(statement.ident.name, self.lower_expression(statement.expression)))
+			case ArrayAssignment():
+				source = self.lower_expression(statement.expression)
+				target = statement.target
+				if isinstance(target.index, Integer):
+					self.emit(Store(target.ident.name, source, target.index.value))
+				else:
+					self.emit(StoreIndexed(target.ident.name, self.lower_expression(target.index), source))
+			case SpriteDeclaration():
+				# Rows of wide sprites are two bytes, the left half first
+				width = 2 if self.semantic.is_wide_sprite(statement.ident.name) else 1
+				self.sprites[statement.ident.name] = b"".join(row.value.to_bytes(width) for row in statement.rows)
+			case ArrayDeclaration():
+				self.arrays[statement.ident.name] = bytes(value.value for value in statement.values)
+			case _:
+				raise LoweringException(f"Unrecognized statement {statement}!")
+		self.line, self.node = outer
+
+	def lower_program(self, program: list[Statement]) -> list[Operation]:
+		# Labels and registers stay unique across calls, so a program can
+		# also be lowered a statement at a time
+		self.operations = []
+		self.lower_block(program)
+		return self.operations
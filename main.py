@@ -1,20 +1,80 @@
+import argparse
 import sys
-from parser import Parser
+from pipeline import Pipeline, OPTIMIZATION_LEVELS, BudgetException, compile_within_budget
+from watch import watch
+from server import serve
+from execution_profile import Profile
+from emulator import KeyTrace
+from listing import Listing
+from remarks import Remarks
+from targets import TARGETS
 
 def main():
-    if len(sys.argv) < 2:
-        print("Please specify an input file.")
-        sys.exit(1)
+    arguments = argparse.ArgumentParser(description="Compile a .c8c program into a CHIP-8 ROM.")
+    arguments.add_argument("filename", nargs="?", help="the program to compile")
+    arguments.add_argument("-O", dest="level", choices=OPTIMIZATION_LEVELS, default="2", help="optimization level: 0 for none, 1 for local optimizations, 2 for all of them and s for the smallest program")
+    arguments.add_argument("--target", choices=TARGETS, default="chip8", help="the CHIP-8 variant to compile for: chip8, schip for SUPER-CHIP or xochip for XO-CHIP")
+    arguments.add_argument("--rom-budget", type=int, metavar="BYTES", help="the most bytes the ROM may take: a program over it is compiled again with -Os and nothing is written if it still doesn't fit")
+    arguments.add_argument("-S", dest="listing", action="store_true", help="print the ROM as annotated assembly with static cycle estimates")
+    arguments.add_argument("--remarks", action="store_true", help="print what the optimizer did with every variable and loop, the register pressure of every line, the instructions per syntax tree node and the bytes of every section")
+    arguments.add_argument("--remarks-format", choices=("text", "json"), default="text", help="print the remarks as text or JSON")
+    arguments.add_argument("--dump-ir", action="store_true", help="print the optimized IR with its registers")
+    arguments.add_argument("--single-pass", action="store_true", help="compile each statement as soon as it is parsed instead of optimizing the whole program")
+    arguments.add_argument("--timings", action="store_true", help="print how long each compiler stage took")
+    arguments.add_argument("--watch", action="store_true", help="recompile whenever the program or a module it imports changes")
+    arguments.add_argument("--serve", metavar="SOCKET", help="run a compile server on the given Unix socket instead of compiling a file")
+    arguments.add_argument("--workers", type=int, help="how many processes the compile server compiles with")
+    arguments.add_argument("--profile", metavar="FILE", help="optimize for the execution counts in a recorded profile")
+    arguments.add_argument("--record-profile", metavar="FILE", help="run the compiled program in an emulator and save a profile of it")
+    arguments.add_argument("--keys", metavar="FILE", help="key trace to press while recording a profile")
+    arguments.add_argument("--cycles", type=int, default=100000, help="how many instructions to run while recording a profile")
+    options = arguments.parse_args()
 
-    filename = sys.argv[1]
+    if options.serve:
+        serve(options.serve, options.workers, options.level, options.target)
+        return
+    if not options.filename:
+        arguments.error("the filename is required unless --serve is given")
+
+    if options.watch:
+        try:
+            watch(options.filename, "output.ch8", level=options.level, target=TARGETS[options.target])
+        except KeyboardInterrupt:
+            pass
+        return
 
     code = ""
-    with open(filename, "r") as file:
+    with open(options.filename, "r") as file:
         code = file.read()
 
     if code:
-        parser = Parser(code)
-        parser.parse_program()
+        profile = Profile.load(options.profile) if options.profile else None
+        settings = {"single_pass": options.single_pass, "dump_ir": options.dump_ir, "profile": profile, "level": options.level, "target": TARGETS[options.target]}
+        if options.rom_budget is not None:
+            try:
+                pipeline, program = compile_within_budget(code, options.filename, options.rom_budget, **settings)
+            except BudgetException as exception:
+                sys.exit(str(exception))
+        else:
+            pipeline = Pipeline(code, options.filename, **settings)
+            program = pipeline.run()
+        pipeline.write_file("output.ch8", options.rom_budget)
+        if options.listing:
+            print(Listing(pipeline, program).text())
+        if options.remarks:
+            remarks = Remarks(pipeline, program)
+            print(remarks.json() if options.remarks_format == "json" else remarks.text())
+        if options.record_profile:
+            keys = KeyTrace()
+            if options.keys:
+                with open(options.keys, "r") as file:
+                    keys = KeyTrace.parse(file.read())
+            recorded = pipeline.record_profile(keys, options.cycles)
+            recorded.save(options.record_profile)
+            print(f"Recorded a profile of {sum(recorded.addresses.values())} instructions to {options.record_profile}")
+        if options.timings:
+            for stage, seconds in pipeline.timings.items():
+                print(f"{stage}: {seconds * 1000:.2f} ms")
         print("program compiled successfully")
     else:
         print("Invalid input")
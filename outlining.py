@@ -0,0 +1,106 @@
+from code_generator import Instruction, LoadInstruction, INSTRUCTION_LENGTH, link_jumps, relocate_jumps
+from peephole import encode, skips
+
+# Longest instruction sequence that is considered for a subroutine
+MAX_LENGTH = 32
+
+def key(instruction: Instruction) -> int | tuple | None:
+	# Equal keys are interchangeable instructions. Jumps, calls, returns and
+	# jump tables depend on where they are, so they have no key
+	if instruction.table or instruction.op in (0x1, 0x2, 0xB) or instruction.op == 0x0 and instruction.kk == 0xEE:
+		return None
+	if isinstance(instruction, LoadInstruction):
+		return ("load", instruction.name, instruction.offset)
+	return encode(instruction)
+
+class Outliner:
+	"""
+	Moves instruction sequences that appear several times into subroutines
+	placed after the end of the program and calls them with 2NNN, always the
+	sequence saving the most bytes first. A sequence may not contain jumps,
+	be jumped into past its first instruction or end in a skip, and it can't
+	start right after a skip, which would only skip the call. Subroutines
+	never call each other, so they only take one level of the stack.
+	"""
+	def __init__(self):
+		self.subroutines = 0
+		self.saved = 0
+
+	def run(self, instructions: list[Instruction]) -> list[Instruction]:
+		link_jumps(instructions)
+		subroutines = []
+		while True:
+			found = self.find(instructions)
+			if not found:
+				break
+			length, starts = found
+			instructions, body = self.outline(instructions, length, starts)
+			subroutines += body
+			self.subroutines += 1
+			self.saved += (len(starts) * (length - 1) - length - 1) * INSTRUCTION_LENGTH
+		instructions = instructions + subroutines
+		relocate_jumps(instructions)
+		return instructions
+
+	def find(self, instructions: list[Instruction]) -> tuple[int, list[int]] | None:
+		# Groups the starts of equal sequences and grows them one instruction
+		# at a time, so only sequences that are still repeated are followed
+		keys = [key(instruction) for instruction in instructions]
+		targets = {id(instruction.target) for instruction in instructions if instruction.target}
+		groups: dict = {}
+		for position, instruction_key in enumerate(keys):
+			if instruction_key is not None and not (position and skips(instructions[position - 1])):
+				groups.setdefault(instruction_key, []).append(position)
+		repeated = [starts for starts in groups.values() if len(starts) > 1]
+		best = None
+		best_saving = 0
+		length = 1
+		while repeated and length < MAX_LENGTH:
+			length += 1
+			extended = []
+			for starts in repeated:
+				by_last: dict = {}
+				for start in starts:
+					last = start + length - 1
+					if last < len(keys) and keys[last] is not None and id(instructions[last]) not in targets:
+						by_last.setdefault(keys[last], []).append(start)
+				extended += [group for group in by_last.values() if len(group) > 1]
+			repeated = extended
+			for starts in repeated:
+				if skips(instructions[starts[0] + length - 1]):
+					continue
+				chosen = []
+				for start in starts:
+					if not chosen or start >= chosen[-1] + length:
+						chosen.append(start)
+				# Every copy becomes one call and the subroutine ends in a return
+				saving = len(chosen) * (length - 1) - length - 1
+				if saving > best_saving:
+					best = (length, chosen)
+					best_saving = saving
+		return best
+
+	def outline(self, instructions: list[Instruction], length: int, starts: list[int]) -> tuple[list[Instruction], list[Instruction]]:
+		body = instructions[starts[0]:starts[0] + length]
+		ret = Instruction(op=0x0, kk=0xEE)
+		ret.line, ret.call, ret.node = body[-1].line, body[-1].call, body[-1].node
+		# Jumps to a copy land on its call instead
+		forward: dict[int, Instruction] = {}
+		result = []
+		position = 0
+		for start in starts:
+			result += instructions[position:start]
+			call = Instruction(op=0x2, nnn=0)
+			call.target = body[0]
+			call.line, call.call, call.node = instructions[start].line, instructions[start].call, instructions[start].node
+			forward[id(instructions[start])] = call
+			result.append(call)
+			position = start + length
+		result += instructions[position:]
+		for instruction in result:
+			if instruction.target and instruction.op != 0x2 and id(instruction.target) in forward:
+				instruction.target = forward[id(instruction.target)]
+		return result, body + [ret]
+
+	def report(self) -> str:
+		return f"Outlined {self.subroutines} repeated sequences into subroutines, saving {self.saved} bytes"
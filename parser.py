@@ -1,12 +1,14 @@
-from code_generator import CodeGenerator
-from semantic_analyzer import SemanticAnalyzer
+from typing import Iterable, Iterator
+
 from lexer import Lexer
 from tokens import TokenType, Token
-from abstract_syntax_tree import Integer, Identifier, Infix, Expression, If, While, Clear, Draw, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, Block, DrawNum, DrawChar, Pressed, UntilPressed, NotPressed
+from abstract_syntax_tree import Integer, Identifier, Infix, Prefix, Expression, If, While, Switch, Case, Clear, Scroll, Draw, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, Block, Statement, DrawNum, DrawChar, Pressed, UntilPressed, NotPressed, Wait, Frame, Move, Index, ArrayDeclaration, ArrayAssignment, Import
 
 class ParserException(Exception):
 	pass
 
+SCROLL_DIRECTIONS = ("down", "up", "left", "right")
+
 class TokenException(ParserException):
 	def __init__(self, expected_type: TokenType, found_token: Token):
 		self.expected_type = expected_type
@@ -17,21 +19,25 @@ class TokenException(ParserException):
 class Parser:
 
 	LOWEST = 1
-	EQUALS = 2
-	SUM = 3
-	PRODUCT = 4
-	CALL = 5
-
-	def __init__(self, code: str):
-		self.lexer = Lexer(code)
-		self.semantic = SemanticAnalyzer()
-		self.generator = CodeGenerator(self.semantic)
-		self.current_token = self.lexer.next_token()
-		self.peek_token = self.lexer.next_token()
+	OR = 2
+	AND = 3
+	EQUALS = 4
+	SUM = 5
+	PRODUCT = 6
+	PREFIX = 7
+	CALL = 8
+	INDEX = 9
+
+	def __init__(self, source: str | Iterable[Token]):
+		# The parser reads either source code or an already lexed token stream
+		self.tokens = Lexer(source).tokens() if isinstance(source, str) else iter(source)
+		self.current_token = next(self.tokens)
+		self.peek_token = next(self.tokens, self.current_token)
 
 	def next_token(self):
 		self.current_token = self.peek_token
-		self.peek_token = self.lexer.next_token()
+		# Past the end of the stream the EOF token is repeated
+		self.peek_token = next(self.tokens, self.peek_token)
 
 	def check_peek_token(self, expected: TokenType):
 		if self.peek_token.type is not expected:
@@ -49,13 +55,10 @@ class Parser:
 			value = int(literal, 2)
 		else:
 			value = int(self.current_token.literal)
-		self.semantic.check_integer_value(self.current_token)
 		return Integer(self.current_token, value)
 
-	def parse_ident(self, declaration = False) -> Identifier:
+	def parse_ident(self) -> Identifier:
 		name = self.current_token.literal
-		if not declaration:
-			self.semantic.check_symbol(self.current_token)
 		return Identifier(self.current_token, name)
 
 	def parse_grouped_expression(self) -> Expression:
@@ -64,12 +67,22 @@ class Parser:
 		self.check_peek_token(TokenType.RPAREN)
 		return expression
 
+	def parse_sprite_reference(self) -> tuple[Identifier, Expression | None]:
+		self.check_peek_token(TokenType.IDENT)
+		ident = self.parse_ident()
+		frame = None
+		if self.peek_token.type is TokenType.LBRACKET:
+			self.next_token()
+			self.next_token()
+			frame = self.parse_expression(self.LOWEST)
+			self.check_peek_token(TokenType.RBRACKET)
+		return ident, frame
+
 	def parse_draw(self) -> Draw:
 		token = self.current_token
 		self.check_peek_token(TokenType.LPAREN)
 
-		self.check_peek_token(TokenType.IDENT)
-		ident = self.parse_ident()
+		ident, frame = self.parse_sprite_reference()
 
 		self.check_peek_token(TokenType.COMMA)
 		self.next_token()
@@ -83,7 +96,23 @@ class Parser:
 
 		self.check_peek_token(TokenType.RPAREN)
 
-		return Draw(token, ident, x, y)
+		return Draw(token, ident, x, y, frame)
+
+	def parse_move(self) -> Move:
+		token = self.current_token
+		self.check_peek_token(TokenType.LPAREN)
+
+		ident, frame = self.parse_sprite_reference()
+
+		coordinates = []
+		for _ in range(4):
+			self.check_peek_token(TokenType.COMMA)
+			self.next_token()
+			coordinates.append(self.parse_expression(self.LOWEST))
+
+		self.check_peek_token(TokenType.RPAREN)
+
+		return Move(token, ident, *coordinates, frame)
 
 	def parse_draw_num(self) -> DrawNum:
 		token = self.current_token
@@ -149,6 +178,14 @@ class Parser:
 		self.check_peek_token(TokenType.RPAREN)
 		return UntilPressed(token)
 
+	def parse_wait(self) -> Wait:
+		token = self.current_token
+		self.check_peek_token(TokenType.LPAREN)
+		self.next_token()
+		parameter = self.parse_expression(self.LOWEST)
+		self.check_peek_token(TokenType.RPAREN)
+		return Wait(token, parameter)
+
 	def parse_infix(self, left_expression) -> Infix:
 		self.next_token()
 		operator = self.current_token
@@ -156,6 +193,21 @@ class Parser:
 		right_expression = self.parse_expression(self.get_precedence(operator.type))
 		return Infix(operator, left_expression, right_expression)
 
+	def parse_prefix(self) -> Prefix:
+		operator = self.current_token
+		self.next_token()
+		return Prefix(operator, self.parse_expression(self.PREFIX))
+
+	def parse_index(self, left_expression) -> Index:
+		self.next_token()
+		token = self.current_token
+		if not isinstance(left_expression, Identifier):
+			raise ParserException(f"Only arrays can be indexed at {token.line}:{token.column}")
+		self.next_token()
+		index = self.parse_expression(self.LOWEST)
+		self.check_peek_token(TokenType.RBRACKET)
+		return Index(token, left_expression, index)
+
 	prefix_functions = {
 		TokenType.INT: parse_int,
 		TokenType.IDENT: parse_ident,
@@ -163,18 +215,24 @@ class Parser:
 		TokenType.DRAW: parse_draw,
 		TokenType.DRAW_NUM: parse_draw_num,
 		TokenType.DRAW_CHAR: parse_draw_char,
+		TokenType.MOVE: parse_move,
 		TokenType.PRESSED: parse_pressed,
 		TokenType.NOT_PRESSED: parse_not_pressed,
 		TokenType.UNTIL_PRESSED: parse_until_pressed,
+		TokenType.WAIT: parse_wait,
+		TokenType.NOT: parse_prefix,
 	}
 
 	precedences = {
+		TokenType.OR: OR,
+		TokenType.AND: AND,
 		TokenType.EQUALS: EQUALS,
 		TokenType.NOT_EQUALS: EQUALS,
 		TokenType.PLUS: SUM,
 		TokenType.MINUS: SUM,
 		TokenType.ASTERISK: PRODUCT,
 		TokenType.SLASH: PRODUCT,
+		TokenType.LBRACKET: INDEX,
 	}
 
 	def get_precedence(self, type: TokenType):
@@ -187,6 +245,9 @@ class Parser:
 		TokenType.SLASH: parse_infix,
 		TokenType.EQUALS: parse_infix,
 		TokenType.NOT_EQUALS: parse_infix,
+		TokenType.AND: parse_infix,
+		TokenType.OR: parse_infix,
+		TokenType.LBRACKET: parse_index,
 	}
 
 	# tokens allowed after a prefix
@@ -194,6 +255,8 @@ class Parser:
 	after_prefix_tokens = (
 		TokenType.EQUALS,
 		TokenType.NOT_EQUALS,
+		TokenType.AND,
+		TokenType.OR,
 		TokenType.PLUS,
 		TokenType.MINUS,
 		TokenType.ASTERISK,
@@ -201,6 +264,8 @@ class Parser:
 		TokenType.SEMICOLON,
 		TokenType.RPAREN,
 		TokenType.COMMA,
+		TokenType.LBRACKET,
+		TokenType.RBRACKET,
 	)
 
 	def parse_expression(self, precedence):
@@ -235,6 +300,22 @@ class Parser:
 		token = self.current_token
 		return Clear(token)
 
+	def parse_scroll_statement(self) -> Scroll:
+		# scroll(left), scroll(right), scroll(down, n) and scroll(up, n)
+		token = self.current_token
+		self.check_peek_token(TokenType.LPAREN)
+		self.check_peek_token(TokenType.IDENT)
+		direction = self.current_token
+		if direction.literal not in SCROLL_DIRECTIONS:
+			raise ParserException(f"Invalid scroll direction '{direction.literal}' at {direction.line}:{direction.column}")
+		amount = None
+		if direction.literal in ("down", "up"):
+			self.check_peek_token(TokenType.COMMA)
+			self.check_peek_token(TokenType.INT)
+			amount = self.parse_int()
+		self.check_peek_token(TokenType.RPAREN)
+		return Scroll(token, direction.literal, amount)
+
 	def parse_block(self):
 		token = self.current_token
 		statements = []
@@ -270,20 +351,62 @@ class Parser:
 		block = self.parse_block()
 		return While(token, condition, block)
 
+	def parse_switch_statement(self) -> Switch:
+		# switch (value) { case 1: { ... } case 2: { ... } default: { ... } }
+		token = self.current_token
+		self.check_peek_token(TokenType.LPAREN)
+		self.next_token()
+		value = self.parse_expression(self.LOWEST)
+		self.check_peek_token(TokenType.RPAREN)
+		self.check_peek_token(TokenType.LBRACE)
+		cases = []
+		default = None
+		while self.peek_token.type is not TokenType.RBRACE:
+			if self.peek_token.type is TokenType.DEFAULT:
+				self.next_token()
+				if default:
+					raise ParserException(f"Switch has more than one default at {self.current_token.line}:{self.current_token.column}")
+				self.check_peek_token(TokenType.COLON)
+				self.check_peek_token(TokenType.LBRACE)
+				default = self.parse_block()
+				continue
+			self.check_peek_token(TokenType.CASE)
+			case_token = self.current_token
+			self.check_peek_token(TokenType.INT)
+			case_value = self.parse_int()
+			self.check_peek_token(TokenType.COLON)
+			self.check_peek_token(TokenType.LBRACE)
+			cases.append(Case(case_token, case_value, self.parse_block()))
+		self.next_token()
+		return Switch(token, value, cases, default)
+
+	def parse_frame_statement(self) -> Frame:
+		token = self.current_token
+		self.check_peek_token(TokenType.LBRACE)
+		block = self.parse_block()
+		return Frame(token, block)
+
 	def parse_integer_declaration(self):
 		token = self.current_token
 		self.check_peek_token(TokenType.IDENT)
-		ident = self.parse_ident(declaration=True)
+		if self.peek_token.type is TokenType.LBRACKET:
+			return self.parse_array_assignment(token)
+		ident = self.parse_ident()
 		self.check_peek_token(TokenType.ASSIGN)
 		self.next_token()
 		expression = self.parse_expression(self.LOWEST)
-		self.semantic.add_integer_symbol(ident.name)
 		return IntegerDeclaration(token, ident, expression)
 
 	def parse_sprite_declaration(self):
 		token = self.current_token
 		self.check_peek_token(TokenType.IDENT)
-		ident = self.parse_ident(declaration=True)
+		ident = self.parse_ident()
+		frames = None
+		if self.peek_token.type is TokenType.LBRACKET:
+			self.next_token()
+			self.check_peek_token(TokenType.INT)
+			frames = self.parse_int()
+			self.check_peek_token(TokenType.RBRACKET)
 		self.check_peek_token(TokenType.ASSIGN)
 		self.check_peek_token(TokenType.LBRACE)
 		self.check_peek_token(TokenType.INT)
@@ -298,8 +421,39 @@ class Parser:
 
 		self.check_peek_token(TokenType.RBRACE)
 
-		self.semantic.add_sprite_symbol(ident.name, len(rows))
-		return SpriteDeclaration(token, ident, rows)
+		return SpriteDeclaration(token, ident, rows, frames)
+
+	def parse_array_assignment(self, token: Token) -> ArrayAssignment:
+		target = self.parse_index(self.parse_ident())
+		self.check_peek_token(TokenType.ASSIGN)
+		self.next_token()
+		expression = self.parse_expression(self.LOWEST)
+		return ArrayAssignment(token, target, expression)
+
+	def parse_array_declaration(self) -> ArrayDeclaration:
+		token = self.current_token
+		self.check_peek_token(TokenType.IDENT)
+		ident = self.parse_ident()
+		self.check_peek_token(TokenType.ASSIGN)
+		self.check_peek_token(TokenType.LBRACE)
+		self.check_peek_token(TokenType.INT)
+
+		values = []
+		values.append(self.parse_int())
+
+		while self.peek_token.type is TokenType.COMMA:
+			self.next_token()
+			self.next_token()
+			values.append(self.parse_int())
+
+		self.check_peek_token(TokenType.RBRACE)
+
+		return ArrayDeclaration(token, ident, values)
+
+	def parse_import_statement(self) -> Import:
+		token = self.current_token
+		self.check_peek_token(TokenType.STRING)
+		return Import(token, self.current_token.literal)
 
 	def parse_statement(self):
 		match self.current_token.type:
@@ -309,34 +463,45 @@ class Parser:
 			case TokenType.SPRITE:
 				statement = self.parse_sprite_declaration()
 				self.check_peek_token(TokenType.SEMICOLON)
+			case TokenType.ARRAY:
+				statement = self.parse_array_declaration()
+				self.check_peek_token(TokenType.SEMICOLON)
 			case TokenType.IF:
 				statement = self.parse_if_statement()
 			case TokenType.WHILE:
 				statement = self.parse_while_statement()
+			case TokenType.SWITCH:
+				statement = self.parse_switch_statement()
+			case TokenType.FRAME:
+				statement = self.parse_frame_statement()
 			case TokenType.CLEAR:
 				statement = self.parse_clear_statement()
 				self.check_peek_token(TokenType.SEMICOLON)
+			case TokenType.SCROLL:
+				statement = self.parse_scroll_statement()
+				self.check_peek_token(TokenType.SEMICOLON)
+			case TokenType.IMPORT:
+				statement = self.parse_import_statement()
+				self.check_peek_token(TokenType.SEMICOLON)
 			case _:
 				statement = self.parse_expression_statement()
 				self.check_peek_token(TokenType.SEMICOLON)
 		self.next_token()
 		return statement
 
-	def parse_program(self):
-		program = []
+	def statements(self) -> Iterator[Statement]:
+		# Statements are handed out as soon as they are parsed
 		while self.current_token.type != TokenType.EOF:
-			statement = self.parse_statement()
-			self.generator.generate_statement(statement, self.generator.main)
-			program.append(statement)
-		self.generator.write_file("output.ch8")
-		return program
+			yield self.parse_statement()
+
+	def parse_program(self) -> list[Statement]:
+		return list(self.statements())
 
 def main():
 	code = ""
 	with open("conditionals.c8c", "r") as file:
 		code = file.read()
-	parser = Parser(code)
-	program = parser.parse_program()
+	program = Parser(code).parse_program()
 	for statement in program:
 		print(statement)
 
@@ -0,0 +1,305 @@
+import json
+import os
+from typing import Callable
+
+from code_generator import Instruction, LoadInstruction, link_jumps, relocate_jumps
+
+class PeepholeException(Exception):
+	pass
+
+# Opcodes that conditionally skip the next instruction
+SKIP_OPS = (0x3, 0x4, 0x5, 0x9, 0xE)
+# Opcodes whose lowest twelve bits are an address
+ADDRESS_OPS = (0x0, 0x1, 0x2, 0xA, 0xB)
+# Opcodes whose lowest eight bits are a byte
+BYTE_OPS = (0x3, 0x4, 0x6, 0x7, 0xC, 0xE, 0xF)
+
+HEX_DIGITS = "0123456789ABCDEF"
+
+# Rules found by superoptimizer.py
+REWRITE_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "superoptimized.json")
+
+def encode(instruction: Instruction) -> int | None:
+	# Symbolic loads don't have their address yet so they never match
+	if isinstance(instruction, LoadInstruction):
+		return None
+	return instruction.word()
+
+def decode(word: int) -> Instruction:
+	op = word >> 12
+	if op in ADDRESS_OPS:
+		return Instruction(op=op, nnn=word & 0xFFF)
+	if op in BYTE_OPS:
+		return Instruction(op=op, x=word >> 8 & 0xF, kk=word & 0xFF)
+	return Instruction(op=op, x=word >> 8 & 0xF, y=word >> 4 & 0xF, n=word & 0xF)
+
+def skips(instruction: Instruction) -> bool:
+	# 5XY2 and 5XY3 share their opcode with 5XY0 but don't skip
+	return instruction.op in SKIP_OPS and not (instruction.op == 0x5 and instruction.n)
+
+def reads(instruction: Instruction) -> set[int]:
+	match instruction.op, instruction.n, instruction.kk:
+		case (0x3 | 0x4 | 0x7 | 0xE, _, _):
+			return {instruction.x}
+		case (0x5, 0x2, _):
+			return set(range(instruction.x, instruction.y + 1))
+		case (0x5, 0x3, _):
+			return set()
+		case (0x5 | 0x9 | 0xD, _, _):
+			return {instruction.x, instruction.y}
+		case (0x8, 0x0, _):
+			return {instruction.y}
+		case (0x8, 0x6 | 0xE, _):
+			return {instruction.x}
+		case (0x8, _, _):
+			return {instruction.x, instruction.y}
+		case (0xB, _, _):
+			return {0x0}
+		case (0xF, _, 0x15 | 0x18 | 0x1E | 0x29 | 0x33):
+			return {instruction.x}
+		case (0xF, _, 0x55):
+			return set(range(instruction.x + 1))
+	return set()
+
+def writes(instruction: Instruction) -> set[int]:
+	match instruction.op, instruction.n, instruction.kk:
+		case (0x6 | 0x7 | 0xC, _, _):
+			return {instruction.x}
+		case (0x5, 0x3, _):
+			return set(range(instruction.x, instruction.y + 1))
+		case (0x8, 0x4 | 0x5 | 0x6 | 0x7 | 0xE, _):
+			return {instruction.x, 0xF}
+		case (0x8, _, _):
+			return {instruction.x}
+		case (0xD, _, _):
+			return {0xF}
+		case (0xF, _, 0x07 | 0x0A):
+			return {instruction.x}
+		case (0xF, _, 0x65):
+			return set(range(instruction.x + 1))
+	return set()
+
+def live_registers(instructions: list[Instruction], words: list[int]) -> list[int]:
+	# The registers that may be read before they are written, on some path
+	# starting at each position, as bit masks. Calls and computed jumps are
+	# assumed to read every register. The masks only grow, so repeating the
+	# backward sweep until nothing changes ends after a few sweeps per loop depth.
+	# Equal words have equal effects, so each is only worked out once
+	positions = {id(instruction): position for position, instruction in enumerate(instructions)}
+	known: dict[int, tuple[int, int]] = {}
+	effects = []
+	for instruction, word in zip(instructions, words):
+		effect = known.get(word)
+		if effect is None:
+			if instruction.op in (0x0, 0x2, 0xB) and instruction.nnn != 0x0E0:
+				effect = (0xFFFF, 0)
+			else:
+				effect = (mask(reads(instruction)), mask(writes(instruction)))
+			known[word] = effect
+		effects.append(effect)
+	live = [0] * (len(instructions) + 2)
+	changed = True
+	while changed:
+		changed = False
+		for position in range(len(instructions) - 1, -1, -1):
+			instruction = instructions[position]
+			if instruction.op == 0x1:
+				after = live[positions[id(instruction.target)]]
+			elif skips(instruction):
+				after = live[position + 1] | live[position + 2]
+			else:
+				after = live[position + 1]
+			read, written = effects[position]
+			value = read | after & ~written
+			if value != live[position]:
+				live[position] = value
+				changed = True
+	return live
+
+def mask(registers: set[int]) -> int:
+	return sum(1 << register for register in registers)
+
+def fields(pattern: str) -> list[tuple[str, int]]:
+	# Splits a pattern like "7xkk" into ("7", 1), ("x", 1), ("k", 2)
+	result = []
+	for char in pattern:
+		if result and char not in HEX_DIGITS and result[-1][0] == char:
+			result[-1] = (char, result[-1][1] + 1)
+		else:
+			result.append((char, 1))
+	return result
+
+class Rule:
+	"""
+	A rewrite of consecutive instructions written with four character patterns,
+	one nibble per character. Hex digits must match as is and lowercase letters
+	bind the nibbles they cover to a variable. Repeating a letter makes a wider
+	field, like the kk in "7xkk", and a variable used in several patterns must
+	have the same value in all of them. The replacement uses the same variables
+	plus the ones returned by compute, and the rule is only applied when where
+	returns True and every register listed in dead is dead after the window.
+	"""
+	def __init__(self, name: str, pattern: list[str], replacement: list[str],
+			where: Callable[[dict[str, int]], bool] | None = None,
+			compute: Callable[[dict[str, int]], dict[str, int]] | None = None,
+			dead: list[str] = []):
+		for template in pattern + replacement:
+			if len(template) != 4:
+				raise PeepholeException(f"Invalid pattern '{template}' in rule '{name}'!")
+		for template in replacement:
+			if int(template[0], 16) in (0x1, 0x2, 0xB):
+				raise PeepholeException(f"Rule '{name}' may not create jumps!")
+		self.name = name
+		self.pattern = [fields(template) for template in pattern]
+		# The bits every word must have, as a mask and their value, checked
+		# before any variable is bound
+		self.fixed = [(int("".join("F" if char in HEX_DIGITS else "0" for char in template), 16), int("".join(char if char in HEX_DIGITS else "0" for char in template), 16)) for template in pattern]
+		# Only the fields that bind variables are left to look at
+		self.variables = [[(char, width, 16 - 4 * sum(w for _, w in template[:index + 1])) for index, (char, width) in enumerate(template) if char not in HEX_DIGITS] for template in self.pattern]
+		self.replacement = [fields(template) for template in replacement]
+		self.where = where
+		self.compute = compute
+		# Registers, as variables or hex digits, that may not be read after the window
+		self.dead = dead
+
+	def match(self, words: list[int | None]) -> dict[str, int] | None:
+		for (fixed, value), word in zip(self.fixed, words):
+			if word is None or word & fixed != value:
+				return None
+		bindings: dict[str, int] = {}
+		for variables, word in zip(self.variables, words):
+			for char, width, shift in variables:
+				value = word >> shift & (1 << 4 * width) - 1
+				if bindings.setdefault(char, value) != value:
+					return None
+		if self.where and not self.where(bindings):
+			return None
+		if self.compute:
+			bindings.update(self.compute(bindings))
+		return bindings
+
+	def rewrite(self, bindings: dict[str, int]) -> list[Instruction]:
+		instructions = []
+		for template in self.replacement:
+			word = 0
+			for char, width in template:
+				value = int(char, 16) if char in HEX_DIGITS else bindings[char]
+				word = word << 4 * width | value & (1 << 4 * width) - 1
+			instructions.append(decode(word))
+		return instructions
+
+def load_rules(path: str) -> list[Rule]:
+	# In a replacement an upper case letter is the register of its lower case
+	# letter, so one register can be used in two neighbouring nibbles. The
+	# rules were verified with every register of the pattern being different
+	try:
+		with open(path, "r") as file:
+			entries = json.load(file)["rules"]
+	except OSError:
+		return []
+	rules = []
+	for entry in entries:
+		registers = entry["registers"]
+		aliases = {char for template in entry["replacement"] for char in template if char.isupper() and char not in HEX_DIGITS}
+		rules.append(Rule(entry["name"], entry["pattern"], entry["replacement"],
+			where=lambda b, registers=registers: len({b[name] for name in registers}) == len(registers) and 0xF not in [b[name] for name in registers],
+			compute=lambda b, aliases=aliases: {alias: b[alias.lower()] for alias in aliases},
+			dead=entry["dead"]))
+	# Longer windows first, so a comparison is merged with its branch when it can be
+	return sorted(rules, key=lambda rule: -len(rule.pattern))
+
+HAND_WRITTEN_RULES = [
+	Rule("self-move", ["8xy0"], [], where=lambda b: b["x"] == b["y"]),
+	Rule("add-zero", ["7x00"], []),
+	Rule("jump-to-next", ["1002"], []),
+	Rule("overwritten-load", ["6xkk", "6xmm"], ["6xmm"]),
+	Rule("overwritten-load-by-move", ["6xkk", "8xy0"], ["8xy0"], where=lambda b: b["x"] != b["y"]),
+	Rule("load-then-add", ["6xkk", "7xmm"], ["6xss"], compute=lambda b: {"s": b["k"] + b["m"]}),
+	Rule("merge-adds", ["7xkk", "7xmm"], ["7xss"], compute=lambda b: {"s": b["k"] + b["m"]}),
+	Rule("move-back", ["8xy0", "8yx0"], ["8xy0"]),
+	Rule("add-immediate", ["6ykk", "8xy4"], ["7xkk"], where=lambda b: b["x"] != b["y"], dead=["y", "F"]),
+]
+
+RULES = load_rules(REWRITE_TABLE) + HAND_WRITTEN_RULES
+
+class Peephole:
+	def __init__(self, rules: list[Rule] = RULES):
+		self.rules = rules
+		# The rules that can match at an instruction, by its opcode, in the same order
+		self.by_op = [[rule for rule in rules if rule.pattern[0][0][0] == f"{op:X}" or rule.pattern[0][0][0] not in HEX_DIGITS] for op in range(16)]
+		self.fired: dict[str, int] = {rule.name: 0 for rule in rules}
+
+	def run(self, instructions: list[Instruction]) -> list[Instruction]:
+		link_jumps(instructions)
+		while True:
+			relocate_jumps(instructions)
+			optimized = self.run_pass(instructions)
+			if len(optimized) == len(instructions) and all(a is b for a, b in zip(optimized, instructions)):
+				break
+			instructions = optimized
+		relocate_jumps(instructions)
+		return instructions
+
+	def run_pass(self, instructions: list[Instruction]) -> list[Instruction]:
+		words = [encode(instruction) for instruction in instructions]
+		live = live_registers(instructions, words)
+		sources: dict[int, list[int]] = {}
+		for position, instruction in enumerate(instructions):
+			if instruction.target:
+				sources.setdefault(id(instruction.target), []).append(position)
+		# Jumps into a rewritten window are sent to whatever replaced its first instruction
+		forward: dict[int, Instruction] = {}
+		optimized = []
+		position = 0
+		while position < len(instructions):
+			rewritten = False
+			if position == 0 or not skips(instructions[position - 1]):
+				for rule in self.by_op[instructions[position].op]:
+					end = position + len(rule.pattern)
+					if end > len(instructions):
+						continue
+					bindings = rule.match(words[position:end])
+					if bindings is None or not self.is_window(instructions, position, end, sources):
+						continue
+					dead = [bindings[name] if name in bindings else int(name, 16) for name in rule.dead]
+					# A window ending in a skip continues at either of the next two instructions
+					exits = [end, end + 1] if skips(instructions[end - 1]) else [end]
+					if any(live[exit] >> register & 1 for exit in exits for register in dead):
+						continue
+					replacement = rule.rewrite(bindings)
+					for instruction in replacement:
+						instruction.line = instructions[position].line
+						instruction.call = instructions[position].call
+						instruction.node = instructions[position].node
+					if replacement:
+						forward[id(instructions[position])] = replacement[0]
+					elif end < len(instructions):
+						forward[id(instructions[position])] = instructions[end]
+					optimized += replacement
+					self.fired[rule.name] += 1
+					position = end
+					rewritten = True
+					break
+			if not rewritten:
+				optimized.append(instructions[position])
+				position += 1
+
+		for instruction in optimized:
+			if instruction.target:
+				while id(instruction.target) in forward:
+					instruction.target = forward[id(instruction.target)]
+		return optimized
+
+	def is_window(self, instructions: list[Instruction], start: int, end: int, sources: dict[int, list[int]]) -> bool:
+		# Only the first instruction of a window may be jumped to from outside
+		# of it. Skips and jumps inside the window are part of the pattern, and
+		# jump tables are never touched
+		if any(instruction.table for instruction in instructions[start:end]):
+			return False
+		for position in range(start + 1, end):
+			if any(source < start or source >= end for source in sources.get(id(instructions[position]), [])):
+				return False
+		return True
+
+	def report(self) -> str:
+		return "\n".join(f"Peephole rule '{name}' fired {count} times" for name, count in self.fired.items() if count)
@@ -0,0 +1,275 @@
+import os
+import tracemalloc
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from tokens import Token
+from lexer import Lexer
+from parser import Parser
+from abstract_syntax_tree import Statement, Import
+from semantic_analyzer import SemanticAnalyzer
+from dead_code import DeadCodeEliminator
+from code_generator import CodeGenerator
+from control_flow import ControlFlowGraph
+from peephole import Peephole, RULES, HAND_WRITTEN_RULES
+from linker import ObjectFile, Linker, LinkerException, source_hash
+from outlining import Outliner
+from execution_profile import Profile, promotable
+from emulator import KeyTrace, record_profile
+from targets import Target, CHIP8
+
+# How many of the hottest variables a profile may move into registers
+PROMOTED_VARIABLES = 4
+
+# -O0 translates every statement as is, -O1 adds dead code elimination, the
+# IR passes and the hand written peephole rules, -O2 adds block layout, the
+# superoptimized rules and profile guidance and -Os is -O2 without the
+# profile guided changes that make the program larger and with repeated
+# code moved into subroutines
+OPTIMIZATION_LEVELS = ("0", "1", "2", "s")
+
+class ImportException(Exception):
+	pass
+
+class BudgetException(Exception):
+	pass
+
+class Pipeline:
+	"""
+	The compiler as a chain of stages: tokens, syntax tree, semantic pass,
+	optimizer, code generation and emitting the ROM image. Every stage takes
+	the output of the previous one, so they can be run on their own. In a
+	single-pass build the first stages are chained as generators and each
+	statement is compiled as soon as it has been parsed. Otherwise every stage
+	is run to completion before the next one, which lets the optimizer see
+	the whole program and records how long each stage took.
+
+	Imported modules are compiled by pipelines of their own into object files
+	that are kept next to their source and reused while neither the source
+	nor the symbols of the modules it imports have changed.
+
+	A profile recorded from an earlier build guides the optimizations of the
+	program itself but not of the modules it imports. Modules are compiled at
+	the optimization level and for the target of the program.
+	"""
+	def __init__(self, code: str, path: str | None = None, single_pass: bool = False, dump_ir: bool = False, parent: "Pipeline | None" = None, profile: Profile | None = None, level: str = "2", target: Target = CHIP8):
+		self.code = code
+		self.path = path
+		self.single_pass = single_pass
+		self.dump_ir = dump_ir
+		self.level = level
+		self.target = target
+		self.warnings: list[str] = []
+		if profile and level not in ("2", "s"):
+			self.warnings.append(f"Warning: The profile is ignored at -O{level}")
+			profile = None
+		self.profile = profile
+		self.semantic = SemanticAnalyzer(target)
+		self.generator = CodeGenerator(self.semantic, profile, level, target)
+		self.object: ObjectFile | None = None
+		if profile and profile.source and profile.source != source_hash(code):
+			self.warnings.append("Warning: The profile was recorded for a different version of the program")
+		self.reports: list[str] = []
+		self.timings: dict[str, float] = {}
+		# Peak traced memory of each stage, only kept while tracemalloc traces
+		self.peaks: dict[str, int] = {}
+
+		# Modules are shared with the pipelines of imported modules. objects is
+		# in link order, so every module comes after the modules it imports
+		self.modules: dict[str, ObjectFile] = parent.modules if parent else {}
+		self.objects: list[ObjectFile] = parent.objects if parent else []
+		self.loading: set[str] = parent.loading if parent else set()
+		self.parent = parent
+		# Interface hashes of the modules this one imports
+		self.dependencies: dict[str, str] = {}
+
+	def tokens(self) -> Iterator[Token]:
+		return Lexer(self.code).tokens()
+
+	def parse(self, tokens: Iterable[Token]) -> Iterator[Statement]:
+		return Parser(tokens).statements()
+
+	def analyze(self, statements: Iterable[Statement]) -> Iterator[Statement]:
+		for statement in statements:
+			if isinstance(statement, Import):
+				self.import_module(statement)
+				continue
+			self.semantic.analyze_statement(statement)
+			yield statement
+
+	def optimize(self, program: list[Statement]) -> list[Statement]:
+		if self.level == "0":
+			return program
+		# Everything a library declares may be used by the modules importing it
+		keep = set(self.semantic.symbols) if self.parent else set(self.semantic.imported)
+		eliminator = DeadCodeEliminator(self.semantic, keep)
+		program = eliminator.run(program)
+		self.warnings += eliminator.warnings
+		if self.profile:
+			self.generator.promote(promotable(program, self.semantic, self.profile, PROMOTED_VARIABLES, keep))
+		return program
+
+	def generate(self, program: list[Statement]):
+		self.generator.generate_program(program, self.dump_ir)
+
+	def finish(self):
+		# Machine level passes that work on the generated instructions
+		self.generator.finish()
+		if self.level in ("2", "s"):
+			graph = ControlFlowGraph(self.generator.main, self.profile)
+			self.generator.main = graph.instructions()
+			self.reports.append(graph.report())
+		if self.level != "0":
+			peephole = Peephole(RULES if self.level in ("2", "s") else HAND_WRITTEN_RULES)
+			self.generator.main = peephole.run(self.generator.main)
+			if peephole.report():
+				self.reports.append(peephole.report())
+		if self.level == "s" and not self.parent:
+			# Modules fall through to the module linked after them, so only the
+			# program itself gets subroutines after its end
+			outliner = Outliner()
+			self.generator.main = outliner.run(self.generator.main)
+			if outliner.subroutines:
+				self.reports.append(outliner.report())
+		if self.profile:
+			lowering = self.generator.lowering
+			promoted = ", ".join(self.generator.promoted) or "no variables"
+			self.reports.append(f"Profile: inverted {lowering.inverted} branches, unrolled {lowering.unrolled} loops, expanded {lowering.expanded} multiplications and kept {promoted} in registers")
+		self.object = ObjectFile.build(self.path or "<main>", self.generator.main, self.semantic, self.generator.sprites, self.generator.arrays)
+		self.object.source = self.object_hash(self.code)
+		self.object.dependencies = self.dependencies
+
+	def object_hash(self, code: str) -> str:
+		# Objects compiled at another optimization level or for another target
+		# are compiled again
+		return source_hash(f"-O{self.level} --target {self.target}\n{code}")
+
+	def link(self) -> Linker:
+		return Linker(self.objects + [self.object], self.target)
+
+	def emit(self) -> bytes:
+		return self.link().link()
+
+	def record_profile(self, keys: KeyTrace, cycles: int) -> Profile:
+		# Runs the linked program and attributes the counts to its source lines
+		linker = self.link()
+		image = linker.link()
+		lines, addresses = record_profile(image, linker.instruction_addresses[self.object.name], self.generator.main, keys, cycles, self.target)
+		return Profile(lines, addresses, source_hash(self.code))
+
+	def import_module(self, statement: Import):
+		directory = os.path.dirname(self.path) if self.path else ""
+		path = os.path.normpath(os.path.join(directory, statement.path))
+		module = self.load_module(path, statement)
+		self.dependencies[path] = module.interface_hash()
+		for name, type in module.types().items():
+			self.semantic.add_imported_symbol(name, type, path)
+
+	def load_module(self, path: str, statement: Import) -> ObjectFile:
+		if path in self.modules:
+			return self.modules[path]
+		if path in self.loading:
+			raise ImportException(f"Module '{path}' imports itself at {statement.token.line}:{statement.token.column}")
+		try:
+			with open(path, "r") as file:
+				code = file.read()
+		except OSError:
+			raise ImportException(f"Cannot read module '{path}' at {statement.token.line}:{statement.token.column}")
+
+		self.loading.add(path)
+		object_path = os.path.splitext(path)[0] + ".c8o"
+		module = ObjectFile.load(object_path)
+		if module and module.source == self.object_hash(code) and all(self.load_module(dependency, statement).interface_hash() == expected for dependency, expected in module.dependencies.items()):
+			self.reports.append(f"Reused {object_path}")
+		else:
+			pipeline = Pipeline(code, path, self.single_pass, parent=self, level=self.level, target=self.target)
+			pipeline.run()
+			module = pipeline.object
+			module.save(object_path)
+			self.warnings += pipeline.warnings
+			self.reports.append(f"Compiled {path}")
+		self.loading.remove(path)
+
+		self.modules[path] = module
+		self.objects.append(module)
+		return module
+
+	def timed(self, name: str, stage: Callable, *arguments):
+		tracing = tracemalloc.is_tracing()
+		if tracing:
+			tracemalloc.reset_peak()
+		start = perf_counter()
+		result = stage(*arguments)
+		self.timings[name] = perf_counter() - start
+		if tracing:
+			self.peaks[name] = tracemalloc.get_traced_memory()[1]
+		return result
+
+	def run(self, emit: bool = True) -> list[Statement]:
+		# Without emit the program is only compiled into its object file, so
+		# programs too large for the memory of the target can be compiled too
+		if self.single_pass:
+			program = []
+			for statement in self.analyze(self.parse(self.tokens())):
+				self.generator.generate_statement(statement, self.dump_ir)
+				program.append(statement)
+			self.finish()
+			return program
+
+		tokens = self.timed("lex", lambda: list(self.tokens()))
+		program = self.timed("parse", lambda: list(self.parse(tokens)))
+		program = self.timed("analyze", lambda: list(self.analyze(program)))
+		program = self.timed("optimize", self.optimize, program)
+		self.timed("generate", self.generate, program)
+		self.timed("finish", self.finish)
+		if emit and not self.parent:
+			self.timed("emit", self.emit)
+		return program
+
+	def write_file(self, filename: str, budget: int | None = None):
+		for warning in self.warnings:
+			print(warning)
+		# Linking fails before the file is touched
+		linker = self.link()
+		image = linker.link()
+		with open(filename, "wb") as output:
+			output.write(image)
+		print(f"The program is {linker.code_size} bytes large!")
+		if budget is not None:
+			print(size_report(linker, budget))
+		if linker.sprites_size:
+			print(f"Sprite data packed from {linker.sprites_size} to {linker.packed_size} bytes")
+		for report in self.reports:
+			print(report)
+
+def size_report(linker: Linker, budget: int) -> str:
+	sections = linker.sections()
+	lines = [f"The image takes {sum(sections.values())} of the {budget} bytes of the ROM budget:"]
+	lines += [f"  {section:<10} {size:>5}" for section, size in sections.items()]
+	return "\n".join(lines)
+
+def over_budget(pipeline: Pipeline, budget: int) -> str | None:
+	# Why the image of a compiled pipeline can't be written, or None when it can
+	linker = pipeline.link()
+	try:
+		image = linker.link()
+	except LinkerException as exception:
+		return f"{exception}\n{size_report(linker, budget)}"
+	if len(image) > budget:
+		return f"The program is {len(image)} bytes large, which is over the ROM budget of {budget} bytes\n{size_report(linker, budget)}"
+	return None
+
+def compile_within_budget(code: str, path: str | None, budget: int, **options) -> tuple[Pipeline, list[Statement]]:
+	# A program over the budget is compiled again with -Os. If it still
+	# doesn't fit, nothing is written and the sizes of its sections are reported
+	pipeline = Pipeline(code, path, **options)
+	program = pipeline.run(emit=False)
+	problem = over_budget(pipeline, budget)
+	if problem and pipeline.level != "s":
+		pipeline = Pipeline(code, path, **options | {"level": "s"})
+		program = pipeline.run(emit=False)
+		pipeline.reports.append(f"The program didn't fit in the ROM budget of {budget} bytes at -O{options.get("level", "2")}, so it was compiled with -Os")
+		problem = over_budget(pipeline, budget)
+	if problem:
+		raise BudgetException(problem)
+	return pipeline, program
@@ -0,0 +1,91 @@
+import json
+
+from abstract_syntax_tree import Statement
+from execution_profile import variable_weights
+from ir_passes import ALLOCATABLE
+from pipeline import Pipeline, PROMOTED_VARIABLES
+import semantic_analyzer
+
+class Remarks:
+	"""
+	What the compiler did with a program and why: where every variable was
+	kept, what happened to every loop and switch, how many registers every
+	line needed, how many instructions every kind of syntax tree node became
+	and how the bytes of the image are spent. Imported modules are only
+	counted in the sizes.
+	"""
+	def __init__(self, pipeline: Pipeline, program: list[Statement]):
+		self.pipeline = pipeline
+		self.program = program
+		self.linker = pipeline.link()
+		self.image = self.linker.link()
+
+	def variables(self) -> dict[str, str]:
+		generator = self.pipeline.generator
+		profile = self.pipeline.profile
+		weights = variable_weights(self.program, profile) if profile else {}
+		remarks = {}
+		for name, symbol in self.pipeline.semantic.symbols.items():
+			if not isinstance(symbol, semantic_analyzer.Integer) or name in self.pipeline.semantic.imported:
+				continue
+			if name in generator.promoted:
+				remarks[name] = f"promoted to V{generator.promoted[name]:X}"
+			elif name in generator.demoted:
+				remarks[name] = "kept in memory, the registers ran out"
+			elif not profile:
+				remarks[name] = "kept in memory, there is no profile"
+			elif not weights.get(name):
+				remarks[name] = "kept in memory, it wasn't used in the profile"
+			else:
+				remarks[name] = f"kept in memory, only the {PROMOTED_VARIABLES} most used variables are promoted"
+		return remarks
+
+	def loops(self) -> dict[int, str]:
+		return dict(sorted(self.pipeline.generator.lowering.loops.items()))
+
+	def switches(self) -> dict[int, str]:
+		return dict(sorted(self.pipeline.generator.lowering.switches.items()))
+
+	def pressure(self) -> dict[int, int]:
+		return {line: registers for line, registers in sorted(self.pipeline.generator.pressure.items()) if line is not None}
+
+	def instructions(self) -> dict[str, int]:
+		# Instructions the compiler adds itself, like the final halt, belong to the program
+		counts: dict[str, int] = {}
+		for instruction in self.pipeline.generator.main:
+			node = instruction.node or "Program"
+			counts[node] = counts.get(node, 0) + 1
+		return dict(sorted(counts.items(), key=lambda count: (-count[1], count[0])))
+
+	def data(self) -> dict:
+		return {
+			"file": self.pipeline.path or "<main>",
+			"level": self.pipeline.level,
+			"target": str(self.pipeline.target),
+			"variables": self.variables(),
+			"loops": {str(line): remark for line, remark in self.loops().items()},
+			"switches": {str(line): remark for line, remark in self.switches().items()},
+			"register_pressure": {"available": len(ALLOCATABLE) - len(self.pipeline.generator.promoted), "lines": {str(line): registers for line, registers in self.pressure().items()}},
+			"instructions": self.instructions(),
+			"bytes": self.linker.sections(),
+		}
+
+	def json(self) -> str:
+		return json.dumps(self.data(), indent="\t")
+
+	def text(self) -> str:
+		source = self.pipeline.code.splitlines()
+		available = len(ALLOCATABLE) - len(self.pipeline.generator.promoted)
+		sections = [
+			[f"Remarks for {self.pipeline.path or "<main>"} at -O{self.pipeline.level} for {self.pipeline.target}"],
+			["Variables:"] + [f"  {name}: {remark}" for name, remark in self.variables().items()],
+			["Loops, which are unrolled or left alone but never rotated:"] + [f"  line {line}: {remark}" for line, remark in self.loops().items()],
+			["Switches:"] + [f"  line {line}: {remark}" for line, remark in self.switches().items()],
+			[f"Peak register pressure, out of {available} registers:"] + [f"  line {line:<4} {registers:>2}  {source[line - 1].strip() if line <= len(source) else ""}" for line, registers in self.pressure().items()],
+			["Instructions per syntax tree node:"] + [f"  {node:<20} {count}" for node, count in self.instructions().items()],
+			[f"Bytes, {len(self.image)} in total:"] + [f"  {section:<20} {size}" for section, size in self.linker.sections().items()],
+		]
+		for section in sections[1:]:
+			if len(section) == 1:
+				section.append("  none")
+		return "\n\n".join("\n".join(section) for section in sections)
@@ -1,9 +1,23 @@
-from tokens import Token
+from typing import Iterable, Iterator
+
+from tokens import Token, TokenType
+from abstract_syntax_tree import Statement, Expression, Block, Identifier, Index, Infix, Prefix, Draw, Move, DrawNum, DrawChar, Pressed, NotPressed, Wait, If, While, Switch, Frame, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, ArrayDeclaration, ArrayAssignment, Import, Scroll
+import abstract_syntax_tree
+from targets import Target, CHIP8
 
 INT_MIN = 0
 INT_MAX = 255
 
 SPRITE_MAX_SIZE = 15
+# Targets with DXY0 draw sprites of this many rows 16 pixels wide, so each
+# row is a 16 bit value stored in two bytes
+WIDE_SPRITE_SIZE = 16
+WIDE_ROW_MAX = 0xFFFF
+
+SCROLL_MAX = 15
+
+# Operators that only make sense as the condition of an if or while
+LOGICAL_OPERATORS = (TokenType.AND, TokenType.OR)
 
 class Type:
 	def __init__(self, location: int, size: int):
@@ -17,19 +31,38 @@ class Integer(Type):
 		super().__init__(location, size=1)
 
 class Sprite(Type):
-	def __init__(self, location: int, size: int):
-		if size > SPRITE_MAX_SIZE:
+	def __init__(self, location: int, size: int, frames: int = 1, wide: bool = False):
+		# A sprite sheet stores its equally sized frames one after another.
+		# The size is in bytes, which is two per row for wide sprites
+		rows = size // 2 if wide else size
+		if frames < 1 or rows % frames != 0:
+			raise SemanticsException(f"Cannot split a sprite of {rows} rows into {frames} equally sized frames!")
+		if wide and rows // frames != WIDE_SPRITE_SIZE:
+			raise SemanticsException(f"Wide sprites must have {WIDE_SPRITE_SIZE} rows!")
+		if not wide and rows // frames > SPRITE_MAX_SIZE:
 			raise SemanticsException(f"Sprites may not be larger than {SPRITE_MAX_SIZE}!")
 		super().__init__(location, size)
+		self.frames = frames
+		self.wide = wide
+		self.height = rows // frames
+		# Bytes from the start of one frame to the next
+		self.stride = size // frames
+
+class Array(Type):
+	def __init__(self, location: int, size: int):
+		super().__init__(location, size)
 
 class SemanticsException(Exception):
 	pass
 
 class SemanticAnalyzer:
-	def __init__(self):
+	def __init__(self, target: Target = CHIP8):
+		self.target = target
 		# The first three bytes of the stack are used for instruction fx33's output
 		self.stack_pointer = 3
 		self.symbols: dict[str, Type] = {}
+		# Names declared in imported modules and the module each came from
+		self.imported: dict[str, str] = {}
 
 	def add_integer_symbol(self, name: str):
 		if name not in self.symbols.keys():
@@ -39,30 +72,209 @@ class SemanticAnalyzer:
 		elif not isinstance(self.symbols[name], Integer):
 			raise SemanticsException(f"Cannot reassign name '{name}' to an integer!")
 
-	def add_sprite_symbol(self, name: str, size: int):
+	def add_sprite_symbol(self, name: str, size: int, frames: int = 1, wide: bool = False):
 		if name in self.symbols.keys():
 			raise SemanticsException(f"Cannot reassign name '{name}' to a sprite!")
-		type = Sprite(self.stack_pointer, size)
+		# Sprites are placed after the variables once all of them are known,
+		# see CodeGenerator.pack_sprites
+		type = Sprite(0, size, frames, wide)
+		self.symbols[name] = type
+
+	def add_array_symbol(self, name: str, size: int):
+		if name in self.symbols.keys():
+			raise SemanticsException(f"Cannot reassign name '{name}' to an array!")
+		type = Array(self.stack_pointer, size)
 		self.symbols[name] = type
 		self.stack_pointer += type.size
 
+	def add_imported_symbol(self, name: str, type: Type, module: str):
+		# Imported symbols are laid out by the linker, so they take no space here
+		if name in self.symbols:
+			if self.imported.get(name) == module:
+				return
+			raise SemanticsException(f"Cannot import name '{name}' from {module} because it is already declared!")
+		self.symbols[name] = type
+		self.imported[name] = module
+
+	def remove_symbol(self, name: str):
+		# Everything stored after the removed symbol moves down to fill the gap
+		type = self.symbols.pop(name)
+		if isinstance(type, Sprite):
+			return
+		for other in self.symbols.values():
+			if not isinstance(other, Sprite) and other.location > type.location:
+				other.location -= type.size
+		self.stack_pointer -= type.size
+
 	def get_symbol_location(self, symbol: str):
 		return self.symbols[symbol].location
 
 	def get_symbol_size(self, symbol: str):
 		return self.symbols[symbol].size
 
+	def get_sprite_height(self, symbol: str):
+		return self.symbols[symbol].height
+
+	def is_wide_sprite(self, symbol: str) -> bool:
+		return self.symbols[symbol].wide
+
 	def check_symbol(self, token: Token):
 		literal = token.literal
 		if literal not in self.symbols:
 			raise SemanticsException(f"Identifier '{literal}' has not been declared at {token.line}:{token.column}!")
 
-	def check_integer_value(self, token: Token):
+	def check_array_index(self, token: Token, index: int | None):
+		# Only constant indices can be checked at compile time
+		literal = token.literal
+		type = self.symbols[literal]
+		if not isinstance(type, Array):
+			raise SemanticsException(f"Identifier '{literal}' is not an array at {token.line}:{token.column}!")
+		if index is not None and index >= type.size:
+			raise SemanticsException(f"Index {index} out of bounds for array '{literal}' of size {type.size} at {token.line}:{token.column}!")
+
+	def check_sprite_frame(self, token: Token, frame: int | None):
+		literal = token.literal
+		type = self.symbols[literal]
+		if not isinstance(type, Sprite):
+			raise SemanticsException(f"Identifier '{literal}' is not a sprite at {token.line}:{token.column}!")
+		if frame is not None and frame >= type.frames:
+			raise SemanticsException(f"Frame {frame} out of bounds for sprite '{literal}' with {type.frames} frames at {token.line}:{token.column}!")
+
+	def check_integer_value(self, token: Token, maximum: int = INT_MAX):
 		literal = token.literal
 		value = 0
 		if literal.startswith("0b"):
 			value = int(token.literal, 2)
 		else:
 			value = int(token.literal)
-		if not (value <= INT_MAX and value >= INT_MIN):
-			raise SemanticsException(f"Value '{value}' out of bounds {INT_MIN} <= value <= {INT_MAX} at {token.line}:{token.column}")
+		if not (value <= maximum and value >= INT_MIN):
+			raise SemanticsException(f"Value '{value}' out of bounds {INT_MIN} <= value <= {maximum} at {token.line}:{token.column}")
+
+	def check_scroll(self, scroll: Scroll):
+		token = scroll.token
+		if scroll.direction not in self.target.scrolls:
+			raise SemanticsException(f"Cannot scroll {scroll.direction} on {self.target} at {token.line}:{token.column}!")
+		if scroll.amount and not 1 <= scroll.amount.value <= SCROLL_MAX:
+			raise SemanticsException(f"Scroll amount {scroll.amount.value} out of bounds 1 <= amount <= {SCROLL_MAX} at {token.line}:{token.column}!")
+
+	def is_wide_declaration(self, statement: SpriteDeclaration) -> bool:
+		frames = statement.frames.value if statement.frames else 1
+		return self.target.wide_sprites and frames > 0 and len(statement.rows) == WIDE_SPRITE_SIZE * frames
+
+	def analyze_sprite_reference(self, ident: Identifier, frame: Expression | None):
+		self.check_symbol(ident.token)
+		if frame:
+			self.analyze_expression(frame)
+		constant = frame.value if isinstance(frame, abstract_syntax_tree.Integer) else None
+		self.check_sprite_frame(ident.token, constant)
+
+	def analyze_index(self, index: Index):
+		self.check_symbol(index.ident.token)
+		self.analyze_expression(index.index)
+		constant = index.index.value if isinstance(index.index, abstract_syntax_tree.Integer) else None
+		self.check_array_index(index.ident.token, constant)
+
+	def analyze_expression(self, expression: Expression):
+		match expression:
+			case abstract_syntax_tree.Integer():
+				self.check_integer_value(expression.token)
+			case Identifier():
+				self.check_symbol(expression.token)
+			case Index():
+				self.analyze_index(expression)
+			case Infix() if expression.operator.type in LOGICAL_OPERATORS:
+				raise SemanticsException(f"'{expression.operator.literal}' can only be used in conditions at {expression.operator.line}:{expression.operator.column}")
+			case Infix():
+				self.analyze_expression(expression.left)
+				self.analyze_expression(expression.right)
+			case Prefix():
+				self.analyze_expression(expression.right)
+			case Draw():
+				self.analyze_sprite_reference(expression.ident, expression.frame)
+				for coordinate in (expression.x, expression.y):
+					self.analyze_expression(coordinate)
+			case Move():
+				self.analyze_sprite_reference(expression.ident, expression.frame)
+				for coordinate in (expression.old_x, expression.old_y, expression.new_x, expression.new_y):
+					self.analyze_expression(coordinate)
+			case DrawNum():
+				for argument in (expression.number, expression.x, expression.y):
+					self.analyze_expression(argument)
+			case DrawChar():
+				for argument in (expression.char, expression.x, expression.y):
+					self.analyze_expression(argument)
+			case Pressed() | NotPressed() | Wait():
+				self.analyze_expression(expression.expression)
+
+	def analyze_condition(self, condition: Expression):
+		# Logical operators are compiled to branches rather than values
+		match condition:
+			case Infix() if condition.operator.type in LOGICAL_OPERATORS:
+				self.analyze_condition(condition.left)
+				self.analyze_condition(condition.right)
+			case Prefix():
+				self.analyze_condition(condition.right)
+			case _:
+				self.analyze_expression(condition)
+
+	def analyze_block(self, block: Block):
+		for statement in block.statements:
+			self.analyze_statement(statement)
+
+	def analyze_statement(self, statement: Statement):
+		match statement:
+			case ExpressionStatement():
+				self.analyze_expression(statement.expression)
+			case IntegerDeclaration():
+				# The value is checked first, so a variable can't be used to
+				# declare itself
+				self.analyze_expression(statement.expression)
+				self.add_integer_symbol(statement.ident.name)
+			case ArrayAssignment():
+				self.analyze_index(statement.target)
+				self.analyze_expression(statement.expression)
+			case SpriteDeclaration():
+				wide = self.is_wide_declaration(statement)
+				for row in statement.rows:
+					self.check_integer_value(row.token, WIDE_ROW_MAX if wide else INT_MAX)
+				size = len(statement.rows) * (2 if wide else 1)
+				if statement.frames:
+					self.check_integer_value(statement.frames.token)
+					self.add_sprite_symbol(statement.ident.name, size, statement.frames.value, wide)
+				else:
+					self.add_sprite_symbol(statement.ident.name, size, wide=wide)
+			case Scroll():
+				self.check_scroll(statement)
+			case ArrayDeclaration():
+				for value in statement.values:
+					self.check_integer_value(value.token)
+				self.add_array_symbol(statement.ident.name, len(statement.values))
+			case If():
+				self.analyze_condition(statement.condition)
+				self.analyze_block(statement.consequence)
+				if statement.alternative:
+					self.analyze_block(statement.alternative)
+			case While():
+				self.analyze_condition(statement.condition)
+				self.analyze_block(statement.block)
+			case Switch():
+				self.analyze_expression(statement.value)
+				values = set()
+				for case in statement.cases:
+					self.check_integer_value(case.value.token)
+					if case.value.value in values:
+						raise SemanticsException(f"Duplicate case {case.value.value} at {case.token.line}:{case.token.column}")
+					values.add(case.value.value)
+					self.analyze_block(case.block)
+				if statement.default:
+					self.analyze_block(statement.default)
+			case Frame():
+				self.analyze_block(statement.block)
+			case Import():
+				raise SemanticsException(f"Modules can only be imported at the top level at {statement.token.line}:{statement.token.column}!")
+
+	def analyze(self, statements: Iterable[Statement]) -> Iterator[Statement]:
+		# Checks statements one at a time as they come from the parser
+		for statement in statements:
+			self.analyze_statement(statement)
+			yield statement
@@ -0,0 +1,146 @@
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from pipeline import Pipeline, OPTIMIZATION_LEVELS
+from targets import TARGETS
+
+def compile_source(code: str, path: str | None, level: str = "2", target: str = "chip8") -> dict:
+	# Runs in a worker process, which keeps its imports between requests
+	start = perf_counter()
+	pipeline = Pipeline(code, path, level=level, target=TARGETS[target])
+	try:
+		pipeline.run()
+		image = pipeline.emit()
+	except Exception as exception:
+		return {"path": path, "ok": False, "errors": [str(exception)], "warnings": pipeline.warnings, "milliseconds": (perf_counter() - start) * 1000}
+	return {
+		"path": path,
+		"ok": True,
+		"rom": base64.b64encode(image).decode(),
+		"errors": [],
+		"warnings": pipeline.warnings,
+		"milliseconds": (perf_counter() - start) * 1000,
+	}
+
+class Counters:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = perf_counter()
+		self.requests = 0
+		self.sources = 0
+		self.failures = 0
+		self.latency = 0.0
+		self.slowest = 0.0
+
+	def record(self, sources: int, failures: int, seconds: float):
+		with self.lock:
+			self.requests += 1
+			self.sources += sources
+			self.failures += failures
+			self.latency += seconds
+			self.slowest = max(self.slowest, seconds)
+
+	def snapshot(self) -> dict:
+		with self.lock:
+			uptime = perf_counter() - self.started
+			return {
+				"requests": self.requests,
+				"sources": self.sources,
+				"failures": self.failures,
+				"uptime": uptime,
+				"average_latency_ms": self.latency / self.requests * 1000 if self.requests else 0.0,
+				"max_latency_ms": self.slowest * 1000,
+				"sources_per_second": self.sources / uptime if uptime else 0.0,
+			}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+	# One JSON request per line, answered with one JSON line:
+	#   {"sources": [{"code": "...", "path": "game.c8c", "level": "s", "target": "schip"}, ...]}
+	#   {"stats": true}
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				response = self.server.answer(json.loads(line))
+			except (ValueError, KeyError, TypeError) as exception:
+				response = {"error": f"Invalid request: {exception}"}
+			self.wfile.write(json.dumps(response).encode() + b"\n")
+			self.wfile.flush()
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""
+	A long-lived compiler listening on a Unix domain socket. Connections are
+	served by threads and the sources of a request are compiled in parallel by
+	a pool of worker processes, so the interpreter and the compiler are only
+	started once. Sources are compiled at the level and for the target of the
+	server unless they give their own.
+	"""
+	daemon_threads = True
+
+	def __init__(self, socket_path: str, workers: int | None = None, level: str = "2", target: str = "chip8"):
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		super().__init__(socket_path, RequestHandler)
+		self.socket_path = socket_path
+		# The handler threads must not be forked, so workers come from a clean server process
+		self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+		self.counters = Counters()
+		self.level = level
+		self.target = target
+
+	def settings(self, source: dict) -> tuple[str, str]:
+		level = source.get("level", self.level)
+		target = source.get("target", self.target)
+		if level not in OPTIMIZATION_LEVELS:
+			raise ValueError(f"unknown optimization level {level!r}")
+		if target not in TARGETS:
+			raise ValueError(f"unknown target {target!r}")
+		return level, target
+
+	def answer(self, request: dict) -> dict:
+		if request.get("stats"):
+			return self.counters.snapshot()
+		start = perf_counter()
+		settings = [self.settings(source) for source in request["sources"]]
+		futures = [self.pool.submit(compile_source, source["code"], source.get("path"), *setting) for source, setting in zip(request["sources"], settings)]
+		results = [future.result() for future in futures]
+		self.counters.record(len(results), sum(not result["ok"] for result in results), perf_counter() - start)
+		return {"results": results}
+
+	def server_close(self):
+		super().server_close()
+		self.pool.shutdown()
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+
+def request(socket_path: str, message: dict) -> dict:
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+		connection.connect(socket_path)
+		connection.sendall(json.dumps(message).encode() + b"\n")
+		with connection.makefile("rb") as response:
+			return json.loads(response.readline())
+
+def compile_remote(socket_path: str, sources: list[tuple[str, str | None]], **settings: str) -> list[dict]:
+	# Compiles (code, path) pairs on a running server, at the level and for
+	# the target given in settings if any. ROMs are returned as bytes
+	results = request(socket_path, {"sources": [{"code": code, "path": path} | settings for code, path in sources]})["results"]
+	for result in results:
+		if result["ok"]:
+			result["rom"] = base64.b64decode(result["rom"])
+	return results
+
+def serve(socket_path: str, workers: int | None = None, level: str = "2", target: str = "chip8"):
+	with CompileServer(socket_path, workers, level, target) as server:
+		print(f"Listening on {socket_path}, press Ctrl+C to stop")
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,274 @@
+import argparse
+import itertools
+import json
+import random
+
+from peephole import REWRITE_TABLE, HEX_DIGITS
+
+class SuperoptimizerException(Exception):
+	pass
+
+# The shifts work differently on different interpreters, so only these
+# 8XYN instructions are used
+ARITHMETIC = (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x7)
+# Loops in a pattern may not run longer than this
+MAX_STEPS = 2000
+# How many candidates of one length may be tried before giving up
+BUDGET = 5_000_000
+# Random cases a candidate has to pass before it is verified exhaustively
+SAMPLES = 32
+# Key states every key instruction is verified with: no key, each key alone
+# and all of them
+KEY_STATES = [frozenset()] + [frozenset({key}) for key in range(16)] + [frozenset(range(16))]
+
+def register(char: str) -> str:
+	# An upper case letter names the same register as its lower case letter
+	return char if char in HEX_DIGITS else char.lower()
+
+def immediate(template: str, state: dict[str, int]) -> int:
+	field = template[2:]
+	if all(char in HEX_DIGITS for char in field):
+		return int(field, 16)
+	return state[field[0]]
+
+def execute(program: list[str], state: dict[str, int], keys: frozenset = frozenset()) -> tuple[dict[str, int], bool] | None:
+	# Runs instructions written as patterns on named registers. Returns the
+	# registers and whether the last instruction skipped out of the program,
+	# or None when a jump leaves the program or it runs for too long
+	state = dict(state)
+	position = 0
+	steps = 0
+	while position < len(program):
+		steps += 1
+		if steps > MAX_STEPS:
+			return None
+		template = program[position]
+		op = int(template[0], 16)
+		x = register(template[1])
+		y = register(template[2])
+		position += 1
+		match op:
+			case 0x1:
+				offset = int(template[1:], 16)
+				if offset >= 0x800:
+					offset -= 0x1000
+				position += offset // 2 - 1
+				if not 0 <= position <= len(program):
+					return None
+			case 0x3 | 0x4:
+				if (state[x] == immediate(template, state)) == (op == 0x3):
+					position += 1
+			case 0x5 | 0x9:
+				if (state[x] == state[y]) == (op == 0x5):
+					position += 1
+			case 0x6:
+				state[x] = immediate(template, state)
+			case 0x7:
+				state[x] = state[x] + immediate(template, state) & 0xFF
+			case 0x8:
+				match int(template[3], 16):
+					case 0x0:
+						state[x] = state[y]
+					case 0x1:
+						state[x] |= state[y]
+					case 0x2:
+						state[x] &= state[y]
+					case 0x3:
+						state[x] ^= state[y]
+					case 0x4:
+						total = state[x] + state[y]
+						state[x] = total & 0xFF
+						state["F"] = int(total > 0xFF)
+					case 0x5:
+						flag = int(state[x] >= state[y])
+						state[x] = state[x] - state[y] & 0xFF
+						state["F"] = flag
+					case 0x7:
+						flag = int(state[y] >= state[x])
+						state[x] = state[y] - state[x] & 0xFF
+						state["F"] = flag
+					case _:
+						raise SuperoptimizerException(f"Unsupported instruction '{template}'")
+			case 0xE:
+				if (state[x] in keys) == (template[2:] == "9E"):
+					position += 1
+			case _:
+				raise SuperoptimizerException(f"Unsupported instruction '{template}'")
+	return state, position > len(program)
+
+def instruction(op: str, first: str, second: str, last: str) -> str:
+	# The second use of a register in neighbouring nibbles is written in upper case
+	if second == first and second not in HEX_DIGITS:
+		second = second.upper()
+	return f"{op}{first}{second}{last}"
+
+class Target:
+	"""
+	A sequence the code generator emits and the search tries to shorten.
+	Registers are lower case letters or F and a kk immediate is an input like
+	the registers. The registers in dead may hold anything afterwards, which
+	lets the search use them as scratch. The alphabet can be narrowed with
+	writable, readable and families to make longer searches affordable.
+	"""
+	def __init__(self, name: str, pattern: list[str], dead: list[str], writable: list[str] | None = None, readable: list[str] | None = None, families: tuple[str, ...] = ("load", "add", "arithmetic", "skip")):
+		self.name = name
+		self.pattern = pattern
+		self.dead = dead
+		self.registers = sorted({char for template in pattern for char in template[1:3] if char.islower() and char != "k"})
+		self.uses_keys = any(template[0] == "E" for template in pattern)
+		self.immediate = any("kk" in template for template in pattern)
+
+		written = {template[1] for template in pattern if template[0] in "678"}
+		self.writable = writable if writable is not None else sorted(written | set(dead))
+		self.readable = readable if readable is not None else self.registers + ["F"]
+		self.families = families + (("key",) if self.uses_keys else ())
+		self.outputs = [name for name in self.registers + ["F"] if name not in dead]
+		self.inputs = self.find_inputs() + (["k"] if self.immediate else [])
+
+	def find_inputs(self) -> list[str]:
+		# Registers the pattern reads before writing them
+		inputs = []
+		written = set()
+		for template in self.pattern:
+			op = template[0]
+			reads = []
+			if op in "347E":
+				reads = [template[1]]
+			elif op in "59":
+				reads = [template[1], template[2]]
+			elif op == "8":
+				reads = [template[2]] if template[3] == "0" else [template[1], template[2]]
+			for name in reads:
+				if name not in written and name not in inputs and name != "F":
+					inputs.append(name)
+			if op in "678":
+				written.add(template[1])
+		return inputs
+
+	def constants(self) -> list[str]:
+		constants = {"00", "01"}
+		for template in self.pattern:
+			if template[0] in "3467":
+				constants.add(template[2:])
+		return sorted(constants)
+
+	def alphabet(self) -> list[str]:
+		alphabet = []
+		if "load" in self.families:
+			alphabet += [f"6{target}{constant}" for target in self.writable for constant in self.constants()]
+		if "add" in self.families:
+			alphabet += [f"7{target}{constant}" for target in self.writable for constant in self.constants() if constant != "00"]
+		if "arithmetic" in self.families:
+			alphabet += [instruction("8", target, source, f"{n:X}") for target in self.writable for source in self.readable for n in ARITHMETIC if not (n == 0 and target == source)]
+		if "skip" in self.families:
+			alphabet += [f"{op}{source}{constant}" for op in "34" for source in self.readable for constant in self.constants()]
+			alphabet += [f"{op}{first}{second}0" for op in "59" for first, second in itertools.combinations(self.readable, 2)]
+		if "key" in self.families:
+			alphabet += [f"E{source}{code}" for source in self.readable for code in ("9E", "A1")]
+		return alphabet
+
+	def state(self, values: dict[str, int], garbage: random.Random) -> dict[str, int]:
+		# Registers that aren't inputs start with whatever was left in them
+		state = {name: garbage.randrange(256) for name in self.registers + ["F"]}
+		state.update(values)
+		return state
+
+	def outcome(self, program: list[str], state: dict[str, int], keys: frozenset) -> tuple | None:
+		result = execute(program, state, keys)
+		if result is None:
+			return None
+		registers, skipped = result
+		return tuple(registers[name] for name in self.outputs) + (skipped,)
+
+	def cases(self):
+		# Every value of every input with every key state
+		garbage = random.Random(0)
+		for values in itertools.product(range(256), repeat=len(self.inputs)):
+			for keys in KEY_STATES if self.uses_keys else [frozenset()]:
+				yield self.state(dict(zip(self.inputs, values)), garbage), keys
+
+	def samples(self, count: int) -> list[tuple[dict[str, int], frozenset]]:
+		# Random cases plus the ones where every input is the same, which is
+		# where comparisons change their answer
+		generator = random.Random(1)
+		samples = []
+		for position in range(count):
+			if position % 2:
+				values = {name: generator.randrange(256) for name in self.inputs}
+			else:
+				value = generator.randrange(256)
+				values = {name: value for name in self.inputs}
+			keys = generator.choice(KEY_STATES) if self.uses_keys else frozenset()
+			if self.uses_keys and position % 4 == 0:
+				keys = frozenset({values[self.inputs[0]] & 0xF})
+			samples.append((self.state(values, generator), keys))
+		return samples
+
+	def verify(self, program: list[str]) -> bool:
+		return all(self.outcome(program, state, keys) == self.outcome(self.pattern, state, keys) for state, keys in self.cases())
+
+	def search(self, budget: int = BUDGET) -> list[str] | None:
+		# Tries every program of each length shorter than the pattern and
+		# returns the first one that is equivalent for every input
+		alphabet = self.alphabet()
+		samples = [(state, keys, self.outcome(self.pattern, state, keys)) for state, keys in self.samples(SAMPLES)]
+		for length in range(len(self.pattern)):
+			if len(alphabet) ** length > budget:
+				break
+			for candidate in itertools.product(alphabet, repeat=length):
+				program = list(candidate)
+				if all(self.outcome(program, state, keys) == expected for state, keys, expected in samples) and self.verify(program):
+					return program
+		return None
+
+def targets() -> list[Target]:
+	# The sequences code_generator.py emits for comparisons, key tests and
+	# multiplications by a constant that was loaded right before
+	found = []
+	tests = {
+		"equal": ["5xy0", "1006", "6z01", "1004", "6z00"],
+		"not-equal": ["5xy0", "1006", "6z00", "1004", "6z01"],
+		"pressed": ["Ex9E", "1006", "6z01", "1004", "6z00"],
+		"not-pressed": ["ExA1", "1006", "6z01", "1004", "6z00"],
+	}
+	for name, test in tests.items():
+		for in_place in (False, True):
+			dest = "x" if in_place else "z"
+			body = [template.replace("z", dest) for template in test]
+			for constant in (False, True) if name.endswith("equal") else (False,):
+				start = ["6ykk"] if constant else []
+				dead = ["F"] + (["y"] if constant else [])
+				label = f"{name}{"-constant" if constant else ""}{"-in-place" if in_place else ""}"
+				found.append(Target(label, start + body, dead))
+				found.append(Target(f"{label}-branch-if-zero", start + body + [f"4{dest}00"], dead + [dest]))
+				found.append(Target(f"{label}-branch-if-nonzero", start + body + [f"3{dest}00"], dead + [dest]))
+	for factor in range(2, 17):
+		pattern = [f"6y{factor:02X}", "6t00", "6z00", "9xt0", "1008", "8zy4", "7t01", "1FF8"]
+		found.append(Target(f"multiply-by-{factor}", pattern, ["F", "t", "y"], writable=["z"], readable=["x", "z"], families=("arithmetic",)))
+	return found
+
+def main():
+	arguments = argparse.ArgumentParser(description="Search for shorter versions of the sequences the code generator emits and save them as peephole rules.")
+	arguments.add_argument("--budget", type=int, default=BUDGET, help="how many candidates of one length to try at most")
+	arguments.add_argument("--output", default=REWRITE_TABLE, help="where to write the rewrite table")
+	options = arguments.parse_args()
+
+	rules = []
+	for target in targets():
+		replacement = target.search(options.budget)
+		if replacement is None:
+			print(f"{target.name}: nothing shorter than {len(target.pattern)} instructions")
+			continue
+		print(f"{target.name}: {len(target.pattern)} -> {len(replacement)} instructions: {" ".join(replacement)}")
+		rules.append({
+			"name": target.name,
+			"pattern": target.pattern,
+			"replacement": replacement,
+			"dead": target.dead,
+			"registers": target.registers,
+		})
+	with open(options.output, "w") as file:
+		json.dump({"rules": rules}, file, indent="\t")
+
+if __name__ == "__main__":
+	main()
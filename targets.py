@@ -0,0 +1,30 @@
+class Target:
+	"""
+	A CHIP-8 variant the compiler can generate code for, described by the
+	extensions of the base instruction set it understands. Programs keep the
+	64x32 screen on every target, so coordinates mean the same everywhere.
+	"""
+	def __init__(self, name: str, memory: int, ranged_memory: bool = False, long_index: bool = False, wide_sprites: bool = False, scrolls: tuple[str, ...] = (), jump_quirk: bool = False):
+		self.name = name
+		# Bytes of memory, including the 512 below the program
+		self.memory = memory
+		# 5XY2 and 5XY3 save and load any range of registers, not only from V0
+		self.ranged_memory = ranged_memory
+		# F000 NNNN loads a 16 bit address into I
+		self.long_index = long_index
+		# DXY0 draws a sprite of 16 by 16 pixels
+		self.wide_sprites = wide_sprites
+		# Directions the screen can be scrolled in
+		self.scrolls = scrolls
+		# BNNN is read as BXNN and adds VX, X being the top nibble of NNN,
+		# instead of V0
+		self.jump_quirk = jump_quirk
+
+	def __str__(self) -> str:
+		return self.name
+
+CHIP8 = Target("chip8", 4096)
+SCHIP = Target("schip", 4096, wide_sprites=True, scrolls=("down", "left", "right"), jump_quirk=True)
+XOCHIP = Target("xochip", 65536, ranged_memory=True, long_index=True, wide_sprites=True, scrolls=("down", "up", "left", "right"))
+
+TARGETS = {target.name: target for target in (CHIP8, SCHIP, XOCHIP)}
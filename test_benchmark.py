@@ -0,0 +1,25 @@
+import pytest
+from benchmark import SHAPES, LIMIT, Result, exponent, synthetic
+from pipeline import Pipeline
+
+def test_exponent():
+	sizes = [100, 200, 400, 800]
+	assert exponent(sizes, [3 * size for size in sizes]) == pytest.approx(1)
+	assert exponent(sizes, [size * size for size in sizes]) == pytest.approx(2)
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_synthetic_programs(shape: str):
+	code = synthetic(300, SHAPES[shape])
+	assert code == synthetic(300, SHAPES[shape])
+	pipeline = Pipeline(code)
+	pipeline.run(emit=False)
+	assert set(pipeline.timings) == {"lex", "parse", "analyze", "optimize", "generate", "finish"}
+
+# Sizes nine times apart that still compile quickly, so timing noise barely
+# moves the fitted exponents
+FAST_SIZES = {"flat": [100, 300, 900], "nested": [100, 300, 900], "expressions": [20, 60, 180], "sprites": [100, 300, 900]}
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_linear_phases(shape: str):
+	result = Result(SHAPES[shape], FAST_SIZES[shape], repeats=5)
+	assert result.failures(LIMIT) == []
@@ -0,0 +1,28 @@
+from code_buffer import CodeBuffer
+from code_generator import Instruction, pack_sprites
+
+def test_sprite_packing():
+	sprites = {
+		"a": b'\x01\x02\x03',
+		"b": b'\x01\x02\x03',
+		"c": b'\x02\x03',
+		"d": b'\x03\x04\x05',
+		"e": b'\x09',
+	}
+	packed, offsets = pack_sprites(sprites)
+	assert len(packed) == 6
+	for name, data in sprites.items():
+		assert packed[offsets[name]:offsets[name] + len(data)] == data
+
+def test_instruction_encoding():
+	# Zero operands and negative relative jumps
+	assert Instruction(op=0x3, x=2, kk=0).word() == 0x3200
+	assert Instruction(op=0x1, nnn=0).word() == 0x1000
+	assert Instruction(op=0x1, nnn=-4).as_byte_instruction() == b"\x1f\xfc"
+	code = CodeBuffer()
+	code.byte(0x6, 0xA, 0x12)
+	code.nibbles(0x8, 0x1, 0x2, 0x4)
+	code.jump(0x1, -1)
+	assert code.tobytes() == bytes.fromhex("6a12 8124 1000")
+	assert list(code.relocated()) == [(2, ["jump", -1])]
+	assert CodeBuffer.frombytes(code.tobytes()).words == code.words
@@ -0,0 +1,50 @@
+import itertools
+import pytest
+from emulator import Emulator
+from pipeline import Pipeline, OPTIMIZATION_LEVELS
+from semantic_analyzer import SemanticsException
+
+def display(code: str, level: str = "2") -> str:
+	pipeline = Pipeline(code, level=level)
+	pipeline.run()
+	return Emulator(pipeline.emit()).run(100000).display()
+
+@pytest.mark.parametrize("condition, expected", [
+	("(a[i] && b[i]) || !c[i]", lambda a, b, c: a and b or not c),
+	("a[i] && !(b[i] || c[i])", lambda a, b, c: a and not (b or c)),
+	("!a[i] || b[i] && c[i] != 0", lambda a, b, c: not a or b and c),
+])
+def test_truth_tables(condition: str, expected):
+	# Every combination of a, b and c adds one bit to the total
+	combinations = list(itertools.product([0, 1], repeat=3))
+	arrays = "\n".join(f"array {name} = {{ {", ".join(str(values[index]) for values in combinations)} }};" for index, name in enumerate("abc"))
+	code = f"""{arrays}
+var i = 0;
+var total = 0;
+while (i != 8) {{
+	var total = total + total;
+	if ({condition}) {{
+		var total = total + 1;
+	}}
+	var i = i + 1;
+}}
+draw_num(total, 0, 0);
+"""
+	total = sum(1 << 7 - bit for bit, values in enumerate(combinations) if expected(*values))
+	for level in OPTIMIZATION_LEVELS:
+		assert display(code, level) == display(f"draw_num({total}, 0, 0);", level)
+
+def test_short_circuit():
+	# Only the draws whose result is still needed run
+	code = """sprite dot = { 128 };
+var x = 0;
+if (x && draw(dot, 0, 0)) { clear; }
+if (!x || draw(dot, 8, 0)) { draw(dot, 16, 0); }
+while (x != 1 && !draw(dot, 24, 0)) { var x = 1; }
+"""
+	assert display(code) == display("sprite dot = { 128 };\ndraw(dot, 16, 0);\ndraw(dot, 24, 0);\n")
+
+def test_logical_operators_only_in_conditions():
+	with pytest.raises(SemanticsException):
+		Pipeline("var x = 1; var y = x && 1;").run()
+	assert display("var x = 2; draw_num(!x, 0, 0); draw_num(!!x, 8, 0);") == display("draw_num(0, 0, 0); draw_num(1, 8, 0);")
@@ -0,0 +1,37 @@
+from code_generator import Instruction, INSTRUCTION_LENGTH
+from control_flow import ControlFlowGraph
+from peephole import encode
+
+def jump(offset: int) -> Instruction:
+	return Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * offset)
+
+def test_block_layout():
+	instructions = [
+		Instruction(op=0x6, x=1, kk=1),
+		jump(3),
+		Instruction(op=0x6, x=2, kk=2),
+		jump(3),
+		Instruction(op=0x6, x=3, kk=3),
+		jump(-3),
+		jump(0),
+	]
+	graph = ControlFlowGraph(instructions)
+	optimized = graph.instructions()
+	assert [encode(instruction) for instruction in optimized] == [0x6101, 0x6303, 0x6202, 0x1000]
+	assert graph.removed == 3
+
+def test_jump_threading():
+	instructions = [
+		Instruction(op=0x3, x=1, kk=0),
+		jump(2),
+		Instruction(op=0x6, x=1, kk=1),
+		jump(1),
+		jump(-4),
+	]
+	graph = ControlFlowGraph(instructions)
+	optimized = graph.instructions()
+	# The skipped jump keeps its place but goes straight to the start and
+	# the last jump can no longer be reached
+	assert [encode(instruction) for instruction in optimized] == [0x3100, 0x1FFE, 0x6101, 0x1FFA]
+	assert graph.threaded == 3
+	assert graph.unreachable == 1
@@ -0,0 +1,23 @@
+from parser import Parser
+from semantic_analyzer import SemanticAnalyzer
+from dead_code import DeadCodeEliminator
+
+def parse(code: str) -> tuple[SemanticAnalyzer, list]:
+	semantic = SemanticAnalyzer()
+	return semantic, list(semantic.analyze(Parser(code).statements()))
+
+def test_unreachable_code():
+	semantic, program = parse("var x = 1; if (0) { var x = 2; } else { draw_num(x, 0, 0); } while (1) { clear; } clear;")
+	eliminator = DeadCodeEliminator(semantic)
+	program = eliminator.run(program)
+	assert [statement.__str__() for statement in program] == ["var x = 1;", "draw_num(x, 0, 0);", "while (1) {\n\tclear;\n}"]
+	assert len(eliminator.warnings) == 2
+	assert eliminator.warnings[1] == "Warning: Unreachable statement removed at 1:83"
+
+def test_dead_stores():
+	semantic, program = parse("sprite s = { 1 }; sprite t = { 2 }; var a = 1; var b = 2; var b = b + 1; var c = draw(s, a, a);")
+	eliminator = DeadCodeEliminator(semantic)
+	program = eliminator.run(program)
+	assert [statement.__str__() for statement in program] == ["sprite s = { 1 };", "var a = 1;", "draw(s, a, a);"]
+	assert list(semantic.symbols) == ["s", "a"]
+	assert semantic.get_symbol_location("a") == 3
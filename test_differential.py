@@ -0,0 +1,72 @@
+import random
+import re
+
+import differential
+from differential import ProgramGenerator, Compound, source, random_keys, compare, shrink
+from pipeline import Pipeline, OPTIMIZATION_LEVELS
+from execution_profile import Profile
+
+CODE = """var x = 0;
+var total = 0;
+while (x != 10) {
+	var total = total + x * 3;
+	var x = x + 1;
+}
+draw_num(total, 0, 0);
+"""
+
+def test_optimization_levels():
+	sizes = {}
+	for level in OPTIMIZATION_LEVELS:
+		pipeline = Pipeline(CODE, level=level)
+		pipeline.run()
+		sizes[level] = len(pipeline.emit())
+	assert sizes["0"] > sizes["1"] > sizes["2"]
+
+	pipeline = Pipeline(CODE, profile=Profile({3: 10}), level="1")
+	assert pipeline.profile is None
+	assert pipeline.warnings == ["Warning: The profile is ignored at -O1"]
+
+def test_random_programs_agree():
+	generator = random.Random(1)
+	compared = 0
+	for _ in range(5):
+		statements = ProgramGenerator(generator).program()
+		difference, runs = compare(source(statements), [random_keys(generator) for _ in range(2)])
+		assert difference is None
+		compared += len(runs)
+	assert compared
+
+def test_uncompilable(monkeypatch):
+	difference, runs = compare("var x = y;", [random_keys(random.Random(0))])
+	assert runs is None and difference.startswith("No level compiles the program")
+
+	# A level rejecting what another accepts is a difference
+	build = differential.build
+	def failing(code: str, level: str):
+		if level == "0":
+			raise Exception("too large")
+		return build(code, level)
+	monkeypatch.setattr(differential, "build", failing)
+	difference, runs = compare(CODE, [random_keys(random.Random(0))])
+	assert runs == [] and difference == "-O0 fails to compile the program that -O1 compiles: too large"
+
+def test_shrink():
+	statements = ["var v_a = 1;", Compound("if (v_a)", ["clear;", "var v_a = 2;"], ["wait(1);"]), "draw_num(v_a, 0, 0);"]
+	smallest = shrink(statements, lambda candidate: "var v_a = 2;" in source(candidate))
+	assert smallest == ["var v_a = 2;"]
+	assert source(smallest) == "var v_a = 2;\ndraw_num(v_a, 0, 0);\n"
+
+def test_generated_switches_and_conditions():
+	# Both ways of compiling a switch and the logical operators are generated
+	generator = random.Random(5)
+	switches = set()
+	operators = set()
+	for _ in range(20):
+		code = source(ProgramGenerator(generator).program())
+		pipeline = Pipeline(code)
+		pipeline.run()
+		switches |= {re.sub(r" (with|over) .*", "", kind) for kind in pipeline.generator.lowering.switches.values()}
+		operators |= set(re.findall(r"&&|\|\||!(?!=)", code))
+	assert switches == {"jump table", "decision tree"}
+	assert operators == {"&&", "||", "!"}
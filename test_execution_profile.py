@@ -0,0 +1,50 @@
+from pipeline import Pipeline
+from emulator import Emulator, KeyTrace
+
+CODE = """sprite s = { 1, 2 };
+var x = 0;
+var hits = 0;
+while (x != 40) {
+	if (x == 30) {
+		var hits = hits + 1;
+	}
+	draw(s, x * 2, 3);
+	var x = x + 1;
+}
+draw_num(hits, 0, 0);
+"""
+
+def build(profile=None) -> Pipeline:
+	pipeline = Pipeline(CODE, profile=profile)
+	pipeline.run()
+	return pipeline
+
+def test_record_profile():
+	profile = build().record_profile(KeyTrace(), 100000)
+	assert profile.count(4) == 41
+	assert profile.count(6) == 1
+	assert profile.count(9) == 40
+	assert profile.hot(9) and not profile.hot(6)
+
+def test_profile_guided_build():
+	profile = build().record_profile(KeyTrace(), 100000)
+	plain = build()
+	guided = build(profile)
+	lowering = guided.generator.lowering
+	# The body is lowered twice because the loop is unrolled
+	assert (lowering.unrolled, lowering.inverted, lowering.expanded) == (1, 2, 2)
+	assert list(guided.generator.promoted) == ["x", "hits"]
+	assert guided.generator.main[0].op == 0x6
+
+	# The same picture is drawn in fewer instructions
+	before = Emulator(plain.emit()).run(100000)
+	after = Emulator(guided.emit()).run(100000)
+	assert before.halted and after.halted
+	assert after.display() == before.display()
+	assert after.cycles < before.cycles
+
+def test_key_trace():
+	keys = KeyTrace.parse("0\n100 7 a # both\n200\n")
+	assert keys.pressed(50) == set()
+	assert keys.pressed(150) == {0x7, 0xA}
+	assert keys.pressed(250) == set()
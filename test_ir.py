@@ -0,0 +1,34 @@
+from parser import Parser
+from semantic_analyzer import SemanticAnalyzer
+from lowering import Lowering
+from ir import Const, Load, Store, Binary, dump
+from ir_passes import optimize, allocate_registers
+
+def lower(code: str):
+	semantic = SemanticAnalyzer()
+	program = list(semantic.analyze(Parser(code).statements()))
+	return Lowering(semantic).lower_program(program)
+
+def test_constant_folding():
+	operations = optimize(lower("var x = 2 * 3 + 1; var y = x * 1 + 0;"))
+	assert [type(operation) for operation in operations] == [Const, Store, Store]
+	assert operations[0].value == 7
+	# The second store reuses the value of the first one instead of loading x
+	assert operations[2].source is operations[0].dest
+
+def test_common_subexpressions():
+	operations = optimize(lower("var x = 1; while (1) { var y = x + x; var z = x + x; }"))
+	text = dump(operations)
+	assert text.count("load x") == 1
+	assert text.count(" + ") == 1
+	assert len([operation for operation in operations if isinstance(operation, (Load, Binary))]) == 2
+
+def test_register_allocation():
+	operations = optimize(lower("var a = 1; var b = 2; while (1) { var c = a + b - a; }"))
+	allocate_registers(operations)
+	for operation in operations:
+		for register in operation.operands() + ([operation.dest] if operation.dest else []):
+			assert 0x1 <= register.physical <= 0xE
+	# The destination of an operation takes over its dying left operand
+	subtract = next(operation for operation in operations if isinstance(operation, Binary) and operation.operator == "-")
+	assert subtract.dest.physical == subtract.left.physical
@@ -67,6 +67,27 @@ def test_lexing():
 				(TokenType.SEMICOLON, ";"),
 				(TokenType.EOF, ""),
 			)
+		),
+		("frame { wait(2); }",
+			(
+				(TokenType.FRAME, "frame"),
+				(TokenType.LBRACE, "{"),
+				(TokenType.WAIT, "wait"),
+				(TokenType.LPAREN, "("),
+				(TokenType.INT, "2"),
+				(TokenType.RPAREN, ")"),
+				(TokenType.SEMICOLON, ";"),
+				(TokenType.RBRACE, "}"),
+				(TokenType.EOF, ""),
+			)
+		),
+		('import "sprites/pelaaja.c8c";',
+			(
+				(TokenType.IMPORT, "import"),
+				(TokenType.STRING, "sprites/pelaaja.c8c"),
+				(TokenType.SEMICOLON, ";"),
+				(TokenType.EOF, ""),
+			)
 		)
 	)
 
@@ -92,6 +113,12 @@ def test_binary_lexing():
 		assert token.type is TokenType.INT
 		assert token.literal == case
 
+def test_unterminated_string():
+	lexer = Lexer('import "kesken')
+	lexer.next_token()
+	with pytest.raises(LexerException):
+		lexer.next_token()
+
 def test_invalid_binary():
 	code = "0b"
 	lexer = Lexer(code)
@@ -0,0 +1,50 @@
+import os
+import pytest
+from pipeline import Pipeline, ImportException
+from code_buffer import CodeBuffer
+from linker import ObjectFile, Linker, LinkerException
+from semantic_analyzer import SemanticsException
+
+def build(path) -> Pipeline:
+	with open(path) as file:
+		pipeline = Pipeline(file.read(), str(path))
+	pipeline.run()
+	return pipeline
+
+def test_imports(tmp_path):
+	(tmp_path / "shapes.c8c").write_text("sprite dot = { 128 }; var size = 3;")
+	(tmp_path / "main.c8c").write_text('import "shapes.c8c"; draw(dot, size, size);')
+	pipeline = build(tmp_path / "main.c8c")
+	assert pipeline.reports[0] == f"Compiled {tmp_path / "shapes.c8c"}"
+	assert os.path.exists(tmp_path / "shapes.c8o")
+	linker = pipeline.link()
+	image = linker.link()
+	assert image.endswith(b'\x00\x80')
+	# Only the halt at the end of the main module is left
+	words = [image[position] >> 4 for position in range(0, linker.code_size, 2)]
+	assert words.count(0x1) == 1
+	# The library keeps its variable although only the main module reads it
+	assert "size" in pipeline.objects[0].symbols
+
+	# Unchanged modules are reused and code changes don't touch importers
+	assert build(tmp_path / "main.c8c").reports[0] == f"Reused {tmp_path / "shapes.c8o"}"
+	(tmp_path / "shapes.c8c").write_text("sprite dot = { 64 }; var size = 4;")
+	rebuilt = build(tmp_path / "main.c8c")
+	assert rebuilt.reports[0] == f"Compiled {tmp_path / "shapes.c8c"}"
+	assert rebuilt.emit().endswith(b'\x00\x40')
+
+def test_import_errors(tmp_path):
+	(tmp_path / "a.c8c").write_text('import "b.c8c";')
+	(tmp_path / "b.c8c").write_text('import "a.c8c";')
+	with pytest.raises(ImportException):
+		build(tmp_path / "a.c8c")
+	(tmp_path / "c.c8c").write_text('sprite s = { 1 };')
+	(tmp_path / "d.c8c").write_text('import "c.c8c"; array s = { 1 };')
+	with pytest.raises(SemanticsException):
+		build(tmp_path / "d.c8c")
+
+def test_duplicate_symbols():
+	first = ObjectFile("first", CodeBuffer(), {"x": {"type": "integer", "size": 1}})
+	second = ObjectFile("second", CodeBuffer(), {"x": {"type": "integer", "size": 1}})
+	with pytest.raises(LinkerException):
+		Linker([first, second]).link()
@@ -0,0 +1,73 @@
+from code_generator import Instruction
+from emulator import Emulator
+from listing import disassemble, CostModel, Listing
+from pipeline import Pipeline
+
+CODE = """var x = 3;
+var y = 0;
+while (y != 5) {
+	var y = y + x * 4;
+	draw_num(y, 0, 0);
+}
+"""
+
+def test_disassemble():
+	assert disassemble(0x00E0) == "CLS"
+	assert disassemble(0x1234) == "JP 234"
+	assert disassemble(0x6A05) == "LD VA, 05"
+	assert disassemble(0x8124) == "ADD V1, V2"
+	assert disassemble(0xD015) == "DRW V0, V1, 5"
+	assert disassemble(0xF30A) == "LD V3, K"
+	assert disassemble(0x5121) == "DW 5121"
+
+def test_cost_model():
+	# Adds V0 to V1 V2 times, which the code generator bounds to 255 rounds
+	instructions = [Instruction(0x8, 1, 0, 4), Instruction(0x7, 2, 0, 0, 0xFF), Instruction(0x3, 2, 0, 0, 0x00), Instruction(0x1, 0, 0, 0, 0, -6)]
+	instructions[3].repeats = 255
+	cost = CostModel(instructions).estimate(set(range(4)))
+	assert (cost.best, cost.worst) == (3, 3 + 255 * 4)
+
+	instructions[3].repeats = None
+	cost = CostModel(instructions).estimate(set(range(4)))
+	assert (cost.best, cost.worst) == (3, None)
+
+def test_listing():
+	pipeline = Pipeline(CODE)
+	program = pipeline.run()
+	text = Listing(pipeline, program).text()
+	assert "; 4: var y = y + x * 4;" in text
+	assert "x: DB 00" in text
+	assert "; Most expensive loops\n; 1. line 3:" in text
+	assert "draw_num" in text
+
+OUTLINED = """var x = 1;
+var y = 2;
+while (x != 5) {
+	draw_num(x + y, 0, 0);
+	var x = x + 1;
+	draw_num(x + y, 0, 0);
+	var y = y + 2;
+}
+draw_num(x + y, 0, 0);
+"""
+
+def test_outlined_listing():
+	# At -Os the calls to outlined subroutines cost what the subroutines run
+	pipeline = Pipeline(OUTLINED, level="s")
+	program = pipeline.run()
+	listing = Listing(pipeline, program)
+	assert any(instruction.op == 0x2 for instruction in listing.instructions)
+	loop = program[2]
+	region = listing.region(loop)
+	assert not region & listing.model.subroutines
+	cost = listing.model.estimate(region, per_iteration=True)
+
+	start = listing.linker.instruction_addresses[pipeline.object.name][listing.model.entry(region)]
+	emulator = Emulator(pipeline.emit())
+	rounds = []
+	while not emulator.halted:
+		if emulator.pc == start:
+			rounds.append(emulator.cycles)
+		emulator.step()
+	assert rounds[1] - rounds[0] == cost.best == cost.worst
+	assert len(listing.calls()) == 3
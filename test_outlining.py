@@ -0,0 +1,40 @@
+import pytest
+from emulator import Emulator
+from pipeline import Pipeline, BudgetException, compile_within_budget
+
+CODE = """var x = 1;
+var y = 2;
+while (x != 5) {
+	draw_num(x + y, 0, 0);
+	var x = x + 1;
+	draw_num(x + y, 0, 0);
+	var y = y + 2;
+}
+draw_num(x + y, 0, 0);
+"""
+
+def size(level: str) -> int:
+	pipeline = Pipeline(CODE, level=level)
+	pipeline.run()
+	return len(pipeline.emit())
+
+def test_outlining():
+	plain = Pipeline(CODE, level="2")
+	plain.run()
+	small = Pipeline(CODE, level="s")
+	small.run()
+	assert any(byte >> 4 == 0x2 for byte in small.emit()[::2])
+	assert len(small.emit()) < len(plain.emit())
+	assert Emulator(small.emit()).run(100000).display() == Emulator(plain.emit()).run(100000).display()
+
+def test_rom_budget():
+	pipeline, program = compile_within_budget(CODE, None, size("2"))
+	assert pipeline.level == "2" and program
+
+	pipeline, _ = compile_within_budget(CODE, None, size("2") - 1)
+	assert pipeline.level == "s"
+	assert len(pipeline.emit()) == size("s")
+
+	with pytest.raises(BudgetException, match="over the ROM budget of 20 bytes") as error:
+		compile_within_budget(CODE, None, 20)
+	assert "code" in str(error.value) and "variables" in str(error.value)
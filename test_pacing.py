@@ -0,0 +1,41 @@
+import pytest
+from code_generator import CYCLES_PER_TICK
+from emulator import Emulator
+from pipeline import Pipeline
+
+def build(code: str) -> Emulator:
+	pipeline = Pipeline(code)
+	pipeline.run()
+	return Emulator(pipeline.emit())
+
+def timer_sets(emulator: Emulator) -> list[tuple[int, int]]:
+	# The cycle and the delay timer at every FX15 until the program halts
+	image = emulator.memory
+	sets = []
+	while not emulator.halted:
+		if image[emulator.pc] >> 4 == 0xF and image[emulator.pc + 1] == 0x15:
+			sets.append((emulator.cycles, emulator.delay))
+		emulator.step()
+	return sets
+
+@pytest.mark.parametrize("ticks", [1, 5, 20])
+def test_wait(ticks: int):
+	# wait(n) spins on FX07 until the timer set by FX15 has ticked n times
+	base = build("wait(0);").run(10000).cycles
+	emulator = build(f"wait({ticks});").run(10000)
+	assert emulator.halted and emulator.delay == 0
+	assert abs(emulator.cycles - base - ticks * CYCLES_PER_TICK) < CYCLES_PER_TICK
+
+def test_frame():
+	# Every frame starts once the timer of the last one has run out, so short
+	# frames run once per tick
+	sets = timer_sets(build("frame { clear; } " * 10))
+	assert len(sets) == 10
+	assert all(delay == 0 for _, delay in sets)
+	assert all(later - earlier == CYCLES_PER_TICK for (earlier, _), (later, _) in zip(sets, sets[1:]))
+
+	# A body longer than a tick isn't held back any further
+	slow = "var j = 0; while (j != 30) { var j = j + 1; }"
+	paced = build(f"var i = 0; while (i != 4) {{ frame {{ {slow} var i = i + 1; }} }}").run(100000).cycles
+	unpaced = build(f"var i = 0; while (i != 4) {{ {slow} var i = i + 1; }}").run(100000).cycles
+	assert unpaced < paced < unpaced + 4 * CYCLES_PER_TICK
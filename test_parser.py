@@ -1,4 +1,8 @@
-from parser import Parser
+import pytest
+from parser import Parser, ParserException
+from lexer import Lexer
+from semantic_analyzer import SemanticAnalyzer, SemanticsException
+from abstract_syntax_tree import Identifier, Integer, walk
 
 def test_statement_parser():
 
@@ -18,3 +22,42 @@ def test_statement_parser():
 		parser = Parser(case)
 		statement = parser.parse_block()
 		assert statement.__str__() == expected
+
+def test_array_parsing():
+	parser = Parser("array taulukko = { 1, 2, 3 }; var taulukko[2 - 1] = taulukko[0] + 1;")
+	assert parser.parse_statement().__str__() == "array taulukko = { 1, 2, 3 };"
+	assert parser.parse_statement().__str__() == "var taulukko[(2 - 1)] = (taulukko[0] + 1);"
+
+def test_token_stream():
+	tokens = list(Lexer("var x = 1; x + 2;").tokens())
+	assert [statement.__str__() for statement in Parser(tokens).statements()] == ["var x = 1;", "(x + 2);"]
+
+def test_array_bounds():
+	semantic = SemanticAnalyzer()
+	parser = Parser("array taulukko = { 1, 2, 3 }; var luku = taulukko[3];")
+	semantic.analyze_statement(parser.parse_statement())
+	with pytest.raises(SemanticsException):
+		semantic.analyze_statement(parser.parse_statement())
+
+def test_sprite_sheet_frames():
+	semantic = SemanticAnalyzer()
+	statements = semantic.analyze(Parser("sprite kuvat[2] = { 1, 2, 3, 4 }; draw(kuvat[1], 0, 0); draw(kuvat[2], 0, 0);").statements())
+	assert next(statements).__str__() == "sprite kuvat[2] = { 1, 2, 3, 4 };"
+	assert next(statements).__str__() == "draw(kuvat[1], 0, 0);"
+	with pytest.raises(SemanticsException):
+		next(statements)
+	with pytest.raises(SemanticsException):
+		SemanticAnalyzer().analyze_statement(Parser("sprite kuvat[3] = { 1, 2, 3, 4 };").parse_statement())
+
+def test_walk():
+	statement = Parser("if (x + t[1]) { draw(s, 2, y); }").parse_statement()
+	nodes = [node.__str__() for node in walk(statement) if isinstance(node, (Identifier, Integer))]
+	assert nodes == ["x", "t", "1", "s", "2", "y"]
+	# Nodes have no instance dictionary
+	assert not hasattr(statement, "__dict__") and not hasattr(statement.token, "__dict__")
+
+def test_logical_operators():
+	statement = Parser("if (!x == 1 || y && z != 2) { clear; }").parse_statement()
+	assert statement.condition.__str__() == "(((!x) == 1) || (y && (z != 2)))"
+	with pytest.raises(ParserException):
+		Parser("if (x & y) { clear; }").parse_statement()
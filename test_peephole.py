@@ -0,0 +1,31 @@
+from code_generator import Instruction, INSTRUCTION_LENGTH
+from peephole import Peephole, encode
+
+def test_peephole_rules():
+	instructions = [
+		Instruction(op=0x6, x=1, kk=5),
+		Instruction(op=0x6, x=1, kk=7),
+		Instruction(op=0x8, x=2, y=2, n=0),
+		Instruction(op=0x1, nnn=INSTRUCTION_LENGTH),
+		Instruction(op=0x1, nnn=0),
+	]
+	peephole = Peephole()
+	optimized = peephole.run(instructions)
+	assert [encode(instruction) for instruction in optimized] == [0x6107, 0x1000]
+	assert peephole.fired["overwritten-load"] == 1
+	assert peephole.fired["self-move"] == 1
+	assert peephole.fired["jump-to-next"] == 1
+
+def test_peephole_barriers():
+	instructions = [
+		# A skip only skips one instruction, so the loads after it must stay apart
+		Instruction(op=0x3, x=1, kk=0),
+		Instruction(op=0x6, x=2, kk=1),
+		Instruction(op=0x6, x=2, kk=2),
+		# The second load is a jump target
+		Instruction(op=0x6, x=3, kk=1),
+		Instruction(op=0x6, x=3, kk=2),
+		Instruction(op=0x1, nnn=INSTRUCTION_LENGTH * -1),
+	]
+	optimized = Peephole().run(instructions)
+	assert [encode(instruction) for instruction in optimized] == [0x3100, 0x6201, 0x6202, 0x6301, 0x6302, 0x1FFE]
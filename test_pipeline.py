@@ -0,0 +1,21 @@
+from pipeline import Pipeline
+
+CODE = "sprite s = { 1, 2 }; var x = 1; while (x != 10) { draw(s, x, x); var x = x + 1; }"
+
+def test_stages():
+	pipeline = Pipeline(CODE)
+	program = pipeline.run()
+	assert len(program) == 3
+	assert list(pipeline.timings) == ["lex", "parse", "analyze", "optimize", "generate", "finish", "emit"]
+	image = pipeline.emit()
+	assert image[:2] == b'\x00\xe0'
+	assert image.endswith(b'\x01\x02')
+
+def test_single_pass():
+	whole = Pipeline(CODE)
+	whole.run()
+	streamed = Pipeline(CODE, single_pass=True)
+	assert len(streamed.run()) == 3
+	# Both builds lay out the same data, and seeing the whole program never costs code
+	assert streamed.emit()[-3:] == whole.emit()[-3:]
+	assert len(whole.generator.main) <= len(streamed.generator.main)
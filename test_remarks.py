@@ -0,0 +1,32 @@
+import json
+from execution_profile import Profile
+from pipeline import Pipeline
+from remarks import Remarks
+
+CODE = """var x = 3;
+var y = 0;
+while (y != 200) {
+	var y = y + x * 4;
+	draw_num(y, 0, 0);
+}
+"""
+
+def test_remarks():
+	pipeline = Pipeline(CODE)
+	program = pipeline.run()
+	remarks = Remarks(pipeline, program)
+	data = json.loads(remarks.json())
+	assert data["variables"] == {"x": "kept in memory, there is no profile", "y": "kept in memory, there is no profile"}
+	assert data["loops"] == {"3": "left alone, there is no profile"}
+	assert data["register_pressure"]["lines"]["4"] >= 3
+	assert sum(data["instructions"].values()) == len(pipeline.generator.main)
+	assert sum(data["bytes"].values()) == len(pipeline.emit())
+	assert "never rotated:\n  line 3: left alone, there is no profile" in remarks.text()
+
+def test_remarks_with_profile():
+	pipeline = Pipeline(CODE, profile=Profile({1: 1, 2: 1, 3: 50, 4: 50, 5: 50}))
+	program = pipeline.run()
+	data = Remarks(pipeline, program).data()
+	assert data["variables"]["y"].startswith("promoted to V")
+	assert data["loops"] == {"3": "unrolled once"}
+	assert data["register_pressure"]["available"] == 14 - len(pipeline.generator.promoted)
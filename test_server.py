@@ -0,0 +1,37 @@
+import os
+import threading
+
+from pipeline import Pipeline
+from server import CompileServer, compile_remote, request
+from targets import SCHIP
+
+CODE = "sprite s = { 1, 2 }; var x = 1; while (x != 10) { draw(s, x, x); var x = x + 1; }"
+
+def test_compile_server(tmp_path):
+	socket_path = os.path.join(tmp_path, "compiler.sock")
+	server = CompileServer(socket_path, workers=2)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.start()
+	try:
+		good, bad = compile_remote(socket_path, [(CODE, None), ("var x = y;", None)])
+		pipeline = Pipeline(CODE)
+		pipeline.run()
+		assert good["ok"] and good["rom"] == pipeline.emit()
+		assert not bad["ok"] and "1:9" in bad["errors"][0]
+
+		stats = request(socket_path, {"stats": True})
+		assert stats["requests"] == 1
+		assert stats["sources"] == 2
+		assert stats["failures"] == 1
+		assert request(socket_path, {"files": []})["error"].startswith("Invalid request")
+
+		# Sources can ask for another level and target than the server's
+		scrolled, = compile_remote(socket_path, [(CODE + " scroll(right);", None)], level="0", target="schip")
+		pipeline = Pipeline(CODE + " scroll(right);", level="0", target=SCHIP)
+		pipeline.run()
+		assert scrolled["ok"] and scrolled["rom"] == pipeline.emit()
+		assert request(socket_path, {"sources": [{"code": CODE, "target": "nes"}]})["error"].startswith("Invalid request")
+	finally:
+		server.shutdown()
+		server.server_close()
+		thread.join()
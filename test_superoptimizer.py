@@ -0,0 +1,54 @@
+import json
+
+from superoptimizer import Target, targets, execute
+import pipeline
+from peephole import Peephole, REWRITE_TABLE, RULES
+from pipeline import Pipeline
+from emulator import Emulator
+
+def test_search():
+	multiply = next(target for target in targets() if target.name == "multiply-by-4")
+	assert multiply.search() == ["8zx0", "8zx4", "8zZ4"]
+	assert execute(["8zx0", "8zx4", "8zZ4"], {"x": 7, "z": 0, "F": 0}) == ({"x": 7, "z": 28, "F": 0}, False)
+
+	branch = Target("test", ["5xy0", "1006", "6z01", "1004", "6z00", "4z00"], ["F", "z"])
+	assert branch.search() == ["5xy0"]
+
+def test_rewrite_table():
+	with open(REWRITE_TABLE, "r") as file:
+		rules = json.load(file)["rules"]
+	assert {rule["name"] for rule in rules} <= {rule.name for rule in RULES}
+	found = {target.name: target for target in targets()}
+	for rule in rules:
+		target = found[rule["name"]]
+		assert len(rule["replacement"]) < len(rule["pattern"])
+		for state, keys in target.samples(64):
+			assert target.outcome(rule["replacement"], state, keys) == target.outcome(target.pattern, state, keys)
+	assert found["equal-constant"].verify(["6z00", "4xkk", "6z01"])
+
+def test_table_in_pipeline(monkeypatch):
+	code = """var x = 3;
+var y = 0;
+while (y != 20) {
+	if (x == 3) {
+		var y = y + 1;
+	}
+	var x = x + y * 4;
+}
+draw_num(x, 0, 0);
+"""
+	optimized = Pipeline(code)
+	optimized.run()
+	assert "Peephole rule 'multiply-by-4' fired 1 times" in "\n".join(optimized.reports)
+
+	# The same program without the rules from the table
+	found = {target.name for target in targets()}
+	monkeypatch.setattr(pipeline, "Peephole", lambda rules: Peephole([rule for rule in rules if rule.name not in found]))
+	plain = Pipeline(code)
+	plain.run()
+
+	before = Emulator(plain.emit()).run(100000)
+	after = Emulator(optimized.emit()).run(100000)
+	assert before.halted and after.halted
+	assert after.display() == before.display()
+	assert len(optimized.emit()) < len(plain.emit())
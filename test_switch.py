@@ -0,0 +1,51 @@
+import pytest
+from emulator import Emulator
+from pipeline import Pipeline, OPTIMIZATION_LEVELS
+from semantic_analyzer import SemanticsException
+from targets import CHIP8, SCHIP
+
+def counting(statement: str) -> str:
+	# Adds something different to the total for every case and 1 otherwise
+	return f"""var x = 0;
+var total = 0;
+while (x != 40) {{
+	{statement}
+	var x = x + 1;
+}}
+draw_num(total, 0, 0);
+"""
+
+def switch(cases: list[int]) -> str:
+	branches = " ".join(f"case {case}: {{ var total = total + {number + 2}; }}" for number, case in enumerate(cases))
+	return f"switch (x) {{ {branches} default: {{ var total = total + 1; }} }}"
+
+def if_chain(cases: list[int]) -> str:
+	code = "var total = total + 1;"
+	for number, case in reversed(list(enumerate(cases))):
+		code = f"if (x == {case}) {{ var total = total + {number + 2}; }} else {{ {code} }}"
+	return code
+
+def display(code: str, level: str, target = CHIP8) -> str:
+	pipeline = Pipeline(code, level=level, target=target)
+	pipeline.run()
+	return Emulator(pipeline.emit(), target=target).run(200000).display()
+
+@pytest.mark.parametrize("cases, table", [([3, 4, 5, 7, 8], True), ([0, 1, 2, 3], True), ([1, 9, 17, 30, 33, 38], False), ([6], False)])
+def test_switch(cases: list[int], table: bool):
+	pipeline = Pipeline(counting(switch(cases)))
+	pipeline.run()
+	assert any(byte >> 4 == 0xB for byte in pipeline.emit()[::2]) == table
+	for level in OPTIMIZATION_LEVELS:
+		assert display(counting(switch(cases)), level) == display(counting(if_chain(cases)), level)
+
+def test_switch_jump_quirk():
+	# SUPER-CHIP adds VX in BXNN, so a dense switch mustn't jump through V0
+	cases = [3, 4, 5, 7, 8]
+	pipeline = Pipeline(counting(switch(cases)), target=SCHIP)
+	pipeline.run()
+	assert not any(byte >> 4 == 0xB for byte in pipeline.emit()[::2])
+	assert display(counting(switch(cases)), "2", SCHIP) == display(counting(if_chain(cases)), "2")
+
+def test_duplicate_case():
+	with pytest.raises(SemanticsException):
+		Pipeline("var x = 1; switch (x) { case 1: { clear; } case 1: { clear; } }").run()
@@ -0,0 +1,48 @@
+import pytest
+from pipeline import Pipeline
+from emulator import Emulator
+from linker import LinkerException
+from semantic_analyzer import SemanticsException
+from targets import CHIP8, SCHIP, XOCHIP
+
+def build(code: str, target) -> Pipeline:
+	pipeline = Pipeline(code, target=target)
+	pipeline.run()
+	return pipeline
+
+def screen(pipeline: Pipeline) -> str:
+	return Emulator(pipeline.emit(), target=pipeline.target).run(10000).display()
+
+def test_ranged_memory():
+	code = "array a = { 1, 2, 3 }; var i = 1; var x = a[i] + 4; var a[i] = x; draw_num(a[i], 0, 0); draw_num(x, 0, 8);"
+	base = build(code, CHIP8)
+	extended = build(code, XOCHIP)
+	assert len(extended.emit()) < len(base.emit())
+	assert any(instruction.op == 0x5 and instruction.n == 3 for instruction in extended.generator.main)
+	assert screen(extended) == screen(base)
+
+def test_wide_sprites_and_scrolling():
+	rows = ", ".join(["65535"] + ["32769"] * 14 + ["65535"])
+	code = f"sprite box = {{ {rows} }}; draw(box, 0, 0); scroll(right); scroll(down, 1);"
+	lines = screen(build(code, SCHIP)).splitlines()
+	assert lines[0] == "." * 64
+	assert lines[1] == "...." + "#" * 16 + "." * 44
+	assert lines[2] == "....#" + "." * 14 + "#" + "." * 44
+
+	with pytest.raises(SemanticsException):
+		build(code, CHIP8)
+	with pytest.raises(SemanticsException):
+		build("scroll(up, 1);", SCHIP)
+
+def test_long_index():
+	arrays = "".join(f"array {name} = {{ {", ".join(["7"] * 250)} }};" for name in "abcdefghijklmnopqrst")
+	reads = "".join(f"draw_num({name}[3], 0, 0);" for name in "abcdefghijklmnopqrst")
+	code = f"{arrays}{reads}clear;draw_num(t[3], 0, 0);"
+	pipeline = build(code, XOCHIP)
+	image = pipeline.emit()
+	assert len(image) > 4096
+	assert b"\xf0\x00" in image
+	assert screen(pipeline) == screen(build("draw_num(7, 0, 0);", CHIP8))
+
+	with pytest.raises(LinkerException):
+		build(code, SCHIP).emit()
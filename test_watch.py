@@ -0,0 +1,47 @@
+from emulator import Emulator
+from targets import SCHIP
+from watch import IncrementalCompiler, split_statements
+
+def test_split_statements():
+	code = 'sprite s = { 1, 2 };\nif (1) { clear; } else { clear; }\nwhile (0) { var x = 1; } import "a.c8c"; var y = 2'
+	assert [text for _, text in split_statements(code)] == [
+		"sprite s = { 1, 2 };",
+		"if (1) { clear; } else { clear; }",
+		"while (0) { var x = 1; }",
+		'import "a.c8c";',
+		"var y = 2",
+	]
+
+def test_incremental_build():
+	compiler = IncrementalCompiler("peli.c8c")
+	code = "sprite s = { 1, 2 };\nvar x = 1;\nwhile (x != 9) { draw(s, x, 0); var x = x + 1; }\nclear;"
+	image = compiler.build(code)
+	assert compiler.regenerated == 4
+
+	assert compiler.build(code) == image
+	assert compiler.regenerated == 0
+
+	# Only the edited statement is compiled again
+	compiler.build(code.replace("var x = 1;", "var x = 2;"))
+	assert compiler.regenerated == 1
+
+	compiler.build(code)
+	# A different sprite height changes the draws that use it
+	compiler.build(code.replace("{ 1, 2 }", "{ 1, 2, 3 }"))
+	assert compiler.regenerated == 2
+
+def test_moved_statement_positions():
+	compiler = IncrementalCompiler("peli.c8c")
+	compiler.build("var x = 1;")
+	compiler.build("\n\n  var x = 1;")
+	token = compiler.statements["var x = 1;"].tokens[1]
+	assert (token.line, token.column) == (3, 7)
+
+def test_level_and_target():
+	code = "sprite s = { 1, 2 };\nvar x = 1 + 2;\ndraw(s, x, 0);\nscroll(right);"
+	compiler = IncrementalCompiler("peli.c8c", "0", SCHIP)
+	image = compiler.build(code)
+	assert b"\x00\xfb" in image
+	assert len(image) > len(IncrementalCompiler("peli.c8c", "2", SCHIP).build(code))
+	screen = Emulator(image, target=SCHIP).run(10000).display()
+	assert screen.splitlines()[0].startswith("." * 14 + "#")
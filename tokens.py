@@ -4,25 +4,36 @@ from enum import Enum
 class TokenType(Enum):
 	VAR = "VAR"
 	SPRITE = "SPRITE"
+	ARRAY = "ARRAY"
 	DRAW = "DRAW"
 	DRAW_NUM = "DRAW_NUM"
 	DRAW_CHAR = "DRAW_CHAR"
+	MOVE = "MOVE"
 	PRESSED = "PRESSED"
 	NOT_PRESSED = "NOT_PRESSED"
 	UNTIL_PRESSED = "UNTIL_PRESSED"
 	CLEAR = "CLEAR"
+	SCROLL = "SCROLL"
 	IF = "IF"
 	ELSE = "ELSE"
 	WHILE = "WHILE"
+	SWITCH = "SWITCH"
+	CASE = "CASE"
+	DEFAULT = "DEFAULT"
+	FRAME = "FRAME"
+	WAIT = "WAIT"
+	IMPORT = "IMPORT"
 	#MAIN = "MAIN"
 
 	INT = "INT"
 	IDENT = "IDENT"
+	STRING = "STRING"
 
 	EOF = "EOF"
 	ILLEGAL = "ILLEGAL"
 
 	SEMICOLON = ";"
+	COLON = ":"
 	COMMA = ","
 
 	LBRACE = "{"
@@ -41,9 +52,12 @@ class TokenType(Enum):
 	NOT = "!"
 	EQUALS = "=="
 	NOT_EQUALS = "!="
+	AND = "&&"
+	OR = "||"
 
 
 class Token:
+	__slots__ = ("type", "literal", "line", "column")
 	def __init__(self, type: TokenType, literal: str, line: int, column: int):
 		self.type = type
 		self.literal = literal
@@ -57,15 +71,24 @@ class Token:
 keywords = {
 	"var": TokenType.VAR,
 	"sprite": TokenType.SPRITE,
+	"array": TokenType.ARRAY,
 
 	"draw": TokenType.DRAW,
 	"draw_num": TokenType.DRAW_NUM,
 	"draw_char": TokenType.DRAW_CHAR,
+	"move": TokenType.MOVE,
 	"clear": TokenType.CLEAR,
+	"scroll": TokenType.SCROLL,
 
 	"if": TokenType.IF,
 	"else": TokenType.ELSE,
 	"while": TokenType.WHILE,
+	"switch": TokenType.SWITCH,
+	"case": TokenType.CASE,
+	"default": TokenType.DEFAULT,
+	"frame": TokenType.FRAME,
+	"wait": TokenType.WAIT,
+	"import": TokenType.IMPORT,
 
 	"pressed": TokenType.PRESSED,
 	"not_pressed": TokenType.NOT_PRESSED,
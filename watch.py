@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from tokens import Token, TokenType
+from lexer import Lexer
+from parser import Parser, ParserException
+from abstract_syntax_tree import Statement, If, While, Switch, ExpressionStatement, IntegerDeclaration, SpriteDeclaration, ArrayDeclaration, ArrayAssignment
+from dead_code import read_names, inner_blocks
+from code_generator import CodeGenerator
+from control_flow import ControlFlowGraph
+from peephole import Peephole, RULES, HAND_WRITTEN_RULES
+from code_buffer import CodeBuffer
+from linker import ObjectFile, Linker, assemble, describe
+from pipeline import Pipeline
+from targets import Target, CHIP8
+
+# A block ends its statement unless one of these follows it
+CONTINUES = re.compile(r"\s*(;|else\b)")
+
+def split_statements(code: str) -> list[tuple[int, str]]:
+	# Finds the source text of every top-level statement without lexing it.
+	# Returns the offset where each statement starts and its text
+	statements = []
+	depth = 0
+	start = None
+	position = 0
+	while position < len(code):
+		char = code[position]
+		if start is None and not char.isspace():
+			start = position
+		if char == '"':
+			end = code.find('"', position + 1)
+			position = len(code) if end < 0 else end
+		elif char == "{":
+			depth += 1
+		elif char == "}":
+			depth -= 1
+		if depth == 0 and start is not None and (char == ";" or char == "}" and not CONTINUES.match(code, position + 1)):
+			statements.append((start, code[start:position + 1]))
+			start = None
+		position += 1
+	if start is not None:
+		statements.append((start, code[start:]))
+	return statements
+
+def statement_names(statement: Statement) -> set[str]:
+	names = set()
+	match statement:
+		case IntegerDeclaration():
+			names = {statement.ident.name} | read_names(statement.expression)
+		case ArrayAssignment():
+			names = read_names(statement.target) | read_names(statement.expression)
+		case ExpressionStatement():
+			names = read_names(statement.expression)
+		case If() | While():
+			names = read_names(statement.condition)
+		case Switch():
+			names = read_names(statement.value)
+		case SpriteDeclaration() | ArrayDeclaration():
+			names = {statement.ident.name}
+	for block in inner_blocks(statement):
+		for inner in block.statements:
+			names |= statement_names(inner)
+	return names
+
+class CachedStatement:
+	def __init__(self, tokens: list[Token], statement: Statement):
+		self.tokens = tokens
+		# Token positions relative to the start of the statement
+		self.positions = [(token.line, token.column) for token in tokens]
+		self.statement = statement
+
+	def place(self, line: int, column: int):
+		# Moves the tokens to where the statement is in the current source
+		for token, (relative_line, relative_column) in zip(self.tokens, self.positions):
+			token.line = line + relative_line - 1
+			token.column = relative_column + (column - 1 if relative_line == 1 else 0)
+
+class IncrementalCompiler:
+	"""
+	Keeps the tokens and syntax tree of every top-level statement and the code
+	generated for it, keyed by the text of the statement. Code is also keyed by
+	the symbols the statement uses, so a statement is only regenerated when it
+	changes or when a declaration it depends on changes. Every statement is
+	compiled like a small module and the linker puts them together, so values
+	are not reused from one statement to the next and no dead code is removed.
+	The machine level passes of the optimization level still run on every
+	statement, except outlining, as statements fall through to the next one.
+	"""
+	def __init__(self, path: str, level: str = "2", target: Target = CHIP8):
+		self.path = path
+		self.level = level
+		self.target = target
+		self.statements: dict[str, CachedStatement] = {}
+		self.chunks: dict[str, ObjectFile] = {}
+		self.regenerated = 0
+		self.reused = 0
+		self.modules: set[str] = set()
+
+	def parse(self, text: str, line: int, column: int) -> Statement:
+		cached = self.statements.get(text)
+		if not cached:
+			tokens = list(Lexer(text).tokens())
+			parser = Parser(tokens)
+			statement = parser.parse_statement()
+			if parser.current_token.type is not TokenType.EOF:
+				token = parser.current_token
+				raise ParserException(f"Expected the statement to end before {token} at {token.line}:{token.column}")
+			cached = CachedStatement(tokens, statement)
+		cached.place(line, column)
+		self.statements[text] = cached
+		return cached.statement
+
+	def generate(self, statement: Statement, pipeline: Pipeline, declared: list[str], line: int) -> ObjectFile:
+		generator = CodeGenerator(pipeline.semantic, level=self.level, target=self.target)
+		generator.generate_statement(statement)
+		generator.finish()
+		instructions = generator.main
+		if self.level in ("2", "s"):
+			instructions = ControlFlowGraph(instructions).instructions()
+		if self.level != "0":
+			instructions = Peephole(RULES if self.level in ("2", "s") else HAND_WRITTEN_RULES).run(instructions)
+		symbols = {name: describe(pipeline.semantic.symbols[name], generator.sprites.get(name) or generator.arrays.get(name)) for name in declared}
+		return ObjectFile(f"line {line}", assemble(instructions), symbols)
+
+	def build(self, code: str) -> bytes:
+		pipeline = Pipeline(code, self.path, level=self.level, target=self.target)
+		semantic = pipeline.semantic
+		statements: dict[str, CachedStatement] = {}
+		chunks: dict[str, ObjectFile] = {}
+		objects = []
+		self.regenerated = 0
+		self.reused = 0
+		for start, text in split_statements(code):
+			line = code.count("\n", 0, start) + 1
+			column = start - code.rfind("\n", 0, start)
+			statement = self.parse(text, line, column)
+			statements[text] = self.statements[text]
+
+			before = set(semantic.symbols)
+			if not list(pipeline.analyze([statement])):
+				# Imports only bring in symbols and the code of the module
+				continue
+			declared = [name for name in semantic.symbols if name not in before]
+			signature = {name: describe(semantic.symbols[name], b'') | {"declared": name in declared} for name in sorted(statement_names(statement))}
+			key = hashlib.sha256(f"{text}\n{json.dumps(signature, sort_keys=True)}".encode()).hexdigest()
+			chunk = self.chunks.get(key)
+			if chunk:
+				self.reused += 1
+			else:
+				chunk = self.generate(statement, pipeline, declared, line)
+				self.regenerated += 1
+			chunks[key] = chunk
+			objects.append(chunk)
+
+		# Only what the current source uses is kept
+		self.statements = statements
+		self.chunks = chunks
+		self.modules = set(pipeline.modules)
+		end = ObjectFile("end", CodeBuffer(), {})
+		end.code.halt()
+		return Linker(pipeline.objects + objects + [end], self.target).link()
+
+def watch(path: str, output: str, interval: float = 0.2, level: str = "2", target: Target = CHIP8):
+	compiler = IncrementalCompiler(path, level, target)
+	modified: dict[str, int] = {}
+	print(f"Watching {path}, press Ctrl+C to stop")
+	while True:
+		files = {path} | compiler.modules
+		current = {}
+		for file in files:
+			try:
+				current[file] = os.stat(file).st_mtime_ns
+			except OSError:
+				pass
+		if current != modified:
+			modified = current
+			start = time.perf_counter()
+			try:
+				with open(path, "r") as file:
+					image = compiler.build(file.read())
+				with open(output, "wb") as file:
+					file.write(image)
+				milliseconds = (time.perf_counter() - start) * 1000
+				print(f"Rebuilt {output} in {milliseconds:.1f} ms, regenerated {compiler.regenerated} and reused {compiler.reused} statements")
+			except Exception as exception:
+				print(f"Error: {exception}")
+		time.sleep(interval)